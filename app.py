@@ -6,29 +6,142 @@ import numpy as np
 from plotly import graph_objs as go
 import os
 
-from wrangling import create_big_df
+from wrangling import create_big_df, bigframe_version, BIGFRAME_PATH, BIGFRAME_VERSION
+from snapshot import load_snapshot, write_snapshot, snapshot_version, SNAPSHOT_DIR, SNAPSHOT_VERSION
+from filtering import encode_dimensions, is_all
+from partitions import PartitionedDataset, InMemoryDataset, write_partitions, partition_version, PARTITION_VERSION
+from figcache import FigureCache, SqliteBackend, file_version
+from summaries import group_summaries, concat_summaries, violin_traces
+from spatial import viewport_from_relayout, snap_viewport, grid_clusters, cluster_cell_deg
+from metrics import CallbackMetrics
+from warmup import CacheWarmer, common_views
+from payloads import encode_figure, encode_text
+from routes import RouteLayer, ROUTE_LAYER_PATH, ROUTE_LAYER_VERSION, SOURCE_COLUMNS
+from export import Exporter
+from compact import MARKER_SIZE_COLUMNS, HOVER_TEXT_COLUMN
+
+SLICER_COLUMNS = ['route_type', 'county_name', 'route', 'year']
 
 ## read the data in and process
-if not os.path.isfile('./data/bigframe.pkl'):
-    create_big_df() 
-
-traffic_df = pd.read_pickle('./data/bigframe.pkl')
+# set PARTITION_DIR to query a dataset partitioned by year and county, reading only the
+# partitions and columns each callback needs, instead of mapping the whole frame into
+# every worker. it's copied from bigframe.pkl if it isn't there yet and the pickle was
+# written by the current version, otherwise it's rebuilt along with bigframe.pkl from
+# the per-year cache. builds at import time read the years serially: with the spawn
+# start method (windows, macos) a process pool would re-import this module in every
+# child. run `python wrangling.py` beforehand to read them in parallel
+partition_dir = os.environ.get('PARTITION_DIR')
+if partition_dir:
+    partition_meta = os.path.join(partition_dir, 'meta.json')
+    version = partition_version(partition_dir)
+    if version is None and bigframe_version() == BIGFRAME_VERSION:
+        write_partitions(pd.read_pickle(BIGFRAME_PATH), partition_dir)
+    elif version != PARTITION_VERSION:
+        create_big_df(workers=1, snapshot_dir=None, partition_dir=partition_dir)
+    dataset = PartitionedDataset(partition_dir)
+    data_files = [partition_meta]
+else:
+    version = snapshot_version()
+    if version is None and bigframe_version() == BIGFRAME_VERSION:
+        write_snapshot(pd.read_pickle(BIGFRAME_PATH))
+    elif version != SNAPSHOT_VERSION:
+        create_big_df(workers=1)
+
+    # memory-mapped read-only, so every gunicorn worker shares the same pages. filters
+    # go through a row-id index, and a lat/long grid pulls the stations in the map's viewport
+    traffic_df = load_snapshot()
+    dataset = InMemoryDataset(traffic_df, SLICER_COLUMNS)
+    data_files = [BIGFRAME_PATH, os.path.join(SNAPSHOT_DIR, 'meta.json')]
+
+# the distinct slicer combinations that assets/slicers.js narrows the dropdown options
+# with in the browser
+slicer_dims = dataset.dimension_table(['county_name', 'route_type', 'route'])
+
+# the map shows the newest year's counts
+MAP_YEAR = int(dataset.value_counts('year').index.max())
+
+# the map year's route lines, simplified for each zoom range. create_big_df writes them,
+# they're built here from the map year's rows if they're missing or out of date
+if RouteLayer.version(ROUTE_LAYER_PATH) != ROUTE_LAYER_VERSION:
+    RouteLayer.build(dataset.read({'year': [MAP_YEAR]}, columns=SOURCE_COLUMNS)).save(ROUTE_LAYER_PATH)
+route_layer = RouteLayer.load(ROUTE_LAYER_PATH)
+data_files.append(ROUTE_LAYER_PATH)
+
+# above this many stations in view, the map draws grid clusters instead of single markers
+MAX_MAP_POINTS = int(os.environ.get('MAX_MAP_POINTS', 5000))
+DEFAULT_ZOOM = 6.6
+
+# memoize the figure callbacks. entries are tagged with the data files' mtimes, so a
+# rebuild invalidates them. set FIGURE_CACHE_DB to share hits between gunicorn workers
+figure_cache_db = os.environ.get('FIGURE_CACHE_DB')
+figure_cache_ttl = os.environ.get('FIGURE_CACHE_TTL')
+figure_cache_ttl = float(figure_cache_ttl) if figure_cache_ttl else None
+figure_cache = FigureCache(
+    version=file_version(*data_files),
+    maxsize=int(os.environ.get('FIGURE_CACHE_SIZE', 128)),
+    ttl=figure_cache_ttl,
+    # the shared entries expire too, or an expired in-memory entry is refetched from them
+    backend=SqliteBackend(figure_cache_db, ttl=figure_cache_ttl) if figure_cache_db else None
+)
+# per-year violin summaries of the unfiltered and single slicer views, small enough to keep them all
+summary_cache = FigureCache(version=figure_cache.version, maxsize=4096)
+
+# per-callback phase timings, row counts and response sizes, served on /metrics. set
+# SLOW_CALLBACK_MS to keep sampled stack profiles of slower calls, served on /metrics/slow
+slow_callback_ms = os.environ.get('SLOW_CALLBACK_MS')
+callback_metrics = CallbackMetrics(slow_seconds=float(slow_callback_ms) / 1000 if slow_callback_ms else None)
+callback_metrics.register_cache('figure', figure_cache)
+callback_metrics.register_cache('summary', summary_cache)
+
+# column plotted for each value of the scale radio items
+SCALE_COLUMNS = {
+    'AADT': 'average_daily_traffic',
+    'Log10AADT': 'log10_adt',
+    'Percent Change': 'total_pct_change',
+    'Trend': 'trend_growth'
+}
+
+# colour range of each scale over the whole map year, for views without any stations in them
+SCALE_RANGES = {}
+for scale, column in SCALE_COLUMNS.items():
+    values = dataset.read({'year': [MAP_YEAR]}, columns=[column])[column].values
+    SCALE_RANGES[scale] = (float(np.nanmin(values)), float(np.nanmax(values)))
+
+# colorbar title of each scale
+SCALE_TITLES = {
+    'AADT': 'Average Daily Traffic',
+    'Log10AADT': 'Log10(Average Daily Traffic)',
+    'Percent Change': 'Total Pct Change',
+    'Trend': 'Trend (% per year)'
+}
+
+# columns the map reads besides the plotted one and its marker sizes, precomputed by compact_frame
+MAP_COLUMNS = ['latitude', 'longitude', 'route', 'route_leg_descrip', HOVER_TEXT_COLUMN]
 
 # create the dash app
 mapboxkey = os.environ.get('MAPBOX_KEY')
 # external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
-app = dash.Dash(__name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}])
+# gzip the responses, newer dash versions no longer do by default
+app = dash.Dash(__name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}], compress=True)
 server = app.server
+callback_metrics.attach(server)
+
+# read-only bulk export of the filtered rows on /export, streamed as csv or binary a
+# batch at a time. at most MAX_EXPORTS run at once in each worker process, each holding
+# a thread, so with the Procfile's threaded workers they can't hold up the dashboard
+exporter = Exporter(dataset, SCALE_COLUMNS, max_exports=int(os.environ.get('MAX_EXPORTS', 2)))
+exporter.attach(server)
+callback_metrics.register_gauges('export', exporter.progress)
 
 # slicer values 
-route_dict = [{'label': i, 'value': i} for i in sorted(traffic_df.route_type.unique())]
+route_dict = [{'label': i, 'value': i} for i in sorted(slicer_dims.route_type.unique())]
 route_dict.insert(0, {'label': 'ALL', 'value': 'ALL'})
 
-county_dict = [{'label': i, 'value': i} for i in sorted(traffic_df.county_name.unique())]
+county_dict = [{'label': i, 'value': i} for i in sorted(slicer_dims.county_name.unique())]
 county_dict.insert(0, {'label': 'ALL', 'value': 'ALL'})
 
-route_name_dict = [{'label': i, 'value': i} for i in sorted(traffic_df.route.unique())]
+route_name_dict = [{'label': i, 'value': i} for i in sorted(slicer_dims.route.unique())]
 route_name_dict.insert(0, {'label': 'ALL', 'value': 'ALL'})
 
 
@@ -36,6 +149,7 @@ route_name_dict.insert(0, {'label': 'ALL', 'value': 'ALL'})
 app.layout = html.Div(
     className="row",
     children=[
+        dcc.Store(id='slicer-dims', data=encode_dimensions(slicer_dims)),
         html.Div(
             className="slicer-div three columns",
             children=[
@@ -89,12 +203,27 @@ app.layout = html.Div(
                         options=[
                             {'label': 'AADT', 'value': 'AADT'},
                             {'label': 'Log10AADT', 'value': 'Log10AADT'},
-                            {'label': 'Total Percent Change', 'value': 'Percent Change'}
+                            {'label': 'Total Percent Change', 'value': 'Percent Change'},
+                            {'label': 'Trend (% per year)', 'value': 'Trend'}
                         ],
                         value='Log10AADT'
                         )  
                     ]
                 ),
+                html.Div(
+                    className="radio-div row",
+                    children=[
+                        html.P('Map Layer'),
+                        dcc.RadioItems(
+                        id='map-layer',
+                        options=[
+                            {'label': 'Stations', 'value': 'stations'},
+                            {'label': 'Routes', 'value': 'routes'}
+                        ],
+                        value='stations'
+                        )  
+                    ]
+                ),
                 html.Div(
                     className="radio-div row",
                     children=[
@@ -115,170 +244,180 @@ app.layout = html.Div(
             className="charts-div nine columns bg-grey",
             children=[
                 dcc.Graph(id='scatter-geo'),
-                dcc.Graph(id='year-plot')
+                dcc.Graph(id='year-plot'),
+                # update_map sends encoded figures here, assets/payloads.js decodes them into the map
+                dcc.Store(id='scatter-geo-payload')
             ]
         )
     ]
 )
 
-# update route names with slicer values
-@app.callback(
+# narrow each slicer's options to what the other two allow, in the browser
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='slicers', function_name='route_names'),
     dash.dependencies.Output("route-names", "options"),
     [dash.dependencies.Input('route-types', 'value'),
-    dash.dependencies.Input("county-names", "value")]
+    dash.dependencies.Input("county-names", "value")],
+    [dash.dependencies.State('slicer-dims', 'data')]
 )
-def update_route_names(route_type, county_name):
-
-    if len(route_type) < 1 or route_type==['ALL']:
-        route_type = list(traffic_df.route_type.unique())
-
-    if len(county_name) < 1 or county_name==['ALL']:
-        county_name = list(traffic_df.county_name.unique())
-    
-    route_type_mask = traffic_df.route_type.isin(route_type)
-    county_mask = traffic_df.county_name.isin(county_name)
-    filter_mask = route_type_mask & county_mask
-    df = traffic_df[filter_mask]
-    
-    route_name_dict = [{'label': i, 'value': i} for i in sorted(df.route.unique())]
-    route_name_dict.insert(0, {'label': 'ALL', 'value': 'ALL'})
 
-    return route_name_dict
-
-# update route types with other slicer values
-@app.callback(
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='slicers', function_name='route_types'),
     dash.dependencies.Output("route-types", "options"),
     [dash.dependencies.Input('route-names', 'value'),
-    dash.dependencies.Input("county-names", "value")]
+    dash.dependencies.Input("county-names", "value")],
+    [dash.dependencies.State('slicer-dims', 'data')]
 )
-def update_route_types(route_name, county_name):
-
-    if len(route_name) < 1 or route_name==['ALL']:
-        route_name = list(traffic_df.route.unique())
 
-    if len(county_name) < 1 or county_name==['ALL']:
-        county_name = list(traffic_df.county_name.unique())
-    
-    route_mask = traffic_df.route.isin(route_name)
-    county_mask = traffic_df.county_name.isin(county_name)
-    filter_mask = route_mask & county_mask
-    df = traffic_df[filter_mask]
-    
-    route_dict = [{'label': i, 'value': i} for i in sorted(df.route_type.unique())]
-    route_dict.insert(0, {'label': 'ALL', 'value': 'ALL'})
-
-    return route_dict
-
-# update county names with other slicer values
-@app.callback(
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='slicers', function_name='counties'),
     dash.dependencies.Output("county-names", "options"),
     [dash.dependencies.Input('route-names', 'value'),
-    dash.dependencies.Input("route-types", "value")]
+    dash.dependencies.Input("route-types", "value")],
+    [dash.dependencies.State('slicer-dims', 'data')]
 )
-def update_county(route_name, route_type):
-
-    if len(route_name) < 1 or route_name==['ALL']:
-        route_name = list(traffic_df.route.unique())
-
-    if len(route_type) < 1 or route_type==['ALL']:
-        route_type = list(traffic_df.route_type.unique())
-    
-    route_mask = traffic_df.route.isin(route_name)
-    route_type_mask = traffic_df.route_type.isin(route_type)
-    filter_mask = route_mask & route_type_mask
-    df = traffic_df[filter_mask]
-    
-    county_dict = [{'label': i, 'value': i} for i in sorted(df.county_name.unique())]
-    county_dict.insert(0, {'label': 'ALL', 'value': 'ALL'})
-
-    return county_dict
 
 # update mapbox plot
 @app.callback(
-    dash.dependencies.Output('scatter-geo', 'figure'),
+    dash.dependencies.Output('scatter-geo-payload', 'data'),
     [dash.dependencies.Input('route-types', 'value'),
     dash.dependencies.Input('county-names', 'value'),
     dash.dependencies.Input('route-names', 'value'),
     dash.dependencies.Input('scale', 'value'),
-    dash.dependencies.Input('background', 'value')]
+    dash.dependencies.Input('background', 'value'),
+    dash.dependencies.Input('scatter-geo', 'relayoutData'),
+    dash.dependencies.Input('map-layer', 'value')]
 )
-def update_map(route_type, county_name, route_name, scale, map_background):
-  
-    if len(route_type) < 1 or route_type==['ALL']:
-        route_type = list(traffic_df.route_type.unique())
-
-    if len(county_name) < 1 or county_name==['ALL']:
-        county_name = list(traffic_df.county_name.unique())
-
-    if len(route_name) < 1 or route_name==['ALL']:
-        route_name = list(traffic_df.route.unique())
-
-    route_type_mask = traffic_df.route_type.isin(route_type)
-    county_mask = traffic_df.county_name.isin(county_name)
-    route_mask = traffic_df.route.isin(route_name)
-    year_mask = traffic_df.year == 2018
-    filter_mask = route_type_mask & county_mask & route_mask & year_mask
-
-
-    plot_df = traffic_df[filter_mask]
+@callback_metrics.instrument('update_map')
+def update_map(route_type, county_name, route_name, scale, map_background, relayout_data=None, map_layer='stations'):
+
+    viewport = viewport_from_relayout(relayout_data)
+    if viewport is None and relayout_data:
+        # relayout events that don't move the map (e.g. the initial autosize) don't need a redraw
+        triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+        if 'scatter-geo.relayoutData' in triggered:
+            raise dash.exceptions.PreventUpdate
+    if viewport is not None:
+        viewport = snap_viewport(viewport)
+
+    return map_figure(route_type, county_name, route_name, scale, map_background, viewport, map_layer)
+
+@figure_cache.memoize
+def map_figure(route_type, county_name, route_name, scale, map_background, viewport, map_layer):
+
+    columns = list(MAP_COLUMNS)
+    for col in (SCALE_COLUMNS[scale], MARKER_SIZE_COLUMNS[scale]):
+        if col not in columns:
+            columns.append(col)
+    with callback_metrics.phase('mask'):
+        # only send the stations inside the (padded) visible part of the map
+        plot_df = dataset.read({
+            'route_type': route_type,
+            'county_name': county_name,
+            'route': route_name,
+            'year': [MAP_YEAR]
+        }, columns=columns, box=viewport[1:] if viewport is not None else None)
+    callback_metrics.rows(len(plot_df))
 
     # map configurations
-    if scale == 'AADT':
-        color = plot_df['average_daily_traffic']
-        title = 'Average Daily Traffic'
-        size = np.log(plot_df['average_daily_traffic']) / 2
-    elif scale == 'Log10AADT':
-        color = np.log10(plot_df['average_daily_traffic'])
-        title = 'Log10(Average Daily Traffic)'
-        size = color
-    elif scale == 'Percent Change':
-        color = plot_df['total_pct_change']
-        title = 'Total Pct Change'
-        size = np.abs(color) / 100
-
-    cmax = max(color)
-    cmin = min(color)
-
-    data = [go.Scattermapbox(
-        lat = plot_df['latitude'],
-        lon = plot_df['longitude'],
-        mode = 'markers',
-        marker = dict(
-            size = size,
-            opacity = 0.5, 
-            color = color,
-            colorbar = dict(title = title),
-            colorscale = 'Jet',
-            cmax = cmax,
-            cmin = cmin,
-            showscale = True
-        ),
-        text = 'Route: ' + plot_df['route'] +\
-            '<br>Route Leg: ' + plot_df['route_leg_descrip'] +\
-            "<br>AverageDailyTraffic: " + plot_df.average_daily_traffic.astype(str)
-    )]
-               
-    layout = go.Layout(
-        #autosize = True,
-        hovermode = 'closest',
-        font=dict(color="white"),
-        showlegend = False,
-        plot_bgcolor="#323130",
-        paper_bgcolor="#323130",
-        margin=go.layout.Margin(t=0, b=0, l=0, r=0),
-        mapbox = dict(
-            accesstoken = mapboxkey,
-            bearing = 0,
-            center = dict(lat = 33.8, lon = -81),
-            pitch = 0,
-            zoom = 6.6,
-            style = map_background
+    if scale == 'Trend':
+        # stations counted in fewer than two years have no trend
+        plot_df = plot_df[np.isfinite(plot_df['trend_growth'].values)]
+    color = plot_df[SCALE_COLUMNS[scale]]
+    title = SCALE_TITLES[scale]
+    size = plot_df[MARKER_SIZE_COLUMNS[scale]]
+
+    if len(plot_df):
+        cmax = max(color)
+        cmin = min(color)
+    else:
+        # nothing in view, keep the whole map year's colour scale so it doesn't change while panning
+        cmin, cmax = SCALE_RANGES[scale]
+
+    lat = plot_df['latitude']
+    lon = plot_df['longitude']
+    lines = []
+    if map_layer == 'routes':
+        # route lines at the detail the zoom can show, the marker trace only carries the colorbar
+        with callback_metrics.phase('aggregate'):
+            lines = route_layer.traces(
+                {'route_type': route_type, 'county_name': county_name, 'route': route_name},
+                SCALE_COLUMNS[scale], viewport[0] if viewport else DEFAULT_ZOOM, cmin, cmax,
+                box=viewport[1:] if viewport is not None else None
+            )
+        lat, lon, color, size, text = [None], [None], [cmin], 0, ''
+    elif not len(plot_df):
+        # an empty trace that still draws the colorbar
+        lat, lon, color, size, text = [None], [None], [cmin], 0, ''
+    elif len(plot_df) > MAX_MAP_POINTS:
+        # too many stations to draw one by one at this zoom, draw grid clusters instead
+        with callback_metrics.phase('aggregate'):
+            clusters = grid_clusters(lat, lon, color, cluster_cell_deg(viewport[0] if viewport else DEFAULT_ZOOM))
+        lat = clusters['lat']
+        lon = clusters['lon']
+        color = clusters['value']
+        size = 4 + 2 * np.sqrt(clusters['count'])
+        text = ['Stations: {}<br>Mean {}: {:.2f}'.format(n, title, v)
+                for n, v in zip(clusters['count'], clusters['value'])]
+    else:
+        # joined in the browser, so each route and leg description is sent once
+        text = None
+
+    with callback_metrics.phase('figure'):
+        data = [go.Scattermapbox(
+            lat = lat,
+            lon = lon,
+            mode = 'markers',
+            marker = dict(
+                size = size,
+                opacity = 0.5, 
+                color = color,
+                colorbar = dict(title = title),
+                colorscale = 'Jet',
+                cmax = cmax,
+                cmin = cmin,
+                showscale = True
             ),
-        height=575,
-        uirevision=True
-        )
-
-    return {'data': data, 'layout': layout} 
+            text = text
+        )] + lines
+               
+        layout = go.Layout(
+            #autosize = True,
+            hovermode = 'closest',
+            font=dict(color="white"),
+            showlegend = False,
+            plot_bgcolor="#323130",
+            paper_bgcolor="#323130",
+            margin=go.layout.Margin(t=0, b=0, l=0, r=0),
+            mapbox = dict(
+                accesstoken = mapboxkey,
+                bearing = 0,
+                center = dict(lat = 33.8, lon = -81),
+                pitch = 0,
+                zoom = DEFAULT_ZOOM,
+                style = map_background
+                ),
+            height=575,
+            uirevision=True
+            )
+
+    with callback_metrics.phase('encode'):
+        payload = encode_figure({'data': data, 'layout': layout})
+        if text is None:
+            payload['data'][0]['text'] = encode_text([
+                'Route: ', plot_df['route'],
+                '<br>Route Leg: ', plot_df['route_leg_descrip'],
+                '<br>AverageDailyTraffic: ', plot_df[HOVER_TEXT_COLUMN]
+            ])
+
+    return payload
+
+# decode the map payload into the figure, in the browser
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='payloads', function_name='figure'),
+    dash.dependencies.Output('scatter-geo', 'figure'),
+    [dash.dependencies.Input('scatter-geo-payload', 'data')]
+)
 
 # update year over year violin plot
 @app.callback(
@@ -288,65 +427,89 @@ def update_map(route_type, county_name, route_name, scale, map_background):
     dash.dependencies.Input('route-names', 'value'),
     dash.dependencies.Input('scale', 'value')]
 )
+@callback_metrics.instrument('update_yearplot')
 def update_yearplot(route_type, county_name, route_name, scale):
-  
-    if len(route_type) < 1 or route_type==['ALL']:
-        route_type = list(traffic_df.route_type.unique())
-
-    if len(county_name) < 1 or county_name==['ALL']:
-        county_name = list(traffic_df.county_name.unique())
-
-    if len(route_name) < 1 or route_name==['ALL']:
-        route_name = list(traffic_df.route.unique())
-
-    route_type_mask = traffic_df.route_type.isin(route_type)
-    county_mask = traffic_df.county_name.isin(county_name)
-    route_mask = traffic_df.route.isin(route_name)
-    filter_mask = route_type_mask & county_mask & route_mask
-
-    plot_df = traffic_df[filter_mask]
 
-    # map configurations
-    if scale == 'AADT':
-        vals = plot_df['average_daily_traffic']
-        medians = plot_df.groupby('year').average_daily_traffic.median().reset_index()
-        title = 'Average Daily Traffic'
-    elif scale == 'Log10AADT':
-        vals = np.log10(plot_df['average_daily_traffic'])
-        medians = plot_df.groupby('year').log10_adt.median().reset_index()
-        title = 'Log10(Average Daily Traffic)'
-    elif scale == 'Percent Change':
-        vals = plot_df['total_pct_change']
-        medians = plot_df.groupby('year').total_pct_change.median().reset_index()
-        title = 'Total Pct Change'
-
-    medians.columns=['year', 'vals']
-
-    data = [
-        go.Violin(
-            y=vals, 
-            x=plot_df["year"], 
-            box_visible=True, 
-            meanline_visible=True, 
-            opacity=0.6,
-            line_color='mediumpurple'
-        ),
-        go.Scatter(
-            x=medians.year,
-            y=medians.vals,
-            line_color='lightblue'
+    return yearplot_figure(route_type, county_name, route_name, scale)
+
+@figure_cache.memoize
+def yearplot_figure(route_type, county_name, route_name, scale):
+
+    # the unfiltered and single slicer views are shared by many filter combinations, keep their summaries
+    n_filtered = sum(not is_all(v) for v in (route_type, county_name, route_name))
+    if n_filtered <= 1:
+        summary = cached_year_summaries(route_type, county_name, route_name, scale)
+    else:
+        summary = year_summaries(route_type, county_name, route_name, scale)
+
+    title = SCALE_TITLES[scale]
+
+    with callback_metrics.phase('figure'):
+        # violins are drawn from the precomputed kde and box stats rather than the raw values
+        data = violin_traces(summary, line_color='mediumpurple', opacity=0.6) + [
+            go.Scatter(
+                x=summary['group'],
+                y=summary['median'],
+                line_color='lightblue'
+            )
+        ]
+        layout = go.Layout(
+            title=title,
+            showlegend=False,
+            font=dict(color="white"),
+            margin=go.layout.Margin(t=32, b=25, l=30, r=5),
+            plot_bgcolor="#323130",
+            paper_bgcolor="#323130"
         )
-    ]
-    layout = go.Layout(
-        title=title,
-        showlegend=False,
-        font=dict(color="white"),
-        margin=go.layout.Margin(t=32, b=25, l=30, r=5),
-        plot_bgcolor="#323130",
-        paper_bgcolor="#323130"
-    )
 
     return {'data': data, 'layout': layout}
 
+def year_summaries(route_type, county_name, route_name, scale):
+
+    column = SCALE_COLUMNS[scale]
+    chunks = dataset.chunks({
+        'route_type': route_type,
+        'county_name': county_name,
+        'route': route_name
+    }, columns=['year', column], by='year')
+
+    # a year at a time from a partitioned dataset, so reading and summarising are timed together
+    with callback_metrics.phase('aggregate'):
+        summaries = []
+        n_rows = 0
+        for chunk in chunks:
+            n_rows += len(chunk)
+            summaries.append(group_summaries(chunk['year'].values, chunk[column].values))
+    callback_metrics.rows(n_rows)
+
+    return concat_summaries(summaries)
+
+cached_year_summaries = summary_cache.memoize(year_summaries)
+
+# set WARMUP_SECONDS to precompute the default and single slicer views in the background
+# at startup, for at most that long. the server takes requests meanwhile. views that
+# don't fit in the figure cache aren't warmed, raise FIGURE_CACHE_SIZE to warm more
+warmup_seconds = os.environ.get('WARMUP_SECONDS')
+if warmup_seconds:
+    # the default scale first, single slicer views busiest first, the map as first drawn
+    warm_map = callback_metrics.instrument('warmup')(map_figure)
+    warm_yearplot = callback_metrics.instrument('warmup')(yearplot_figure)
+    views = common_views(dataset, ['route_type', 'county_name', 'route'])
+    scales = ['Log10AADT'] + [s for s in SCALE_COLUMNS if s != 'Log10AADT']
+    tasks = []
+    for scale in scales:
+        for view in views:
+            selection = (view['route_type'], view['county_name'], view['route'], scale)
+            tasks.append((warm_map, selection + ('dark', None, 'stations')))
+            tasks.append((warm_yearplot, selection))
+    cache_warmer = CacheWarmer(
+        tasks,
+        workers=int(os.environ.get('WARMUP_WORKERS', 2)),
+        budget=float(warmup_seconds),
+        max_tasks=figure_cache.maxsize
+    )
+    callback_metrics.register_gauges('warmup', cache_warmer.progress)
+    cache_warmer.start()
+
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,109 @@
+// decoding of the figure payloads encoded by payloads.py, run as dash clientside callbacks
+//
+// typed buffers ({dtype, bdata}, plus decimals for scaled integers) become plain arrays, dictionary encoded strings
+// ({values, codes}) and joined text ({join}) become arrays of strings, and everything
+// else is passed through, giving back the figure plotly.js would have been sent.
+
+(function() {
+    var TYPES = {
+        i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+        i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+    };
+
+    // shortest decimal that rounds to the same float32, like numpy prints it
+    function float32Decimal(v) {
+        for (var p = 1; p < 9; p++) {
+            var d = parseFloat(v.toPrecision(p));
+            if (Math.fround(d) === v) {
+                return d;
+            }
+        }
+        return v;
+    }
+
+    function decodeArray(spec) {
+        var raw = atob(spec.bdata);
+        var bytes = new Uint8Array(raw.length);
+        for (var i = 0; i < raw.length; i++) {
+            bytes[i] = raw.charCodeAt(i);
+        }
+        var typed = new TYPES[spec.dtype](bytes.buffer);
+        var out = new Array(typed.length);
+        if (spec.decimals !== undefined) {
+            // floats sent as scaled integers, the type's minimum is null
+            var scale = Math.pow(10, spec.decimals);
+            var missing = -Math.pow(2, 8 * typed.BYTES_PER_ELEMENT - 1);
+            for (var k = 0; k < typed.length; k++) {
+                out[k] = typed[k] === missing ? null : typed[k] / scale;
+            }
+            return out;
+        }
+        for (var j = 0; j < typed.length; j++) {
+            var v = typed[j];
+            // NaN is how payloads.py sends None
+            out[j] = v !== v ? null : (spec.dtype === 'f4' ? float32Decimal(v) : v);
+        }
+        return out;
+    }
+
+    function decodeStrings(spec) {
+        return decodeArray(spec.codes).map(function(code) {
+            return code < 0 ? null : spec.values[code];
+        });
+    }
+
+    function decodeJoin(spec) {
+        var parts = spec.join.map(function(part) {
+            return typeof part === 'string' ? part : decodeStrings(part);
+        });
+        var n = parts.reduce(function(length, part) {
+            return typeof part === 'string' ? length : part.length;
+        }, 0);
+        var out = new Array(n);
+        for (var i = 0; i < n; i++) {
+            var text = '';
+            for (var k = 0; k < parts.length && text !== null; k++) {
+                var part = typeof parts[k] === 'string' ? parts[k] : parts[k][i];
+                // a missing part makes the whole text missing, like adding NaN to a string in pandas
+                text = part === null ? null : text + part;
+            }
+            out[i] = text;
+        }
+        return out;
+    }
+
+    function decode(obj) {
+        if (Array.isArray(obj)) {
+            return obj.map(decode);
+        }
+        if (obj === null || typeof obj !== 'object') {
+            return obj;
+        }
+        if (typeof obj.bdata === 'string' && TYPES[obj.dtype]) {
+            return decodeArray(obj);
+        }
+        if (Array.isArray(obj.values) && obj.codes && typeof obj.codes.bdata === 'string') {
+            return decodeStrings(obj);
+        }
+        if (Array.isArray(obj.join)) {
+            return decodeJoin(obj);
+        }
+        var out = {};
+        Object.keys(obj).forEach(function(key) {
+            out[key] = decode(obj[key]);
+        });
+        return out;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        payloads: {
+            figure: function(payload) {
+                if (!payload) {
+                    // nothing computed yet, e.g. on page load
+                    return window.dash_clientside.no_update || {data: [], layout: {}};
+                }
+                return decode(payload);
+            }
+        }
+    });
+})();
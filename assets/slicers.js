@@ -0,0 +1,63 @@
+// slicer option narrowing, run in the browser as dash clientside callbacks
+//
+// the distinct (county_name, route_type, route) combinations are shipped once in the
+// slicer-dims store, encoded by filtering.encode_dimensions as each column's sorted
+// values plus one code per combination. narrowing one dropdown's options to what the
+// other two allow is then a scan over a few thousand integers, no server round trip.
+
+(function() {
+    // same as filtering.is_all: nothing selected, or just 'ALL'
+    function isAll(values) {
+        return !values || values.length < 1 || (values.length === 1 && values[0] === 'ALL');
+    }
+
+    // options for column, from the combinations matching every filter (column -> values)
+    function options(dims, column, filters) {
+        var codes = dims.codes[column];
+        var keep = [];
+        Object.keys(filters).forEach(function(col) {
+            if (isAll(filters[col])) {
+                return;
+            }
+            var wanted = {};
+            filters[col].forEach(function(value) { wanted[value] = true; });
+            var allowed = dims.values[col].map(function(value) { return wanted[value] === true; });
+            keep.push([dims.codes[col], allowed]);
+        });
+
+        var seen = new Uint8Array(dims.values[column].length);
+        for (var i = 0; i < codes.length; i++) {
+            var match = codes[i] >= 0;
+            for (var k = 0; match && k < keep.length; k++) {
+                match = keep[k][1][keep[k][0][i]] === true;
+            }
+            if (match) {
+                seen[codes[i]] = 1;
+            }
+        }
+
+        // codes follow the values' python sort order, so this matches sorted() server side
+        var result = [{label: 'ALL', value: 'ALL'}];
+        for (var c = 0; c < seen.length; c++) {
+            if (seen[c]) {
+                var value = dims.values[column][c];
+                result.push({label: value, value: value});
+            }
+        }
+        return result;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        slicers: {
+            route_names: function(route_type, county_name, dims) {
+                return options(dims, 'route', {route_type: route_type, county_name: county_name});
+            },
+            route_types: function(route_name, county_name, dims) {
+                return options(dims, 'route_type', {route: route_name, county_name: county_name});
+            },
+            counties: function(route_name, route_type, dims) {
+                return options(dims, 'county_name', {route: route_name, route_type: route_type});
+            }
+        }
+    });
+})();
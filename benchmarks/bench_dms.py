@@ -0,0 +1,63 @@
+# micro-benchmark of convert_lat_long against the str.split implementation it replaced
+#
+# usage: python benchmarks/bench_dms.py [n_values]
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from wrangling import convert_lat_long
+
+
+def convert_lat_long_split(series, delimiter=':', precision=5):
+    # the previous implementation, kept here as the reference
+    split = series.str.split(delimiter, expand=True).astype('float')
+    multiplier = np.sign(split[0])
+    hours = np.absolute(split[0])
+    minutes = split[1] / 60.0
+    seconds = split[2] / (60.0 * 60.0)
+    converted = multiplier * (hours + minutes + seconds)
+
+    return converted.round(precision)
+
+
+def make_values(n, seed=0):
+    # dbf style d:m:s strings spread over south carolina
+    rng = np.random.RandomState(seed)
+    lat = rng.uniform(32.0, 35.25, n)
+    lon = -rng.uniform(78.5, 83.4, n)
+    return [pd.Series(['{}:{}:{:.2f}'.format(int(v), int(abs(v) * 60 % 60), abs(v) * 3600 % 60) for v in values])
+            for values in (lat, lon)]
+
+
+def measure(func, series, repeat=5):
+    # best of repeat wall time, and the peak python allocation of one run
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(series)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(series)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main(n=200000):
+    for name, series in zip(['latitude', 'longitude'], make_values(n)):
+        expected, split_time, split_peak = measure(convert_lat_long_split, series)
+        converted, bytes_time, bytes_peak = measure(convert_lat_long, series)
+        pd.testing.assert_series_equal(expected, converted)
+        print('{} x {:,}: str.split {:.3f}s / {:.1f} MB peak, bytes {:.3f}s / {:.1f} MB peak, {:.1f}x faster'.format(
+            name, n, split_time, split_peak / 1e6, bytes_time, bytes_peak / 1e6, split_time / bytes_time
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,327 @@
+# benchmark harness: times each create_big_df stage and each dash callback on synthetic data
+#
+# usage: python benchmarks/run.py [--stations N] [--years N] [--dup-rate R] [--repeat N]
+#            [--out results.json] [--baseline benchmarks/baseline.json] [--tolerance 1.5]
+#
+# results are written as json, times are the median of --repeat runs. with --baseline,
+# every metric is compared against the stored run and the exit code is 1 if any got
+# worse by more than the tolerance and by more than its noise floor, so rerunning an
+# unchanged tree passes.
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import synth
+import wrangling
+from snapshot import write_snapshot, load_snapshot
+from partitions import write_partitions, PartitionedDataset, PARTITION_DIR
+from routes import RouteLayer
+from compact import compact_frame
+
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+# the generated data and everything built from it go here when it exists. the build
+# writes thousands of small files (the partitions, the per-year cache), and on disk their
+# timings swing several-fold with the writeback of the previous run's files
+RAM_DIR = '/dev/shm'
+
+# metric -> the smallest increase that counts as a regression, below it is noise. the
+# time floors are well above the run-to-run jitter of the millisecond-scale callbacks
+NOISE_FLOOR = {
+    'seconds': 0.05,
+    'warm_seconds': 0.01,
+    'peak_mb': 1.0,
+    'payload_bytes': 1024,
+    'payload_gzip_bytes': 512
+}
+
+# the build stages write and read files, their times swing more between runs than the
+# in-memory callbacks' and queries'
+BUILD_NOISE_FLOOR = dict(NOISE_FLOOR, seconds=0.15)
+
+SCALES = ['AADT', 'Log10AADT', 'Percent Change', 'Trend']
+
+
+def measure(func, repeat=1):
+    """Time a call and measure its peak python memory.
+
+    The median of repeat untraced calls is the time, and one more call under tracemalloc
+    (which slows python code down, so it's never timed) gives the peak allocation.
+
+    Returns:
+        result: what func returned
+        metrics (dict): 'seconds' and 'peak_mb'
+
+    """
+    seconds, result = median_seconds(func, repeat)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {'seconds': seconds, 'peak_mb': peak / 1e6}
+
+
+def median_seconds(func, repeat=1):
+    """Time repeat calls.
+
+    Returns:
+        seconds (float): the median time of a call
+        result: what the last call returned
+
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def bench_build(shp_dir, repeat):
+    """Time every stage of create_big_df on its own, and the whole of it cold and cached."""
+    results = {}
+    files = wrangling.find_year_files(shp_dir)
+
+    raw, results['read_year_df'] = measure(
+        lambda: {year: wrangling.read_year_df(path) for year, path in files.items()}, repeat)
+    # clean_year_df renames the columns of the frame it's given, hand it shallow copies
+    clean, results['clean_year_df'] = measure(
+        lambda: {year: wrangling.clean_year_df(year, df.copy(deep=False)) for year, df in raw.items()}, repeat)
+    traffic_df, results['combine_year_dfs'] = measure(lambda: wrangling.combine_year_dfs(clean), repeat)
+
+    _, results['to_pickle'] = measure(lambda: traffic_df.to_pickle(wrangling.BIGFRAME_PATH), repeat)
+    _, results['compact_frame'] = measure(lambda: compact_frame(traffic_df), repeat)
+    _, results['write_snapshot'] = measure(lambda: write_snapshot(traffic_df), repeat)
+    _, results['load_snapshot'] = measure(load_snapshot, repeat)
+    _, results['write_partitions'] = measure(lambda: write_partitions(traffic_df), repeat)
+    map_year = traffic_df[traffic_df.year == traffic_df.year.max()]
+    _, results['build_route_layer'] = measure(lambda: RouteLayer.build(map_year), repeat)
+
+    def cold():
+        shutil.rmtree(wrangling.CACHE_DIR, ignore_errors=True)
+        wrangling.create_big_df(shp_dir, workers=1)
+
+    _, results['create_big_df'] = measure(cold, repeat)
+    _, results['create_big_df_cached'] = measure(lambda: wrangling.create_big_df(shp_dir, workers=1), repeat)
+
+    return {'build/' + stage: metrics for stage, metrics in results.items()}
+
+
+def selections(traffic_df):
+    """Representative slicer values: nothing, ALL, single and combined filters.
+
+    Picked from the busiest county and routes of the newest year, so every
+    combination matches some stations.
+
+    """
+    newest = traffic_df[traffic_df.year == traffic_df.year.max()]
+    newest = newest[['route_type', 'county_name', 'route']].astype(object)
+    county = newest.county_name.value_counts().index[0]
+    in_county = newest[newest.county_name == county]
+    route_types = list(in_county.route_type.value_counts().index[:2])
+    routes = list(in_county[in_county.route_type == route_types[0]].route.value_counts().index[:5])
+    return {
+        'none': ([], [], []),
+        'all': (['ALL'], ['ALL'], ['ALL']),
+        'route_type': (route_types[:1], [], []),
+        'county': ([], [county], []),
+        'route_type+county': (route_types, [county], []),
+        'route': ([], [], routes[:1]),
+        'route_type+county+routes': (route_types[:1], [county], routes)
+    }
+
+
+def payload_sizes(result):
+    """Size of what dash sends to the browser for an output, as json and gzipped like the server does."""
+    import plotly
+    body = json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8')
+    return {'payload_bytes': len(body), 'payload_gzip_bytes': len(gzip.compress(body, 6))}
+
+
+def bench_callbacks(repeat):
+    """Time each callback cold (caches cleared) and warm, with its payload size.
+
+    The dropdown options are narrowed in the browser, only the encoding of the
+    combinations they're narrowed from (sent once with the layout) runs server side.
+
+    """
+    import app
+    from filtering import encode_dimensions
+
+    results = {}
+    encoded, results['layout/slicer_dims'] = measure(lambda: encode_dimensions(app.slicer_dims), repeat)
+    results['layout/slicer_dims'].update(payload_sizes(encoded))
+
+    calls = {}
+    for name, (route_type, county_name, route_name) in selections(app.traffic_df).items():
+        for scale in SCALES:
+            calls['update_map/{}/{}'.format(name, scale)] = \
+                (app.update_map, (route_type, county_name, route_name, scale, 'dark'))
+            calls['update_map/{}/{}/routes'.format(name, scale)] = \
+                (app.update_map, (route_type, county_name, route_name, scale, 'dark', None, 'routes'))
+            calls['update_yearplot/{}/{}'.format(name, scale)] = \
+                (app.update_yearplot, (route_type, county_name, route_name, scale))
+
+    def clear_caches():
+        app.figure_cache.clear()
+        app.summary_cache.clear()
+
+    for key, (callback, args) in calls.items():
+        # call the function under dash's callback decorator directly
+        func = getattr(callback, '__wrapped__', callback)
+
+        def cold():
+            clear_caches()
+            return func(*args)
+
+        result, metrics = measure(cold, repeat)
+        metrics['warm_seconds'], _ = median_seconds(lambda: func(*args), repeat)
+        metrics.update(payload_sizes(result))
+        results['callback/' + key] = metrics
+
+    return results
+
+
+def bench_queries(repeat):
+    """Time the map's and the violin plot's reads, from the snapshot and from the partitioned dataset."""
+    import app
+    datasets = {'in_memory': app.dataset, 'partitioned': PartitionedDataset(PARTITION_DIR)}
+
+    results = {}
+    for name, (route_type, county_name, route_name) in selections(app.traffic_df).items():
+        filters = {'route_type': route_type, 'county_name': county_name, 'route': route_name}
+        for kind, dataset in datasets.items():
+            _, results['query/{}/map/{}'.format(kind, name)] = measure(
+                lambda: dataset.read(dict(filters, year=[app.MAP_YEAR]), columns=app.MAP_COLUMNS), repeat)
+            _, results['query/{}/yearplot/{}'.format(kind, name)] = measure(
+                lambda: [len(chunk) for chunk in dataset.chunks(filters, columns=['year', 'log10_adt'])], repeat)
+
+    # a full export of every row and column, streamed and thrown away
+    for fmt in ['csv', 'binary']:
+        _, results['query/export/' + fmt] = measure(lambda: sum(len(chunk) for chunk in app.exporter.stream(
+            {'year': app.exporter.years}, app.exporter.export_columns(), fmt)), repeat)
+
+    return results
+
+
+def environment(workdir):
+    env = {
+        'workdir': os.path.dirname(workdir),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+    try:
+        import resource
+        # linux reports kilobytes, macos bytes
+        scale = 1 if sys.platform == 'darwin' else 1024
+        env['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    except ImportError:
+        pass
+    return env
+
+
+def compare(baseline, current, tolerance):
+    """Find the metrics that got worse than the baseline by more than tolerance.
+
+    Args:
+        baseline (dict): a stored results file
+        current (dict): this run's results
+        tolerance (float): allowed ratio of current to baseline, e.g. 1.5
+    Returns:
+        regressions (list): (key, metric, baseline value, current value)
+
+    """
+    regressions = []
+    for key, metrics in sorted(current['results'].items()):
+        before = baseline['results'].get(key)
+        if before is None:
+            continue
+        floors = BUILD_NOISE_FLOOR if key.startswith('build/') else NOISE_FLOOR
+        for metric, value in metrics.items():
+            old = before.get(metric)
+            if old is None:
+                continue
+            if value > old * tolerance and value - old > floors.get(metric, 0):
+                regressions.append((key, metric, old, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark create_big_df and the dash callbacks on synthetic data.')
+    parser.add_argument('--stations', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--dup-rate', type=float, default=0.03)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per measurement, the median is kept')
+    parser.add_argument('--out', default='benchmark_results.json', help='where to write this run\'s results')
+    parser.add_argument('--baseline', help='results file to compare against, e.g. ' + os.path.relpath(BASELINE_PATH))
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed slowdown/growth vs the baseline')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data directory')
+    args = parser.parse_args()
+
+    params = {'stations': args.stations, 'years': args.years, 'dup_rate': args.dup_rate, 'seed': args.seed}
+    out = os.path.abspath(args.out)
+    workdir = tempfile.mkdtemp(prefix='scdot-bench-', dir=RAM_DIR if os.path.isdir(RAM_DIR) else None)
+    cwd = os.getcwd()
+    try:
+        # the app and create_big_df use paths relative to the working directory
+        os.chdir(workdir)
+        shp_dir = os.path.join('data', 'shp_files')
+        synth.generate(shp_dir, args.stations, args.years, args.dup_rate, args.seed)
+        results = bench_build(shp_dir, args.repeat)
+        results.update(bench_callbacks(args.repeat))
+        results.update(bench_queries(args.repeat))
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print('data kept in ' + workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    run = {'params': params, 'environment': environment(workdir), 'results': results}
+    with open(out, 'w') as f:
+        json.dump(run, f, indent=1, sort_keys=True)
+
+    for key, metrics in sorted(results.items()):
+        print('{:<60} {:>9.4f}s {:>8.1f} MB{}'.format(
+            key, metrics['seconds'], metrics['peak_mb'],
+            ' {:>10,} bytes {:>9,} gzipped'.format(metrics['payload_bytes'], metrics['payload_gzip_bytes'])
+            if 'payload_bytes' in metrics else ''
+        ))
+    print('results written to ' + out)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['params'] != params:
+            sys.exit('baseline was run with {}, rerun with the same parameters'.format(baseline['params']))
+        regressions = compare(baseline, run, args.tolerance)
+        for key, metric, old, new in regressions:
+            print('REGRESSION {} {}: {:.4g} -> {:.4g} ({:.2f}x)'.format(key, metric, old, new, new / old if old else float('inf')))
+        print('{} regressions against {}'.format(len(regressions), args.baseline))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+# synthetic SC DOT count station files for the benchmarks
+#
+# writes a .dbf/.shp/.shx/.prj set per year with the same kind of mess the real files
+# have: column names that change from year to year, d:m:s or float lat/long, state plane
+# or plain lat/long points, duplicated records and stations, and missing counts.
+#
+# usage: python benchmarks/synth.py <out dir> [n_stations] [n_years] [dup_rate]
+
+import os
+import struct
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shpreader import parse_prj, project
+
+STATE_PLANE_PRJ = (
+    'PROJCS["NAD_1983_StatePlane_South_Carolina_FIPS_3900",GEOGCS["GCS_North_American_1983",'
+    'DATUM["D_North_American_1983",SPHEROID["GRS_1980",6378137,298.257222101]],PRIMEM["Greenwich",0],'
+    'UNIT["Degree",0.017453292519943295]],PROJECTION["Lambert_Conformal_Conic"],'
+    'PARAMETER["standard_parallel_1",34.83333333333334],PARAMETER["standard_parallel_2",32.5],'
+    'PARAMETER["latitude_of_origin",31.83333333333333],PARAMETER["central_meridian",-81],'
+    'PARAMETER["false_easting",609600],PARAMETER["false_northing",0],UNIT["Meter",1],'
+    'PARAMETER["scale_factor",1.0]]'
+)
+WGS84_PRJ = (
+    'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137,298.257223563]],'
+    'PRIMEM["Greenwich",0],UNIT["Degree",0.017453292519943295]]'
+)
+
+# like the real files: d:m:s strings in these years, and plain lat/long points in these
+DMS_YEARS = [2010, 2011, 2018]
+WGS84_YEARS = [2012, 2018]
+# years whose shapefile has some null shapes
+NULL_SHAPE_YEARS = [2016, 2018]
+# the real files end in 2018, and create_big_df takes the newest attributes from it
+LAST_YEAR = 2018
+
+COUNTIES = [
+    'ABBEVILLE', 'AIKEN', 'ALLENDALE', 'ANDERSON', 'BAMBERG', 'BARNWELL', 'BEAUFORT', 'BERKELEY',
+    'CALHOUN', 'CHARLESTON', 'CHEROKEE', 'CHESTER', 'CHESTERFIELD', 'CLARENDON', 'COLLETON',
+    'DARLINGTON', 'DILLON', 'DORCHESTER', 'EDGEFIELD', 'FAIRFIELD', 'FLORENCE', 'GEORGETOWN',
+    'GREENVILLE', 'GREENWOOD', 'HAMPTON', 'HORRY', 'JASPER', 'KERSHAW', 'LANCASTER', 'LAURENS',
+    'LEE', 'LEXINGTON', 'MARION', 'MARLBORO', 'MCCORMICK', 'NEWBERRY', 'OCONEE', 'ORANGEBURG',
+    'PICKENS', 'RICHLAND', 'SALUDA', 'SPARTANBURG', 'SUMTER', 'UNION', 'WILLIAMSBURG', 'YORK'
+]
+# route type, its route type number, and how common it is
+ROUTE_TYPES = [('I', 1.0, 0.05), ('US', 2.0, 0.15), ('SC', 4.0, 0.3), ('S-', 9.0, 0.47), ('L-', 9.0, 0.03)]
+
+# (one name per alias set, dbf type, size, decimals), the alias set rotates with the year
+FIELDS = [
+    (['ID_1', 'ID1', 'ID_1'], 'N', 8, 0),
+    (['STATION', 'STATIONNU', 'STATIONNUM'], 'N', 8, 0),
+    (['ROUTELRS', 'MAPLRS', 'ROUTE_LRS'], 'C', 12, 0),
+    (['RTENUM', 'ROUTENUMB', 'ROUTENUMBE'], 'N', 6, 0),
+    (['ROUTETYPE', 'RTETYPE', 'ROUTETYPE1'], 'C', 4, 0),
+    (['ROUTETYPEN', 'ROUTETYPEN', 'ROUTETYPEN'], 'N', 6, 1),
+    (['COUNTY', 'COUNTYNAME', 'COUNTYNAM'], 'C', 20, 0),
+    (['COUNTYID', 'COUNTYNUMB', 'COUNTYID'], 'N', 4, 0),
+    (['LATITUDE', 'LAT', 'LATITUDE'], None, 16, 6),
+    (['LONGITUDE', 'LONG', 'LONGITUDE'], None, 16, 6),
+    (['AADT', 'FACTOREDA', 'COUNT'], 'N', 10, 0),
+    (['AADTYR', 'YEAR', 'FACTORED1'], 'N', 6, 0),
+    (['TERMINI', 'DESCRIPTIO', 'TERMINI'], 'C', 40, 0),
+    (['BEGINMILEP', 'BMP', 'BEGINMILE'], 'N', 10, 3),
+    (['ENDMILEPO', 'EMP', 'ENDMILEPOI'], 'N', 10, 3),
+    (['MILEPOINT', 'METERMILE', 'METERMILEP'], 'N', 10, 3),
+    (['OBJECTID', 'FID_1', 'OBJECTID'], 'N', 9, 0),
+]
+
+
+def make_stations(n_stations, rng):
+    """Draw the stations every year's file is sampled from.
+
+    Returns:
+        stations (dict): one array per attribute, n_stations long
+
+    """
+    types, numbers, weights = zip(*ROUTE_TYPES)
+    kind = rng.choice(len(types), n_stations, p=weights)
+    county = rng.randint(0, len(COUNTIES), n_stations)
+    begin = rng.uniform(0, 20, n_stations)
+    return {
+        'station': np.arange(n_stations) + 100,
+        'lrs': np.array(['{:05d}{:07d}'.format(c + 1, i) for i, c in enumerate(county)]),
+        'route_number': rng.randint(1, 900, n_stations),
+        'route_type': np.array(types)[kind],
+        'route_type_number': np.array(numbers)[kind],
+        'county': county,
+        'lat': rng.uniform(32.12, 35.19, n_stations),
+        'lon': rng.uniform(-83.3, -78.6, n_stations),
+        'base_aadt': np.exp(rng.normal(7.5, 1.4, n_stations)),
+        'growth': rng.normal(0.015, 0.02, n_stations),
+        'begin': begin,
+        'end': begin + rng.uniform(0.2, 5, n_stations)
+    }
+
+
+def year_rows(stations, year, first_year, dup_rate, rng):
+    """Sample one year's records from the stations.
+
+    Some stations skip the year, some records are exact duplicates (apart from the row
+    number), and some stations get a second record with a different count.
+
+    Returns:
+        rows (dict): one array per attribute, plus 'aadt'
+
+    """
+    n = len(stations['station'])
+    present = np.flatnonzero(rng.rand(n) < (1.0 if year == LAST_YEAR else 0.95))
+    duplicated = present[rng.rand(len(present)) < dup_rate]
+    recounted = present[rng.rand(len(present)) < dup_rate]
+    picks = np.sort(np.concatenate([present, duplicated, recounted]))
+    rows = {key: values[picks] for key, values in stations.items()}
+
+    noise = rng.uniform(0.9, 1.1, len(present))
+    aadt = dict(zip(present, stations['base_aadt'][present] * (1 + stations['growth'][present]) ** (year - first_year) * noise))
+    rows['aadt'] = np.array([aadt[p] for p in picks]).round()
+    # the second record of a recounted station has another count
+    second = np.zeros(len(picks), dtype=bool)
+    second[1:] = picks[1:] == picks[:-1]
+    recount = second & np.isin(picks, recounted) & (rng.rand(len(picks)) < 0.5)
+    rows['aadt'][recount] = (rows['aadt'][recount] * rng.uniform(0.8, 1.2, recount.sum())).round()
+    if year == LAST_YEAR:
+        rows['aadt'][rng.rand(len(picks)) < 0.01] = np.nan
+    return rows
+
+
+def dms(values):
+    # decimal degrees to d:m:s strings with seconds to two places
+    out = []
+    for value in values:
+        sign = '-' if value < 0 else ''
+        value = abs(value)
+        degrees = int(value)
+        minutes = int((value - degrees) * 60)
+        seconds = ((value - degrees) * 60 - minutes) * 60
+        out.append('{}{}:{}:{:.2f}'.format(sign, degrees, minutes, seconds))
+    return out
+
+
+def write_dbf(path, fields, columns):
+    """Write a dbase III file.
+
+    Args:
+        path (str): the file to write
+        fields (list): (name, type, size, decimals) per column
+        columns (list): the values of each column, None or NaN for blanks
+
+    """
+    n = len(columns[0]) if columns else 0
+    header_len = 32 + 32 * len(fields) + 1
+    record_len = 1 + sum(f[2] for f in fields)
+    matrix = [np.full((n, 1), ord(' '), dtype='uint8')]
+    for (name, typ, size, decimals), values in zip(fields, columns):
+        if typ == 'C':
+            text = [str(v).encode('utf-8')[:size].ljust(size) for v in values]
+        else:
+            text = [b' ' * size if v is None or v != v else
+                    '{:.{}f}'.format(v, decimals).encode('ascii')[:size].rjust(size) for v in values]
+        matrix.append(np.array(text, dtype='S{}'.format(size)).view('uint8').reshape(n, size))
+
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<BBBBLHH20x', 3, 120, 1, 1, n, header_len, record_len))
+        for name, typ, size, decimals in fields:
+            f.write(struct.pack('<11sc4xBB14x', name.encode('ascii'), typ.encode('ascii'), size, decimals))
+        f.write(b'\r')
+        f.write(np.hstack(matrix).tobytes())
+        f.write(b'\x1a')
+
+
+def write_points(base, x, y):
+    """Write a multipoint .shp/.shx pair with one point per record, NaN x for null shapes."""
+    records, index = [], []
+    offset = 50
+    for i, (px, py) in enumerate(zip(x, y)):
+        if px != px:
+            content = struct.pack('<i', 0)
+        else:
+            content = struct.pack('<i4di2d', 8, px, py, px, py, 1, px, py)
+        records.append(struct.pack('>2i', i + 1, len(content) // 2) + content)
+        index.append(struct.pack('>2i', offset, len(content) // 2))
+        offset += 4 + len(content) // 2
+
+    bbox = (np.nanmin(x), np.nanmin(y), np.nanmax(x), np.nanmax(y)) if len(x) else (0.0, 0.0, 0.0, 0.0)
+
+    def header(words):
+        return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, words) + struct.pack('<2i8d', 1000, 8, *(bbox + (0.0,) * 4))
+
+    body = b''.join(records)
+    with open(base + '.shp', 'wb') as f:
+        f.write(header(50 + len(body) // 2) + body)
+    with open(base + '.shx', 'wb') as f:
+        f.write(header(50 + 4 * len(index)) + b''.join(index))
+
+
+def generate(out_dir, n_stations=2000, n_years=10, dup_rate=0.03, seed=0):
+    """Write n_years of synthetic files, ending in 2018, to out_dir.
+
+    Args:
+        out_dir (str): directory to write the files to
+        n_stations (int): number of distinct count stations
+        n_years (int): number of yearly files
+        dup_rate (float): share of records duplicated, and of stations recounted, per year
+        seed (int): random seed, the same arguments always give the same files
+    Returns:
+        paths (list): the dbf file written for each year
+
+    """
+    rng = np.random.RandomState(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    stations = make_stations(n_stations, rng)
+    first_year = LAST_YEAR - n_years + 1
+    paths = []
+    for year in range(first_year, LAST_YEAR + 1):
+        rows = year_rows(stations, year, first_year, dup_rate, rng)
+        alias = year % 3
+        n = len(rows['station'])
+
+        county_names = np.array(COUNTIES)[rows['county']]
+        if year < 2015:
+            # older files spell the county names in title case
+            county_names = np.char.title(county_names)
+        if year in (2009, 2012, 2017):
+            # these years have a county_name column that isn't the county name
+            county_names = np.char.mod('%03d', rows['county'] * 2 + 1)
+
+        if year in DMS_YEARS:
+            lat_type, lat, lon = 'C', dms(rows['lat']), dms(rows['lon'])
+        else:
+            lat_type, lat, lon = 'N', rows['lat'], rows['lon']
+
+        columns = [
+            np.arange(1, n + 1), rows['station'], rows['lrs'], rows['route_number'], rows['route_type'],
+            rows['route_type_number'], county_names, rows['county'] + 1, lat, lon, rows['aadt'],
+            np.full(n, year), np.char.add('FROM A TO B ', rows['station'].astype(str)), rows['begin'],
+            rows['end'], (rows['begin'] + rows['end']) / 2, rng.randint(0, 10 ** 8, n)
+        ]
+        fields = [(names[alias], typ or lat_type, size, 0 if typ is None and lat_type == 'C' else decimals)
+                  for names, typ, size, decimals in FIELDS]
+        if year >= 2013:
+            fields.append(('GMROTATION', 'N', 8, 2))
+            columns.append(rng.uniform(0, 90, n))
+
+        base = os.path.join(out_dir, str(year))
+        write_dbf(base + '.dbf', fields, columns)
+
+        x, y = rows['lon'].copy(), rows['lat'].copy()
+        if year in NULL_SHAPE_YEARS:
+            x[rng.rand(n) < 0.016] = np.nan
+        prj = WGS84_PRJ if year in WGS84_YEARS else STATE_PLANE_PRJ
+        if prj is STATE_PLANE_PRJ:
+            x, y = project(x, y, parse_prj(prj))
+        write_points(base, x, y)
+        with open(base + '.prj', 'w') as f:
+            f.write(prj)
+        paths.append(base + '.dbf')
+
+    return paths
+
+
+if __name__ == '__main__':
+    out = sys.argv[1]
+    args = [int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 10,
+            float(sys.argv[4]) if len(sys.argv) > 4 else 0.03]
+    print('wrote {} years to {}'.format(len(generate(out, *args)), out))
@@ -0,0 +1,97 @@
+# compact in-memory representation of the traffic dataframe, with render-ready columns
+#
+# create_big_df's frame keeps the slicer dimensions as object strings and every integer
+# as int64. write_snapshot and write_partitions store the compacted frame instead: strings
+# as categoricals, integer ids and years in the smallest int type that holds them, plus
+# the per-row values the map draws (hover text, marker size per scale) computed once, so
+# the callbacks only take slices. floats are left alone: the map payload sends coordinates
+# exactly, as scaled integers, and float32 can't hold their 5 decimals past 64 degrees.
+
+import numpy as np
+import pandas as pd
+
+# the map's hover text is 'Route: <route><br>Route Leg: <leg><br>AverageDailyTraffic: <adt>',
+# the count as text is the one part that isn't already a categorical
+HOVER_TEXT_COLUMN = 'adt_text'
+
+# marker size column of each scale, the Log10AADT markers are sized by the value itself
+MARKER_SIZE_COLUMNS = {
+    'AADT': 'size_adt',
+    'Log10AADT': 'log10_adt',
+    'Percent Change': 'size_pct_change',
+    'Trend': 'size_trend'
+}
+
+
+def render_columns(df):
+    """Compute the per-row values the map draws from the value columns.
+
+    Args:
+        df (pandas DataFrame): the traffic dataframe
+    Returns:
+        columns (dict): column -> values, for the value columns df has and the render
+            columns it doesn't have yet
+
+    """
+    sources = {
+        HOVER_TEXT_COLUMN: 'average_daily_traffic',
+        'size_adt': 'log_adt',
+        'size_pct_change': 'total_pct_change',
+        'size_trend': 'trend_growth'
+    }
+    missing = {col for col, source in sources.items() if source in df.columns and col not in df.columns}
+
+    columns = {}
+    if HOVER_TEXT_COLUMN in missing:
+        columns[HOVER_TEXT_COLUMN] = pd.Categorical(df['average_daily_traffic'].astype(str))
+    if 'size_adt' in missing:
+        columns['size_adt'] = df['log_adt'].values / 2
+    if 'size_pct_change' in missing:
+        columns['size_pct_change'] = np.abs(df['total_pct_change'].values) / 100
+    if 'size_trend' in missing:
+        # stations without a trend stay NaN, the map leaves them out
+        columns['size_trend'] = np.clip(np.abs(df['trend_growth'].values), 2, 15)
+    return columns
+
+
+def compact_frame(df):
+    """Compact a traffic dataframe and add the map's render columns.
+
+    A frame that's already compact is returned as it is, render columns it already has
+    are kept.
+
+    Args:
+        df (pandas DataFrame): e.g. the output of create_big_df
+    Returns:
+        df (pandas DataFrame): the same rows and values, strings as categoricals,
+            integers downcast, and the render columns
+
+    """
+    columns = {}
+    for col, dtype in df.dtypes.items():
+        if dtype == object:
+            columns[col] = df[col].astype('category')
+        elif dtype.kind in 'iu':
+            values = pd.to_numeric(df[col], downcast='integer')
+            if values.dtype != dtype:
+                columns[col] = values
+    columns.update(render_columns(df))
+    if not columns:
+        return df
+    return df.assign(**columns)
+
+
+def memory_report(before, after):
+    """Describe how much memory compact_frame saved.
+
+    Args:
+        before (pandas DataFrame): the frame given to compact_frame
+        after (pandas DataFrame): the compacted frame
+    Returns:
+        report (str): both sizes and the difference, in MB
+
+    """
+    before_mb = before.memory_usage(deep=True).sum() / 1e6
+    after_mb = after.memory_usage(deep=True).sum() / 1e6
+    return 'compacted {} rows from {:.1f} MB to {:.1f} MB, {:.1f} MB ({:.0%}) saved'.format(
+        len(before), before_mb, after_mb, before_mb - after_mb, 1 - after_mb / before_mb if before_mb else 0)
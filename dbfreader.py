@@ -0,0 +1,262 @@
+# memory-mapped dbf reader that only decodes the columns it is asked for
+#
+# simpledbf unpacks and converts every field of every record in python. here the records
+# are mapped as a (records x record length) byte matrix, and each requested column is
+# decoded from its slice of that matrix with numpy, a chunk of records at a time.
+
+import numpy as np
+import pandas as pd
+import datetime
+import struct
+
+# records decoded per chunk, bounds the temporary arrays for very large files
+CHUNKSIZE = 200000
+
+# bytes a simple numeric field may contain: digits, space, '.', '+', '-' and NUL padding
+_NUMERIC_BYTES = np.zeros(256, dtype=bool)
+_NUMERIC_BYTES[[ord(c) for c in '0123456789 .+-']] = True
+_NUMERIC_BYTES[0] = True
+
+
+class DbfField(object):
+    """One column of a dbf file: its name, type, width, decimals and byte offset."""
+    def __init__(self, name, type, size, decimals, offset):
+        self.name = name
+        self.type = type
+        self.size = size
+        self.decimals = decimals
+        self.offset = offset
+
+
+class DbfReader(object):
+    """Read selected columns of a dbf file into a dataframe.
+
+    Decodes like simpledbf's to_dataframe: character fields are stripped with empty
+    values as NaN, numeric fields become int64 if every value is a whole number without
+    a decimal point and float64 otherwise, and deleted records are skipped.
+
+    Args:
+        path (str): the dbf file
+        encoding (str): the codec character fields are decoded with
+    Attributes:
+        fields (list): a DbfField per column, in file order
+        columns (list): the column names, in file order
+        numrec (int): number of records, including deleted ones
+
+    """
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+
+        with open(path, 'rb') as f:
+            self.numrec, self.lenheader, self.reclen = struct.unpack('<4xLHH20x', f.read(32))
+            self.fields = []
+            # the deletion flag is the first byte of every record
+            offset = 1
+            while True:
+                descriptor = f.read(32)
+                if descriptor[:1] in (b'\r', b''):
+                    break
+                name, typ, size, decimals = struct.unpack('<11sc4xBB14x', descriptor)
+                self.fields.append(DbfField(
+                    name.split(b'\x00')[0].decode(encoding), typ.decode(encoding), size, decimals, offset
+                ))
+                offset += size
+
+        self.columns = [f.name for f in self.fields]
+        self._fields = {f.name: f for f in self.fields}
+        self._records = None
+        if self.numrec:
+            self._records = np.memmap(path, dtype='uint8', mode='r', offset=self.lenheader,
+                                      shape=(self.numrec, self.reclen))
+
+    def read(self, columns=None, chunksize=CHUNKSIZE, unread_key=None, unread_exclude=()):
+        """Read columns into a single dataframe.
+
+        Args:
+            columns (list): the columns to decode, all of them if None
+            chunksize (int): records decoded at a time
+            unread_key (str): if given, add a column of this name holding an integer that is
+                equal for two rows exactly when their undecoded fields are byte for byte equal,
+                so dropping duplicates still considers every field of the file
+            unread_exclude (list): columns left out of unread_key
+        Returns:
+            df (pandas DataFrame): one row per non-deleted record
+
+        """
+        chunks = list(self.iter_chunks(columns, chunksize, unread_key, unread_exclude))
+        if not chunks:
+            empty = self._records[:0] if self._records is not None else np.zeros((0, self.reclen), 'uint8')
+            return self._decode_chunk(empty, columns, unread_key, unread_exclude)
+        return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+    def iter_chunks(self, columns=None, chunksize=CHUNKSIZE, unread_key=None, unread_exclude=()):
+        """Yield dataframes of up to chunksize records, for streaming large files.
+
+        Args:
+            columns (list): the columns to decode, all of them if None
+            chunksize (int): records decoded at a time
+            unread_key (str): see read
+            unread_exclude (list): see read
+        Yields:
+            df (pandas DataFrame): the decoded non-deleted records of the chunk
+
+        """
+        for start in range(0, self.numrec, chunksize):
+            yield self._decode_chunk(self._records[start:start + chunksize], columns, unread_key, unread_exclude)
+
+    def record_numbers(self):
+        """Position in the file of each record read returns, to join other per-record data on.
+
+        Returns:
+            recnos (numpy array): int64 record number of each non-deleted record
+
+        """
+        if self._records is None:
+            return np.zeros(0, dtype='int64')
+        return np.flatnonzero(self._records[:, 0] == ord(' '))
+
+    def _decode_chunk(self, records, columns, unread_key, unread_exclude):
+        columns = columns if columns is not None else self.columns
+        # anything but a space in the deletion flag means the record was deleted
+        records = records[records[:, 0] == ord(' ')]
+        df = pd.DataFrame({c: self._decode(self._fields[c], records) for c in columns}, columns=columns)
+        if unread_key is not None:
+            skip = set(columns) | set(unread_exclude)
+            df[unread_key] = _hash_fields(records, [f for f in self.fields if f.name not in skip])
+        return df
+
+    def _decode(self, field, records):
+        raw = np.ascontiguousarray(records[:, field.offset:field.offset + field.size])
+        if field.type == 'C':
+            return self._decode_text(raw)
+        if field.type in 'NF':
+            return _decode_numeric(raw, as_float=field.type == 'F')
+        if field.type == 'D':
+            return _decode_each(raw, _parse_date)
+        if field.type == 'L':
+            return _decode_each(raw, _parse_bool)
+        raise ValueError('Column type "{}" not yet supported.'.format(field.type))
+
+    def _decode_text(self, raw):
+        # text columns repeat a lot (counties, route types), so only decode each distinct value once
+        uniques, inverse = np.unique(raw.view('S{}'.format(raw.shape[1])).ravel(), return_inverse=True)
+        stripped = [u.strip() for u in uniques]
+        decoded = np.array([v.decode(self.encoding) if v else np.nan for v in stripped] + [np.nan], dtype=object)
+        return decoded[:-1][inverse.ravel()]
+
+
+def _hash_fields(records, fields):
+    """64-bit hash per record of the raw bytes of some fields, equal bytes give equal hashes."""
+    hashes = np.zeros(len(records), dtype='uint64')
+    if not fields:
+        return hashes.view('int64')
+    raw = np.concatenate([records[:, f.offset:f.offset + f.size] for f in fields], axis=1)
+    # pad to whole 8 byte words and mix one word at a time (splitmix64 finalizer)
+    raw = np.pad(raw, ((0, 0), (0, -raw.shape[1] % 8)), mode='constant')
+    words = np.ascontiguousarray(raw).view('uint64')
+    with np.errstate(over='ignore'):
+        for j in range(words.shape[1]):
+            h = hashes ^ words[:, j]
+            h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+            h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+            hashes = (h ^ (h >> np.uint64(31))) + np.uint64(j + 1)
+    return hashes.view('int64')
+
+
+def _decode_numeric(raw, as_float=False):
+    """Parse a (records x width) matrix of fixed-width ascii numbers.
+
+    Each digit is weighted by its place value into an integer mantissa which is then
+    divided by the power of ten of the digits after the point, so simple values are
+    exact without ever building python strings. Anything else (exponents, embedded
+    spaces, over long values) falls back to simpledbf's per value parsing for just
+    those rows.
+
+    """
+    n, width = raw.shape
+    is_digit = (raw >= ord('0')) & (raw <= ord('9'))
+    is_dot = raw == ord('.')
+    is_core = is_digit | is_dot
+    is_minus = raw == ord('-')
+    is_sign = is_minus | (raw == ord('+'))
+    n_digits = is_digit.sum(axis=1)
+    n_core = is_core.sum(axis=1)
+    first_core = is_core.argmax(axis=1)
+    last_core = width - 1 - is_core[:, ::-1].argmax(axis=1)
+    has_sign = is_sign.any(axis=1)
+
+    # simple rows: padding, then an optional sign, then digits with at most one point
+    simple = _NUMERIC_BYTES[raw].all(axis=1)
+    simple &= (is_dot.sum(axis=1) <= 1) & (is_sign.sum(axis=1) <= 1)
+    simple &= (n_core == 0) | (last_core - first_core + 1 == n_core)
+    simple &= ~has_sign | (is_sign.argmax(axis=1) == first_core - 1)
+    # int64 mantissas are exact up to 18 digits, float64 division up to 15
+    simple &= n_digits <= 15
+
+    # each digit's place value is the number of digits to its right
+    places = np.cumsum(is_digit[:, ::-1], axis=1)[:, ::-1] - is_digit
+    digits = np.where(is_digit & simple[:, None], raw.astype('int64') - ord('0'), 0)
+    mantissa = (digits * 10 ** np.minimum(places, 18)).sum(axis=1)
+    frac_digits = (is_digit & (np.cumsum(is_dot, axis=1) > 0)).sum(axis=1)
+    sign = np.where(is_minus.any(axis=1), -1, 1)
+    mantissa *= sign
+    values = mantissa / 10.0 ** frac_digits
+    has_dot = is_dot.any(axis=1)
+    missing = n_digits == 0
+    values[missing] = np.nan
+
+    # simpledbf parses values with a point as floats, and everything else as ints
+    ints = mantissa
+    for i in np.flatnonzero(~simple):
+        text = raw[i].tobytes().rstrip(b'\x00')
+        if as_float or b'.' in text:
+            values[i] = _parse_float(text)
+            has_dot[i] = True
+        else:
+            value = _parse_int(text)
+            if value is None:
+                values[i] = np.nan
+            else:
+                values[i] = value
+                ints[i] = value
+        missing[i] = np.isnan(values[i])
+
+    # like pandas on simpledbf's records, a column is only int when every value is one
+    if not as_float and n and not missing.any() and not has_dot.any():
+        return ints
+    return values
+
+
+def _parse_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _parse_int(text):
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
+def _decode_each(raw, parse):
+    values = raw.view('S{}'.format(raw.shape[1])).ravel()
+    return np.array([parse(v) for v in values], dtype=object)
+
+
+def _parse_date(value):
+    try:
+        return datetime.date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+    except ValueError:
+        return np.nan
+
+
+def _parse_bool(value):
+    if value in (b'T', b'Y', b't', b'y'):
+        return True
+    if value in (b'F', b'N', b'f', b'n'):
+        return False
+    return np.nan
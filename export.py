@@ -0,0 +1,272 @@
+# read-only bulk export of the filtered traffic rows, streamed from the flask server
+#
+# downstream users get the slicers' filters plus a year range without scraping the
+# figures. rows are read and written one batch at a time by a generator, so an export
+# holds a single batch in memory however many rows match, and only a few exports run
+# at once so they can't take every thread the dashboard is served from.
+#
+# the binary format is columnar: a sequence of frames, each a little endian uint32
+# header length, a json header {'rows': n, 'columns': [{'name', 'dtype' (numpy style,
+# e.g. '<f8'), 'nbytes', and for strings 'categories'}]}, then every column's raw bytes
+# in header order, strings as codes into the frame's categories (-1 for missing). a
+# header length of 0 ends the stream. read_export reads it back into dataframes.
+
+import json
+import struct
+import threading
+
+import numpy as np
+import pandas as pd
+
+from snapshot import _codes_dtype
+
+# columns every export has, the scale picks the value columns that follow them
+EXPORT_COLUMNS = [
+    'year', 'station_id', 'route_identifier', 'route', 'route_type', 'county_name',
+    'route_leg_descrip', 'route_mile_point', 'latitude', 'longitude'
+]
+
+# format -> mimetype and file extension
+FORMATS = {'csv': ('text/csv', 'csv'), 'binary': ('application/octet-stream', 'bin')}
+
+# the slicer filters an export takes, each a repeatable query parameter
+FILTER_PARAMS = ['route_type', 'county_name', 'route']
+
+END_OF_STREAM = struct.pack('<I', 0)
+
+
+def _int_param(args, name, default):
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('{} must be a year, not {!r}'.format(name, value))
+
+
+def export_filters(args, years):
+    """Turn an export request's query parameters into dataset filters.
+
+    Args:
+        args (werkzeug MultiDict): the request's query parameters: route_type,
+            county_name and route (each repeatable, none or ALL for no filter), and
+            year_from / year_to (inclusive, default the first and last year)
+        years (list): the years in the data
+    Returns:
+        filters (dict): column -> list of selected values
+    Raises:
+        ValueError: if the years aren't numbers or no year is in the range
+
+    """
+    filters = {col: args.getlist(col) for col in FILTER_PARAMS}
+    year_from = _int_param(args, 'year_from', min(years))
+    year_to = _int_param(args, 'year_to', max(years))
+    filters['year'] = [year for year in years if year_from <= year <= year_to]
+    # an empty list would mean no filter at all
+    if not filters['year']:
+        raise ValueError('no data between {} and {}, the years are {} to {}'
+                         .format(year_from, year_to, min(years), max(years)))
+    return filters
+
+
+def csv_chunks(batches, columns):
+    """Write batches of rows as one csv, a chunk per batch.
+
+    Args:
+        batches (iterable): dataframes with the columns
+        columns (list): the columns, for the header line
+    Yields:
+        chunk (bytes): utf-8 csv, the header first
+
+    """
+    yield pd.DataFrame(columns=columns).to_csv(index=False).encode('utf-8')
+    for df in batches:
+        yield df.to_csv(index=False, header=False).encode('utf-8')
+
+
+def binary_frame(df):
+    """Encode a batch of rows as one frame of the binary format.
+
+    String columns are dictionary encoded against the values in the batch only, so
+    each frame can be decoded on its own.
+
+    Args:
+        df (pandas DataFrame): the rows, numeric, string or categorical columns
+    Returns:
+        frame (bytes): header length, json header and column bytes
+
+    """
+    columns, buffers = [], []
+    for col in df.columns:
+        values = df[col]
+        meta = {'name': col}
+        if values.dtype.kind in 'biuf':
+            data = values.values
+        else:
+            codes, categories = pd.factorize(values)
+            data = codes.astype(_codes_dtype(len(categories)))
+            meta['categories'] = [str(c) for c in categories]
+        data = np.ascontiguousarray(data, dtype=data.dtype.newbyteorder('<'))
+        meta['dtype'] = data.dtype.str
+        meta['nbytes'] = data.nbytes
+        columns.append(meta)
+        buffers.append(data.tobytes())
+    header = json.dumps({'rows': len(df), 'columns': columns}).encode('utf-8')
+    return struct.pack('<I', len(header)) + header + b''.join(buffers)
+
+
+def binary_chunks(batches):
+    """Write batches of rows as the binary format, a frame per batch.
+
+    Args:
+        batches (iterable): dataframes
+    Yields:
+        chunk (bytes): a frame, then the end of the stream
+
+    """
+    for df in batches:
+        yield binary_frame(df)
+    yield END_OF_STREAM
+
+
+def _read_exactly(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError('export stream ended early')
+    return data
+
+
+def read_export(f):
+    """Read a binary export back.
+
+    Args:
+        f (file like): the stream, opened in binary mode
+    Yields:
+        df (pandas DataFrame): the rows of each frame, strings as categoricals
+    Raises:
+        ValueError: if the stream ends before its end marker
+
+    """
+    while True:
+        size = struct.unpack('<I', _read_exactly(f, 4))[0]
+        if size == 0:
+            return
+        header = json.loads(_read_exactly(f, size).decode('utf-8'))
+        data = {}
+        for col in header['columns']:
+            values = np.frombuffer(_read_exactly(f, col['nbytes']), dtype=col['dtype'])
+            if 'categories' in col:
+                values = pd.Categorical.from_codes(values, categories=col['categories'])
+            data[col['name']] = values
+        yield pd.DataFrame(data, columns=[col['name'] for col in header['columns']])
+
+
+class Exporter(object):
+    """Serve the filtered rows of a dataset as streamed csv or binary downloads.
+
+    Args:
+        dataset (PartitionedDataset or InMemoryDataset): the data to export
+        scale_columns (dict): scale -> value column, the scales the slicers offer
+        columns (list): columns every export starts with
+        max_exports (int): most exports streaming at once in this process, more are turned
+            away with a 429. keep it below the server's threads per process
+        batch_rows (int): rows read and written at a time
+
+    """
+    def __init__(self, dataset, scale_columns, columns=EXPORT_COLUMNS, max_exports=2, batch_rows=50000):
+        self.dataset = dataset
+        self.scale_columns = scale_columns
+        self.columns = [col for col in columns if col in dataset.columns]
+        self.batch_rows = batch_rows
+        self.years = sorted(int(year) for year in dataset.value_counts('year').index)
+        self._slots = threading.BoundedSemaphore(max_exports)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.exports = 0
+        self.rejected = 0
+        self.rows = 0
+
+    def export_columns(self, scale=None):
+        """The columns an export has: the fixed ones and the scale's value column, or every scale's.
+
+        Raises:
+            ValueError: for a scale the slicers don't offer
+
+        """
+        if scale:
+            if scale not in self.scale_columns:
+                raise ValueError('scale must be one of {}, not {!r}'.format(sorted(self.scale_columns), scale))
+            values = [self.scale_columns[scale]]
+        else:
+            values = list(self.scale_columns.values())
+        return self.columns + [col for col in values if col not in self.columns]
+
+    def batches(self, filters, columns):
+        """The matching rows a batch at a time, counted as they go."""
+        for df in self.dataset.batches(filters, columns, self.batch_rows):
+            with self._lock:
+                self.rows += len(df)
+            yield df
+
+    def stream(self, filters, columns, fmt):
+        """Encode the matching rows in a format, see FORMATS."""
+        if fmt == 'csv':
+            return csv_chunks(self.batches(filters, columns), columns)
+        return binary_chunks(self.batches(filters, columns))
+
+    def _release(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    def progress(self):
+        """Counters for monitoring the exports.
+
+        Returns:
+            progress (dict): exports running, exports started and turned away, rows sent
+
+        """
+        with self._lock:
+            return {'active': self.active, 'started': self.exports, 'rejected': self.rejected, 'rows': self.rows}
+
+    def attach(self, server, route='/export'):
+        """Serve exports on a flask server.
+
+        The query parameters are those of export_filters, plus scale (one of the
+        scales, default every scale's column) and format ('csv', the default, or 'binary').
+
+        Args:
+            server (flask.Flask): the dash app's server
+            route (str): where to serve the exports
+
+        """
+        from flask import request, Response
+
+        @server.route(route)
+        def export():
+            try:
+                filters = export_filters(request.args, self.years)
+                columns = self.export_columns(request.args.get('scale'))
+                fmt = request.args.get('format', 'csv')
+                if fmt not in FORMATS:
+                    raise ValueError('format must be one of {}, not {!r}'.format(sorted(FORMATS), fmt))
+            except ValueError as e:
+                return Response(str(e) + '\n', status=400, mimetype='text/plain')
+
+            if not self._slots.acquire(blocking=False):
+                with self._lock:
+                    self.rejected += 1
+                return Response('too many exports running, retry later\n', status=429, mimetype='text/plain',
+                                headers={'Retry-After': '30'})
+            with self._lock:
+                self.active += 1
+                self.exports += 1
+
+            mimetype, extension = FORMATS[fmt]
+            response = Response(self.stream(filters, columns, fmt), mimetype=mimetype, headers={
+                'Content-Disposition': 'attachment; filename=traffic.' + extension
+            })
+            # the slot is freed when the server closes the response, finished or not
+            response.call_on_close(self._release)
+            return response
@@ -0,0 +1,207 @@
+# memoization cache for the figure callbacks
+#
+# the figures only depend on the slicer values, and the combinations people actually
+# click on are few and repeat constantly. results are kept in a bounded in-process lru,
+# optionally backed by a sqlite file that every gunicorn worker on the box shares.
+
+from collections import OrderedDict
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+def normalize_selection(values):
+    """Turn a slicer value into a hashable key that ignores order and 'ALL'.
+
+    Args:
+        values (list): the slicer value, as sent by the dropdown
+    Returns:
+        key (tuple): () for no filter, otherwise the sorted distinct values
+
+    """
+    if values is None or len(values) < 1 or values == ['ALL']:
+        return ()
+    return tuple(sorted(set(values)))
+
+
+def file_version(*paths):
+    """Describe the current state of some files, to tag cache entries with.
+
+    Args:
+        paths (str): the files the cached results were computed from
+    Returns:
+        version (str): size and mtime of each file that exists
+
+    """
+    parts = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append('{}:{}:{}'.format(path, stat.st_size, stat.st_mtime_ns))
+    return '|'.join(parts)
+
+
+class SqliteBackend(object):
+    """Shared on-disk store for FigureCache, one sqlite file for all workers.
+
+    Args:
+        path (str): the sqlite database file
+        maxsize (int): max number of entries kept, oldest accessed are evicted first
+        ttl (float): seconds an entry stays valid, None for no expiry
+
+    """
+    def __init__(self, path, maxsize=1024, ttl=None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS figures ('
+                'key TEXT PRIMARY KEY, version TEXT, value BLOB, created REAL, accessed REAL)'
+            )
+
+    def _conn(self):
+        # sqlite connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, version):
+        with self._conn() as conn:
+            row = conn.execute('SELECT value, created FROM figures WHERE key = ? AND version = ?',
+                               (key, version)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and time.time() - row[1] > self.ttl:
+                conn.execute('DELETE FROM figures WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE figures SET accessed = ? WHERE key = ?', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def set(self, key, version, value):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute('INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?, ?)',
+                         (key, version, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now, now))
+            conn.execute('DELETE FROM figures WHERE key IN ('
+                         'SELECT key FROM figures ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                         (self.maxsize,))
+
+    def purge(self, version):
+        # entries from an older build of the data can never be hit again
+        with self._conn() as conn:
+            conn.execute('DELETE FROM figures WHERE version != ?', (version,))
+
+
+class FigureCache(object):
+    """LRU/TTL cache for callback results, keyed on the normalized callback arguments.
+
+    Lists are normalized with normalize_selection, so [], ['ALL'] and reordered
+    selections share an entry. Every key is tagged with version, so results computed
+    from an older build of the data are never returned.
+
+    Args:
+        version (str): identifies the data the results are computed from, e.g. file_version
+        maxsize (int): max number of entries kept in process memory
+        ttl (float): seconds an entry stays valid, None for no expiry
+        backend (SqliteBackend): optional shared store checked on an in-memory miss
+
+    """
+    def __init__(self, version='', maxsize=128, ttl=None, backend=None):
+        self.version = version
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if backend is not None:
+            backend.purge(version)
+
+    def make_key(self, name, args):
+        normalized = [normalize_selection(a) if isinstance(a, list) else a for a in args]
+        return hashlib.sha1(json.dumps([name, normalized]).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Look a key up in memory, then in the backend.
+
+        Returns:
+            value: the cached result, or None on a miss
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if self.ttl is None or time.time() - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.backend is not None:
+            value = self.backend.get(key, self.version)
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.backend_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, self.version, value)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every in-memory entry, the backend is left as it is."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for monitoring how well the cache is doing.
+
+        Returns:
+            stats (dict): hits, backend_hits, misses and current in-memory size
+
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'backend_hits': self.backend_hits,
+                'misses': self.misses,
+                'size': len(self._entries)
+            }
+
+    def memoize(self, func):
+        """Decorator caching a callback's result on its normalized arguments."""
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = self.make_key(func.__name__, args)
+            value = self.get(key)
+            if value is None:
+                value = func(*args)
+                self.set(key, value)
+            return value
+        return wrapper
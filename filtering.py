@@ -0,0 +1,159 @@
+# precomputed indexes for the slicer filters used by the app callbacks
+
+import numpy as np
+
+
+def is_all(values):
+    """Check whether a slicer selection means 'no filter'.
+
+    Args:
+        values (list): the slicer value, as sent by the dropdown
+    Returns:
+        (bool): True for an empty selection or just 'ALL'
+
+    """
+    return values is None or len(values) < 1 or values == ['ALL']
+
+
+def _factorize(series):
+    # categoricals (e.g. from the snapshot) already carry codes, no need to rescan
+    if series.dtype.name == 'category':
+        return np.asarray(series.cat.codes, dtype='int64'), list(series.cat.categories)
+    codes, uniques = series.factorize()
+    return codes.astype('int64'), list(uniques)
+
+
+class SlicerIndex(object):
+    """Sorted row-id index over the slicer columns of a dataframe.
+
+    For each column the row ids are sorted by value once, so the rows holding a value
+    are one contiguous slice. Selecting values of one column is a union of slices, and
+    the other columns are intersected by looking up their codes for just those rows.
+    A selection of 'ALL' (or nothing) skips the column entirely.
+
+    Args:
+        df (pandas DataFrame): the dataframe to index, its row positions are returned
+        columns (list): the columns to index
+
+    """
+    def __init__(self, df, columns):
+        self.n_rows = len(df)
+        self._columns = {}
+        for col in columns:
+            codes, uniques = _factorize(df[col])
+            # mergesort is stable, so rows within a value stay in frame order
+            order = np.argsort(codes, kind='mergesort').astype('int32')
+            # missing values get code -1, sort first and can never be selected
+            order = order[(codes < 0).sum():]
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            lookup = {value: code for code, value in enumerate(uniques)}
+            self._columns[col] = (codes, order, offsets, lookup)
+
+    def rows(self, filters):
+        """Find the positions of the rows matching every filter.
+
+        Args:
+            filters (dict): column -> list of selected values, 'ALL' or [] for no filter
+        Returns:
+            rows (numpy array): sorted row positions, or None if nothing is filtered
+
+        """
+        selected = []
+        for col, values in filters.items():
+            if is_all(values):
+                continue
+            codes, order, offsets, lookup = self._columns[col]
+            value_codes = sorted({lookup[v] for v in values if v in lookup})
+            n_matches = sum(offsets[c + 1] - offsets[c] for c in value_codes)
+            selected.append((n_matches, col, value_codes))
+
+        if not selected:
+            return None
+
+        # start from the most selective column so the intersections touch the fewest rows
+        selected.sort(key=lambda s: s[0])
+        n_matches, col, value_codes = selected[0]
+        codes, order, offsets, lookup = self._columns[col]
+        rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in value_codes] or [order[:0]])
+        if len(value_codes) > 1:
+            rows.sort()
+
+        for n_matches, col, value_codes in selected[1:]:
+            codes, order, offsets, lookup = self._columns[col]
+            # one extra slot at the end so missing values (-1) look up as False
+            keep = np.zeros(len(lookup) + 1, dtype=bool)
+            keep[value_codes] = True
+            rows = rows[keep[codes[rows]]]
+
+        return rows
+
+    def select(self, df, filters):
+        """Slice the indexed dataframe down to the rows matching every filter.
+
+        Args:
+            df (pandas DataFrame): the same dataframe the index was built from
+            filters (dict): column -> list of selected values, 'ALL' or [] for no filter
+        Returns:
+            df (pandas DataFrame): the matching rows, in their original order
+
+        """
+        rows = self.rows(filters)
+        if rows is None:
+            return df
+        return df.take(rows)
+
+
+def dimension_table(df, columns):
+    """Build the table of distinct value combinations of the slicer columns.
+
+    The option callbacks only need to know which combinations exist, and there are far
+    fewer of those than rows in the full multi-year frame.
+
+    Args:
+        df (pandas DataFrame): the dataframe to summarise
+        columns (list): the slicer columns
+    Returns:
+        dims (pandas DataFrame): one row per distinct combination of columns
+
+    """
+    return df[columns].drop_duplicates().reset_index(drop=True)
+
+
+def encode_dimensions(dims):
+    """Encode a dimension table compactly for shipping to the browser.
+
+    Each column becomes its sorted distinct values plus one code per row, so every
+    string is sent once. assets/slicers.js decodes it, and sorting codes numerically
+    gives the same order as sorting the values in python.
+
+    Args:
+        dims (pandas DataFrame): the table to encode, e.g. from dimension_table
+    Returns:
+        encoded (dict): {'values': column -> sorted values, 'codes': column -> list of codes}
+
+    """
+    encoded = {'values': {}, 'codes': {}}
+    for col in dims.columns:
+        values = sorted(dims[col].dropna().astype(object).unique())
+        lookup = {value: code for code, value in enumerate(values)}
+        encoded['values'][col] = values
+        encoded['codes'][col] = [lookup.get(value, -1) for value in dims[col].astype(object)]
+    return encoded
+
+
+def filter_frame(df, filters):
+    """Filter a (small) dataframe with isin masks, skipping 'ALL' selections.
+
+    Args:
+        df (pandas DataFrame): the dataframe to filter, e.g. a dimension table
+        filters (dict): column -> list of selected values, 'ALL' or [] for no filter
+    Returns:
+        df (pandas DataFrame): the matching rows
+
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for col, values in filters.items():
+        if not is_all(values):
+            mask &= df[col].isin(values).values
+    return df[mask]
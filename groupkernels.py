@@ -0,0 +1,157 @@
+# vectorized per-group kernels for the station groups in create_big_df
+#
+# the (station_id, route_identifier, route_number) key is factorized and sorted once,
+# and every fill, difference and mean is then a single array pass that resets at
+# group boundaries, rather than a separate pandas groupby per column.
+
+import numpy as np
+import pandas as pd
+
+
+def group_codes(keys):
+    """Factorize a composite key into one integer code per row.
+
+    Codes follow the sorted order of the key values, so sorting by code is the same
+    as sorting by the key columns.
+
+    Args:
+        keys (list): one array per key column
+    Returns:
+        codes (numpy array): int64 group code per row, -1 where any key is missing
+
+    """
+    codes = None
+    missing = None
+    for key in keys:
+        key_codes, uniques = pd.factorize(key, sort=True)
+        if codes is None:
+            codes = key_codes.astype('int64')
+            missing = key_codes < 0
+            continue
+        missing |= key_codes < 0
+        codes = codes * len(uniques) + key_codes
+        # re-compact so the codes can't overflow however many key columns there are
+        codes[~missing] = np.unique(codes[~missing], return_inverse=True)[1].ravel()
+
+    codes[missing] = -1
+    return codes
+
+
+def mean_dedup(df, keys, col):
+    """Keep the first row of each group, with col replaced by the group mean.
+
+    Same result as transform('mean') + drop_duplicates + groupby().head(1), in one pass.
+    Rows with a missing key are dropped, like groupby drops them.
+
+    Args:
+        df (pandas DataFrame): the dataframe to dedup
+        keys (list): the columns identifying a group
+        col (str): the column to average across the group
+    Returns:
+        df (pandas DataFrame): one row per group, in the order groups first appear
+
+    """
+    codes = group_codes([df[k].values for k in keys])
+    valid = codes >= 0
+    n_groups = codes.max() + 1 if valid.any() else 0
+
+    values = df[col].values.astype('float64')
+    counted = valid & ~np.isnan(values)
+    sums = np.bincount(codes[counted], weights=values[counted], minlength=n_groups)
+    counts = np.bincount(codes[counted], minlength=n_groups)
+
+    first = np.unique(codes[valid], return_index=True)[1]
+    rows = np.sort(np.flatnonzero(valid)[first])
+    df = df.take(rows)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df[col] = (sums / counts)[codes[rows]]
+    return df
+
+
+class GroupKernel(object):
+    """Sorted group layout with vectorized fills and differences inside each group.
+
+    The rows are sorted once by group and then by order_by. Every method takes and
+    returns arrays in that sorted order, so take the frame in kernel.order once and
+    then work column by column. Rows with a missing key are each their own group.
+
+    Args:
+        keys (list): one array per key column
+        order_by (array like): sort rows within a group by this, e.g. the year
+    Attributes:
+        order (numpy array): row positions in sorted order
+        codes (numpy array): group code of each sorted row
+
+    """
+    def __init__(self, keys, order_by=None):
+        codes = group_codes(keys)
+        # rows with a missing key go last, like sort_values puts NaNs
+        sort_codes = np.where(codes < 0, codes.max() + 1 if len(codes) else 0, codes)
+        if order_by is None:
+            self.order = np.argsort(sort_codes, kind='mergesort')
+        else:
+            self.order = np.lexsort((np.asarray(order_by), sort_codes))
+        self.codes = codes[self.order]
+
+        n = len(self.codes)
+        positions = np.arange(n)
+        is_start = np.ones(n, dtype=bool)
+        is_start[1:] = (self.codes[1:] != self.codes[:-1]) | (self.codes[1:] < 0)
+        is_end = np.ones(n, dtype=bool)
+        is_end[:-1] = is_start[1:]
+        # position of the first and last row of each row's group
+        self.start = np.maximum.accumulate(np.where(is_start, positions, 0))
+        self.end = np.minimum.accumulate(np.where(is_end, positions, n)[::-1])[::-1]
+
+    def ffill(self, values):
+        """Forward fill missing values, never across a group boundary."""
+        values = np.asarray(values)
+        positions = np.arange(len(values))
+        last_valid = np.maximum.accumulate(np.where(pd.notna(values), positions, -1))
+        return self._take(values, last_valid, last_valid >= self.start)
+
+    def bfill(self, values):
+        """Backward fill missing values, never across a group boundary."""
+        values = np.asarray(values)
+        positions = np.arange(len(values))
+        next_valid = np.where(pd.notna(values), positions, len(values))
+        next_valid = np.minimum.accumulate(next_valid[::-1])[::-1]
+        return self._take(values, next_valid, next_valid <= self.end)
+
+    def fill(self, values):
+        """Backward then forward fill inside each group."""
+        return self.ffill(self.bfill(values))
+
+    def _take(self, values, source, found):
+        # rows with nothing to fill from in their group are missing already, leave them be
+        filled = values.copy()
+        filled[found] = values[source[found]]
+        return filled
+
+    def first(self, values):
+        """The first value of each row's group."""
+        return np.asarray(values)[self.start]
+
+    def last(self, values):
+        """The last value of each row's group."""
+        return np.asarray(values)[self.end]
+
+    def pct_change(self, values):
+        """Change from the previous row of the same group, like groupby().pct_change().
+
+        Missing values are forward filled within the group first, as pandas does.
+
+        """
+        values = self.ffill(np.asarray(values, dtype='float64'))
+        previous = np.full(len(values), np.nan)
+        has_previous = np.arange(len(values)) > self.start
+        previous[has_previous] = values[np.flatnonzero(has_previous) - 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return values / previous - 1
+
+    def total_pct_change(self, values):
+        """Percent change from the first to the last row of each row's group."""
+        values = np.asarray(values, dtype='float64')
+        first = self.first(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.last(values) - first) / first * 100
@@ -0,0 +1,296 @@
+# lightweight instrumentation for the dash callbacks, served on the flask server
+#
+# every callback call is timed as a whole and per phase (masking, aggregation, figure
+# construction), along with the number of rows it filtered down to. the dash endpoint's
+# responses are timed and sized per output, which includes the json serialization. all
+# of it goes into fixed-bucket histograms, so recording is a bisect and an add under a
+# lock and the memory used never grows. /metrics serves them in prometheus' text format.
+
+from collections import Counter, deque
+from contextlib import contextmanager
+import bisect
+import functools
+import sys
+import threading
+import time
+
+# histogram bucket upper bounds
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1e3, 4e3, 16e3, 64e3, 256e3, 1e6, 4e6, 16e6)
+ROWS_BUCKETS = (1, 10, 100, 1e3, 1e4, 1e5, 1e6)
+
+# dash posts every callback to this route, the body names the output being updated
+DASH_UPDATE_PATH = '_dash-update-component'
+
+
+class Histogram(object):
+    """Cumulative fixed-bucket histogram with a running sum and count."""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # (upper bound, observations at or below it), ending with +Inf
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class CallbackMetrics(object):
+    """Registry of the callback histograms and counters.
+
+    Args:
+        prefix (str): prefix of every exported metric name
+        slow_seconds (float): if set, stack samples are taken while callbacks run, and kept
+            for the calls that take at least this long
+        sample_interval (float): seconds between stack samples
+        max_profiles (int): number of slow call profiles kept, oldest are dropped first
+
+    """
+    def __init__(self, prefix='scdot', slow_seconds=None, sample_interval=0.005, max_profiles=20):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = Counter()
+        self._caches = {}
+        self._gauges = {}
+        self._local = threading.local()
+        self.profiler = SlowCallProfiler(slow_seconds, sample_interval, max_profiles) if slow_seconds else None
+
+    def _observe(self, name, labels, buckets, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def _count(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def _current(self):
+        return getattr(self._local, 'callback', None)
+
+    def instrument(self, name):
+        """Decorator timing a callback, and naming the calls that phase and rows record under.
+
+        Put it under dash's callback decorator so it wraps the function dash calls.
+
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                outer = self._current()
+                self._local.callback = name
+                token = self.profiler.start(name) if self.profiler else None
+                start = time.perf_counter()
+                try:
+                    return func(*args)
+                except Exception as e:
+                    # dash uses PreventUpdate for control flow, it's not a failure
+                    if type(e).__name__ != 'PreventUpdate':
+                        self._count('callback_errors_total', {'callback': name})
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - start
+                    self._local.callback = outer
+                    self._observe('callback_seconds', {'callback': name, 'phase': 'total'}, SECONDS_BUCKETS, elapsed)
+                    if token is not None:
+                        self.profiler.stop(token, elapsed)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def phase(self, phase):
+        """Time a block of the current callback, e.g. 'mask', 'aggregate' or 'figure'."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe('callback_seconds', {'callback': self._current() or 'none', 'phase': phase},
+                          SECONDS_BUCKETS, time.perf_counter() - start)
+
+    def rows(self, n):
+        """Record how many rows the current callback's filters left."""
+        self._observe('callback_rows', {'callback': self._current() or 'none'}, ROWS_BUCKETS, n)
+
+    def register_cache(self, name, cache):
+        """Export a FigureCache's hit and miss counters."""
+        self._caches[name] = cache
+
+    def register_gauges(self, name, func):
+        """Export the numbers in the dict func returns as gauges, e.g. the cache warm-up progress."""
+        self._gauges[name] = func
+
+    def attach(self, server, route='/metrics'):
+        """Time and size the dash update responses and serve the metrics on a flask server.
+
+        Args:
+            server (flask.Flask): the dash app's server
+            route (str): where to serve the metrics, slow call profiles go under route + '/slow'
+
+        """
+        from flask import request, g, Response
+
+        @server.before_request
+        def start_timer():
+            g.metrics_start = time.perf_counter()
+
+        @server.after_request
+        def record_response(response):
+            start = getattr(g, 'metrics_start', None)
+            if start is None or not request.path.endswith(DASH_UPDATE_PATH):
+                return response
+            body = request.get_json(silent=True) or {}
+            labels = {'output': str(body.get('output', 'unknown')), 'status': str(response.status_code)}
+            self._observe('response_seconds', labels, SECONDS_BUCKETS, time.perf_counter() - start)
+            if not response.direct_passthrough:
+                self._observe('response_bytes', labels, BYTES_BUCKETS, len(response.get_data()))
+            return response
+
+        @server.route(route)
+        def metrics_text():
+            return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+        if self.profiler is not None:
+            @server.route(route.rstrip('/') + '/slow')
+            def slow_profiles():
+                return Response(self.profiler.render(), mimetype='text/plain')
+
+    def render(self):
+        """All the metrics in prometheus' text exposition format."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            # copy the bucket counts so rendering doesn't hold up the callbacks
+            histograms = [(key, list(h.cumulative()), h.sum, h.count) for key, h in histograms]
+
+        typed = set()
+        for (name, labels), buckets, total, count in histograms:
+            full = '{}_{}'.format(self.prefix, name)
+            if full not in typed:
+                lines.append('# TYPE {} histogram'.format(full))
+                typed.add(full)
+            for bound, cumulative in buckets:
+                le = '+Inf' if bound == float('inf') else '{:g}'.format(bound)
+                lines.append('{}_bucket{} {}'.format(full, _labels(labels + (('le', le),)), cumulative))
+            lines.append('{}_sum{} {:.6f}'.format(full, _labels(labels), total))
+            lines.append('{}_count{} {}'.format(full, _labels(labels), count))
+
+        for (name, labels), value in counters:
+            full = '{}_{}'.format(self.prefix, name)
+            if full not in typed:
+                lines.append('# TYPE {} counter'.format(full))
+                typed.add(full)
+            lines.append('{}{} {}'.format(full, _labels(labels), value))
+
+        if self._caches:
+            stats = {name: cache.stats() for name, cache in self._caches.items()}
+            for stat, kind in [('hits', 'counter'), ('backend_hits', 'counter'), ('misses', 'counter'), ('size', 'gauge')]:
+                full = '{}_cache_{}'.format(self.prefix, stat + ('_total' if kind == 'counter' else ''))
+                lines.append('# TYPE {} {}'.format(full, kind))
+                for name in sorted(stats):
+                    lines.append('{}{} {}'.format(full, _labels((('cache', name),)), stats[name][stat]))
+
+        for name in sorted(self._gauges):
+            for stat, value in sorted(self._gauges[name]().items()):
+                full = '{}_{}_{}'.format(self.prefix, name, stat)
+                lines.append('# TYPE {} gauge'.format(full))
+                lines.append('{} {}'.format(full, value))
+
+        if self.profiler is not None:
+            lines.append('# TYPE {}_slow_calls_total counter'.format(self.prefix))
+            lines.append('{}_slow_calls_total {}'.format(self.prefix, self.profiler.slow_calls))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+
+class SlowCallProfiler(object):
+    """Sampling profiler that keeps the stacks of slow callback calls.
+
+    While any instrumented call is running, a background thread samples the stack of
+    each calling thread every interval. When a call finishes, its samples are kept if
+    it took at least slow_seconds and dropped otherwise, so fast calls cost little more
+    than the wakeups of the sampler.
+
+    Args:
+        slow_seconds (float): calls at least this long keep their profile
+        interval (float): seconds between samples
+        max_profiles (int): number of slow call profiles kept
+
+    """
+    def __init__(self, slow_seconds, interval=0.005, max_profiles=20):
+        self.slow_seconds = slow_seconds
+        self.interval = interval
+        self.profiles = deque(maxlen=max_profiles)
+        self.slow_calls = 0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, name):
+        token = object()
+        with self._lock:
+            self._active[token] = (threading.get_ident(), name, Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='slow-call-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return token
+
+    def stop(self, token, elapsed):
+        with self._lock:
+            ident, name, samples = self._active.pop(token)
+            if elapsed >= self.slow_seconds:
+                self.slow_calls += 1
+                self.profiles.append((time.time(), name, elapsed, samples))
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                    continue
+                for ident, name, samples in self._active.values():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+    def render(self):
+        """The kept profiles as collapsed stacks ('outer;inner count'), ready for flamegraph.pl."""
+        with self._lock:
+            profiles = list(self.profiles)
+        lines = []
+        for when, name, elapsed, samples in profiles:
+            lines.append('# {} {} {:.3f}s'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when)), name, elapsed))
+            lines.extend('{} {}'.format(stack, count) for stack, count in samples.most_common())
+        return '\n'.join(lines) + '\n'
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
@@ -0,0 +1,508 @@
+# dataset partitioned by year and county, read back one partition at a time
+#
+# the snapshot maps the whole frame into every worker, which stops scaling once the data
+# covers more than one state. here each (year, county) partition is a directory of one
+# .npy file per column, and meta.json lists every partition with its key, row count and
+# per-column zone maps (min/max of numeric columns, codes present in string columns).
+# a query only opens the partitions whose zone maps can match its filters, and only the
+# columns it asks for, so a worker holds the rows a callback needs and nothing else.
+
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from compact import compact_frame
+from filtering import SlicerIndex, dimension_table, is_all
+from snapshot import _codes_dtype
+from spatial import GridIndex
+
+PARTITION_DIR = './data/bigframe.partitions'
+
+PARTITION_COLUMNS = ['year', 'county_name']
+
+# string columns whose codes are listed per partition, so filters on them prune partitions.
+# numeric columns always get their min/max
+ZONE_MAP_COLUMNS = ['route_type', 'route']
+
+# bump this whenever the on-disk layout changes
+PARTITION_VERSION = 2
+
+# columns a box query filters on
+LAT_LON_COLUMNS = ('latitude', 'longitude')
+
+# rows per batch when a query's result is read in batches
+BATCH_ROWS = 50000
+
+# column files at least this big are memory-mapped, smaller ones are read. every mapping
+# holds a file descriptor, and a partition per year and county makes thousands of small files
+MMAP_MIN_BYTES = 1 << 20
+
+# a dataset keeps at most this many column files mapped and this many bytes of read ones,
+# dropping the least recently used first
+MAX_MAPPED_FILES = 256
+MAX_LOADED_BYTES = 256 << 20
+
+
+def _partition_path(by, key):
+    # hive style, e.g. year=2018/county_name=RICHLAND
+    return '/'.join('{}={}'.format(col, '__null__' if value is None else quote(str(value), safe=''))
+                    for col, value in zip(by, key))
+
+
+def _plain(value):
+    # numpy scalars and NaN to something json can hold
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def write_partitions(df, partition_dir=PARTITION_DIR, by=PARTITION_COLUMNS, zone_maps=ZONE_MAP_COLUMNS):
+    """Write a dataframe as a dataset partitioned by some of its columns.
+
+    String columns are dictionary encoded against categories shared by every
+    partition, so codes read from different partitions can be concatenated as they are.
+    Rows keep their order within a partition. Like write_snapshot, the frame is compacted
+    first and the dataset is built in a temp directory and swapped in, so readers never
+    see a partial write.
+
+    Args:
+        df (pandas DataFrame): the dataframe to write, e.g. the output of create_big_df
+        partition_dir (str): directory to write the dataset to
+        by (list): the columns to partition by, one directory level each
+        zone_maps (list): string columns to list each partition's codes of, worth it for
+            the ones queries filter on, not for near unique ones like descriptions
+    Raises:
+        TypeError: if a column is neither numeric nor string
+
+    """
+    df = compact_frame(df)
+    tmp_dir = '{}.tmp{}'.format(partition_dir, os.getpid())
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    arrays = {}
+    for col, dtype in df.dtypes.items():
+        if dtype.kind in 'biuf':
+            columns.append({'column': col, 'dtype': dtype.name})
+            arrays[col] = df[col].values
+        elif dtype.name in ('object', 'category'):
+            cat = pd.Categorical(df[col])
+            codes_dtype = _codes_dtype(len(cat.categories))
+            columns.append({'column': col, 'dtype': codes_dtype, 'categories': [str(c) for c in cat.categories]})
+            arrays[col] = cat.codes.astype(codes_dtype)
+        else:
+            raise TypeError('column {} has unsupported dtype {}'.format(col, dtype))
+
+    # one group id per distinct combination of the partition columns, missing values included
+    key_codes, key_values = [], []
+    for col in by:
+        codes, uniques = pd.factorize(df[col].values, sort=True)
+        key_codes.append(codes)
+        key_values.append([_plain(v) for v in uniques] + [None])
+    keys, group = np.unique(np.stack(key_codes, axis=1), axis=0, return_inverse=True)
+    group = group.ravel()
+    order = np.argsort(group, kind='mergesort')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(group, minlength=len(keys)))])
+
+    meta = {'version': PARTITION_VERSION, 'by': list(by), 'nrows': len(df), 'columns': columns, 'partitions': []}
+    for i, codes in enumerate(keys):
+        rows = order[bounds[i]:bounds[i + 1]]
+        key = [values[c] for values, c in zip(key_values, codes)]
+        path = _partition_path(by, key)
+        os.makedirs(os.path.join(tmp_dir, path))
+        part = {'key': key, 'path': path, 'nrows': len(rows), 'min': {}, 'max': {}, 'codes': {}}
+        for column in columns:
+            col = column['column']
+            values = arrays[col][rows]
+            np.save(os.path.join(tmp_dir, path, col + '.npy'), values)
+            if col in zone_maps:
+                part['codes'][col] = [int(c) for c in np.unique(values)]
+            elif 'categories' not in column and values.dtype.kind in 'iuf' and not np.isnan(values).all():
+                part['min'][col] = _plain(np.nanmin(values))
+                part['max'][col] = _plain(np.nanmax(values))
+        meta['partitions'].append(part)
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    old_dir = '{}.old{}'.format(partition_dir, os.getpid())
+    if os.path.isdir(partition_dir):
+        os.rename(partition_dir, old_dir)
+    os.rename(tmp_dir, partition_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def partition_version(partition_dir=PARTITION_DIR):
+    """The layout version a partitioned dataset was written with.
+
+    Args:
+        partition_dir (str): directory written by write_partitions
+    Returns:
+        version (int): the version, None if there's no dataset
+
+    """
+    try:
+        with open(os.path.join(partition_dir, 'meta.json')) as f:
+            return json.load(f)['version']
+    except FileNotFoundError:
+        return None
+
+
+class PartitionedDataset(object):
+    """Query layer over a dataset written by write_partitions.
+
+    Filters are pushed down in two steps. Partitions are pruned on their keys and zone
+    maps without opening any file, then the remaining filters become a row mask over
+    just the columns they name. Only the projected columns of the surviving rows are
+    ever copied into memory.
+
+    Args:
+        partition_dir (str): directory written by write_partitions
+        lat_lon (tuple): the latitude and longitude columns box queries filter on
+        max_mapped (int): column files kept memory-mapped between queries
+        max_loaded_bytes (int): bytes of read column files kept between queries
+    Raises:
+        ValueError: if the dataset was written with another layout version
+
+    """
+    def __init__(self, partition_dir=PARTITION_DIR, lat_lon=LAT_LON_COLUMNS, max_mapped=MAX_MAPPED_FILES,
+                 max_loaded_bytes=MAX_LOADED_BYTES):
+        with open(os.path.join(partition_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != PARTITION_VERSION:
+            raise ValueError('partition version {} is not {}, rebuild it with write_partitions'
+                             .format(meta['version'], PARTITION_VERSION))
+        self.partition_dir = partition_dir
+        self.by = meta['by']
+        self.nrows = meta['nrows']
+        self.partitions = meta['partitions']
+        self.lat_lon = lat_lon
+        self.columns = [c['column'] for c in meta['columns']]
+        self._dtypes = {c['column']: c['dtype'] for c in meta['columns']}
+        self._categories = {c['column']: c['categories'] for c in meta['columns'] if 'categories' in c}
+        self._lookup = {col: {value: code for code, value in enumerate(categories)}
+                        for col, categories in self._categories.items()}
+        # loaded column files, lru. a dropped mapping is closed once no result still uses it
+        self.max_mapped = max_mapped
+        self.max_loaded_bytes = max_loaded_bytes
+        self._loaded = OrderedDict()
+        self._n_mapped = 0
+        self._loaded_bytes = 0
+        self._lock = threading.Lock()
+
+    def _wanted(self, filters):
+        # the active filters, string values turned into codes
+        wanted = {}
+        for col, values in filters.items():
+            if is_all(values):
+                continue
+            if col in self._lookup:
+                wanted[col] = sorted({self._lookup[col][v] for v in values if v in self._lookup[col]})
+            else:
+                wanted[col] = list(values)
+        return wanted
+
+    def _matches(self, part, wanted, box):
+        # whether a partition can hold matching rows, from meta.json alone
+        for col, values in wanted.items():
+            if col in self.by:
+                key = part['key'][self.by.index(col)]
+                if col in self._lookup:
+                    key = self._lookup[col].get(key)
+                if key not in values:
+                    return False
+            elif col in part['codes']:
+                if not set(values).intersection(part['codes'][col]):
+                    return False
+            elif col in self._categories:
+                # no zone map, only the rows can tell
+                continue
+            elif col in part['min']:
+                if not any(part['min'][col] <= v <= part['max'][col] for v in values):
+                    return False
+            else:
+                # every value of the column is missing
+                return False
+        if box is not None:
+            south, west, north, east = box
+            lat, lon = self.lat_lon
+            if lat not in part['min'] or lon not in part['min']:
+                return False
+            if part['max'][lat] < south or part['min'][lat] > north or \
+                    part['max'][lon] < west or part['min'][lon] > east:
+                return False
+        return True
+
+    def _load(self, part, col):
+        key = (part['path'], col)
+        with self._lock:
+            values = self._loaded.get(key)
+            if values is not None:
+                self._loaded.move_to_end(key)
+                return values
+        path = os.path.join(self.partition_dir, part['path'], col + '.npy')
+        values = np.load(path, mmap_mode='r' if os.path.getsize(path) >= MMAP_MIN_BYTES else None)
+        with self._lock:
+            if key not in self._loaded:
+                self._loaded[key] = values
+                self._count(values, 1)
+            while self._n_mapped > self.max_mapped or self._loaded_bytes > self.max_loaded_bytes:
+                self._count(self._loaded.popitem(last=False)[1], -1)
+        return values
+
+    def _count(self, values, sign):
+        if isinstance(values, np.memmap):
+            self._n_mapped += sign
+        else:
+            self._loaded_bytes += sign * values.nbytes
+
+    def _mask(self, part, wanted, box):
+        # rows of a partition matching the filters its key doesn't settle, None for all
+        mask = None
+        for col, values in wanted.items():
+            if col in self.by:
+                continue
+            match = np.isin(self._load(part, col), values)
+            mask = match if mask is None else mask & match
+        if box is not None:
+            south, west, north, east = box
+            lat, lon = (self._load(part, c) for c in self.lat_lon)
+            match = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+            mask = match if mask is None else mask & match
+        return mask
+
+    def _scan(self, parts, wanted, columns, box):
+        # per column, the concatenated raw arrays (codes for strings) of the matching rows
+        pieces = {col: [] for col in columns}
+        for part in parts:
+            mask = self._mask(part, wanted, box)
+            if mask is not None and not mask.any():
+                continue
+            for col in columns:
+                values = self._load(part, col)
+                pieces[col].append(values if mask is None else values[mask])
+        arrays = {}
+        for col, found in pieces.items():
+            if len(found) == 1:
+                # a single partition isn't copied, unmasked it stays memory-mapped
+                arrays[col] = found[0]
+            else:
+                arrays[col] = np.concatenate(found) if found else np.zeros(0, self._dtypes[col])
+        return arrays
+
+    def _frame(self, arrays, columns):
+        return pd.DataFrame({
+            col: pd.Categorical.from_codes(arrays[col], categories=self._categories[col])
+            if col in self._categories else arrays[col]
+            for col in columns
+        }, columns=columns)
+
+    def select_partitions(self, filters, box=None):
+        """List the partitions a query has to open.
+
+        Args:
+            filters (dict): column -> list of selected values, 'ALL' or [] for no filter
+            box (tuple): south, west, north, east edges to keep, or None
+        Returns:
+            partitions (list): the matching entries of meta.json's partitions
+
+        """
+        wanted = self._wanted(filters)
+        return [part for part in self.partitions if self._matches(part, wanted, box)]
+
+    def read(self, filters, columns=None, box=None):
+        """Read the rows matching every filter.
+
+        Args:
+            filters (dict): column -> list of selected values, 'ALL' or [] for no filter
+            columns (list): the columns to read, None for all of them
+            box (tuple): south, west, north, east edges the rows' lat/long must fall in, or None
+        Returns:
+            df (pandas DataFrame): the matching rows in partition order, string columns
+                as categoricals
+
+        """
+        columns = list(columns or self.columns)
+        wanted = self._wanted(filters)
+        parts = [part for part in self.partitions if self._matches(part, wanted, box)]
+        return self._frame(self._scan(parts, wanted, columns, box), columns)
+
+    def chunks(self, filters, columns=None, by='year'):
+        """Read the rows matching every filter one value of a partition column at a time.
+
+        Aggregations that group by that column can run chunk by chunk, holding a
+        single chunk in memory.
+
+        Args:
+            filters (dict): column -> list of selected values, 'ALL' or [] for no filter
+            columns (list): the columns to read, None for all of them
+            by (str): one of the partition columns
+        Yields:
+            df (pandas DataFrame): the matching rows of one value of by, in order of the
+                values, empty chunks are skipped
+        Raises:
+            ValueError: if by isn't a partition column
+
+        """
+        if by not in self.by:
+            raise ValueError('{} is not one of the partition columns {}'.format(by, self.by))
+        columns = list(columns or self.columns)
+        wanted = self._wanted(filters)
+        groups = {}
+        for part in self.partitions:
+            if self._matches(part, wanted, None):
+                groups.setdefault(part['key'][self.by.index(by)], []).append(part)
+        # missing keys last
+        for key in sorted(groups, key=lambda k: (k is None, k)):
+            df = self._frame(self._scan(groups[key], wanted, columns, None), columns)
+            if len(df):
+                yield df
+
+    def batches(self, filters, columns=None, batch_rows=BATCH_ROWS):
+        """Read the rows matching every filter in batches, a partition at a time.
+
+        Small partitions are gathered into one batch, so a batch holds up to twice
+        batch_rows rows however many partitions match.
+
+        Args:
+            filters (dict): column -> list of selected values, 'ALL' or [] for no filter
+            columns (list): the columns to read, None for all of them
+            batch_rows (int): rows in a batch, it's full once it has at least this many
+        Yields:
+            df (pandas DataFrame): the next matching rows, in partition order
+
+        """
+        columns = list(columns or self.columns)
+        wanted = self._wanted(filters)
+        pending, n_pending = [], 0
+        for part in self.partitions:
+            if not self._matches(part, wanted, None):
+                continue
+            mask = self._mask(part, wanted, None)
+            rows = np.arange(part['nrows']) if mask is None else np.flatnonzero(mask)
+            for start in range(0, len(rows), batch_rows):
+                batch = rows[start:start + batch_rows]
+                pending.append({col: self._load(part, col)[batch] for col in columns})
+                n_pending += len(batch)
+                if n_pending >= batch_rows:
+                    yield self._frame({col: np.concatenate([p[col] for p in pending]) for col in columns}, columns)
+                    pending, n_pending = [], 0
+        if n_pending:
+            yield self._frame({col: np.concatenate([p[col] for p in pending]) for col in columns}, columns)
+
+    def dimension_table(self, columns):
+        """Build the table of distinct value combinations of some columns.
+
+        Distinct combinations are found per partition and then merged, so this never
+        holds more than one partition's worth of the columns.
+
+        Args:
+            columns (list): the columns, e.g. the slicers
+        Returns:
+            dims (pandas DataFrame): one row per distinct combination of columns
+
+        """
+        tables = []
+        for part in self.partitions:
+            arrays = self._scan([part], {}, columns, None)
+            tables.append(pd.DataFrame(arrays, columns=columns).drop_duplicates())
+        codes = pd.concat(tables, ignore_index=True).drop_duplicates() if tables else \
+            pd.DataFrame({col: np.zeros(0, self._dtypes[col]) for col in columns}, columns=columns)
+        return self._frame({col: codes[col].values for col in columns}, columns).reset_index(drop=True)
+
+    def value_counts(self, column):
+        """Count the rows of each value of a column, most frequent first.
+
+        Args:
+            column (str): the column to count
+        Returns:
+            counts (pandas Series): value -> number of rows, values that never occur left out
+
+        """
+        if column in self.by:
+            counts = {}
+            for part in self.partitions:
+                key = part['key'][self.by.index(column)]
+                if key is not None:
+                    counts[key] = counts.get(key, 0) + part['nrows']
+            counts = pd.Series(counts, dtype='int64')
+        elif column in self._categories:
+            total = np.zeros(len(self._categories[column]), dtype='int64')
+            for part in self.partitions:
+                codes = self._load(part, column)
+                total += np.bincount(codes[codes >= 0], minlength=len(total))
+            counts = pd.Series(total, index=self._categories[column])
+            counts = counts[counts > 0]
+        else:
+            counts = pd.concat([pd.Series(self._load(part, column)).value_counts() for part in self.partitions])
+            counts = counts.groupby(level=0).sum()
+        return counts.sort_values(ascending=False, kind='mergesort')
+
+
+class InMemoryDataset(object):
+    """The PartitionedDataset query interface over a dataframe that's already loaded.
+
+    Filters use a SlicerIndex over the slicer columns and box queries a GridIndex, so
+    the callbacks run the same way over the snapshot and over a partitioned dataset.
+
+    Args:
+        df (pandas DataFrame): the whole dataset, e.g. from load_snapshot
+        columns (list): the columns filters can be on
+        lat_lon (tuple): the latitude and longitude columns box queries filter on
+
+    """
+    def __init__(self, df, columns, lat_lon=LAT_LON_COLUMNS):
+        self.df = df
+        self.columns = list(df.columns)
+        self.index = SlicerIndex(df, columns)
+        self.grid = GridIndex(df[lat_lon[0]].values, df[lat_lon[1]].values)
+
+    def rows(self, filters, box=None):
+        """Positions of the rows matching every filter and the box, None for every row."""
+        rows = self.index.rows(filters)
+        if box is not None:
+            in_box = self.grid.query(*box)
+            rows = in_box if rows is None else np.intersect1d(rows, in_box, assume_unique=True)
+        return rows
+
+    def read(self, filters, columns=None, box=None):
+        """Read the rows matching every filter, see PartitionedDataset.read."""
+        columns = list(columns or self.columns)
+        rows = self.rows(filters, box)
+        if rows is None:
+            return self.df[columns]
+        return pd.DataFrame({col: self.df[col].values.take(rows) for col in columns}, columns=columns)
+
+    def chunks(self, filters, columns=None, by='year'):
+        """Read the rows matching every filter as a single chunk, see PartitionedDataset.chunks."""
+        df = self.read(filters, columns)
+        if len(df):
+            yield df
+
+    def batches(self, filters, columns=None, batch_rows=BATCH_ROWS):
+        """Read the rows matching every filter in batches, see PartitionedDataset.batches."""
+        columns = list(columns or self.columns)
+        rows = self.rows(filters)
+        n_rows = len(self.df) if rows is None else len(rows)
+        for start in range(0, n_rows, batch_rows):
+            stop = min(start + batch_rows, n_rows)
+            batch = np.arange(start, stop) if rows is None else rows[start:stop]
+            yield pd.DataFrame({col: self.df[col].values.take(batch) for col in columns}, columns=columns)
+
+    def dimension_table(self, columns):
+        """Build the table of distinct value combinations of some columns."""
+        return dimension_table(self.df, columns)
+
+    def value_counts(self, column):
+        """Count the rows of each value of a column, most frequent first."""
+        counts = self.df[column].value_counts()
+        return counts[counts > 0]
@@ -0,0 +1,164 @@
+# compact encoding of the figure callbacks' responses
+#
+# plotly's json encoder writes every float as up to ~18 characters of decimal text and
+# every hover string in full. large numeric arrays are sent instead as base64 typed
+# buffers, in the {'dtype', 'bdata'} layout newer plotly versions use, and repeated
+# strings as their distinct values plus codes. assets/payloads.js turns a payload back
+# into a plain figure in the browser, so it works with any plotly.js version.
+
+import base64
+
+import numpy as np
+import pandas as pd
+
+# arrays shorter than this are left as plain lists, the encoding doesn't pay off
+MIN_ENCODED_LENGTH = 32
+
+# attributes that only position or style points, where float32 is precise enough
+LOSSY_KEYS = ('lat', 'lon', 'size', 'color')
+
+# floats with at most this many decimals are sent exactly, as scaled integers
+MAX_DECIMALS = 6
+
+
+def encode_array(values, lossy=False):
+    """Encode a numeric array as a base64 typed buffer.
+
+    Integers get the smallest integer type that holds them. Floats with few decimals
+    (rounded coordinates, counts) are sent exactly as integers times 10 ** -decimals,
+    with the integer type's minimum standing for null. Other floats go as float32 if
+    lossy, otherwise float64. None and NaN both decode as null.
+
+    Args:
+        values (array like): the numbers, None allowed
+        lossy (bool): whether float32 rounding is acceptable
+    Returns:
+        encoded (dict): 'dtype' (numpy style, e.g. 'f4'), 'bdata' (base64 little endian
+            bytes) and for scaled integers 'decimals'
+
+    """
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = np.array([np.nan if v is None else v for v in values], dtype='float64')
+    if values.dtype.kind == 'b':
+        values = values.astype('uint8')
+
+    encoded = {}
+    if values.dtype.kind in 'iu':
+        dtype = _int_dtype(values, 0)
+    else:
+        missing = np.isnan(values)
+        decimals = _decimals(values[~missing])
+        if decimals is not None:
+            values = np.round(values * 10.0 ** decimals)
+            dtype = _int_dtype(values[~missing], 1)
+            values[missing] = np.iinfo(dtype).min
+            encoded['decimals'] = decimals
+        else:
+            dtype = 'f4' if lossy else 'f8'
+
+    data = np.ascontiguousarray(values, dtype='<' + dtype)
+    encoded.update({'dtype': dtype, 'bdata': base64.b64encode(data.tobytes()).decode('ascii')})
+    return encoded
+
+
+def _int_dtype(values, reserved):
+    # smallest int type holding values, keeping its lowest reserved values free
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    for dtype in ('i1', 'i2', 'i4'):
+        info = np.iinfo(dtype)
+        if info.min + reserved <= low and high <= info.max:
+            return dtype
+    return 'f8'
+
+
+def _decimals(values):
+    # the fewest decimals that represent every value exactly, None if there's no such number
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10.0 ** decimals
+        scaled = np.round(values * scale)
+        if np.abs(scaled).max(initial=0) > np.iinfo('i4').max - 1:
+            return None
+        # dividing back is exact in javascript too, both are ieee doubles
+        if (scaled / scale == values).all():
+            return decimals
+    return None
+
+
+def encode_strings(values):
+    """Encode an array of strings as its distinct values plus an integer code per item.
+
+    Args:
+        values (array like): the strings, e.g. a (categorical) Series column
+    Returns:
+        encoded (dict): 'values' (the distinct strings) and 'codes' (encode_array of the
+            codes, -1 for missing)
+
+    """
+    codes, uniques = pd.factorize(values)
+    return {'values': [str(v) for v in uniques], 'codes': encode_array(codes)}
+
+
+def encode_text(parts):
+    """Encode per-point text built by joining constant and per-point parts.
+
+    Each per-point part is dictionary encoded on its own, so repeated route names and
+    leg descriptions are sent once however many points share them.
+
+    Args:
+        parts (list): constant strings and per-point string arrays, in order
+    Returns:
+        encoded (dict): 'join', the parts with the arrays encode_strings encoded
+
+    """
+    return {'join': [part if isinstance(part, str) else encode_strings(part) for part in parts]}
+
+
+def encode_figure(figure, lossy_keys=LOSSY_KEYS):
+    """Encode a figure's long numeric and repetitive string arrays.
+
+    Args:
+        figure (dict): 'data' (plotly traces or dicts) and 'layout' (go.Layout or dict)
+        lossy_keys (tuple): attribute names whose floats may be sent as float32
+    Returns:
+        payload (dict): the figure as plain json-able values, for assets/payloads.js
+
+    """
+    return {
+        'data': [_encode(_plain(trace), None, lossy_keys) for trace in figure['data']],
+        'layout': _encode(_plain(figure['layout']), None, lossy_keys)
+    }
+
+
+def _plain(obj):
+    return obj.to_plotly_json() if hasattr(obj, 'to_plotly_json') else obj
+
+
+def _encode(obj, key, lossy_keys):
+    if isinstance(obj, dict):
+        return {k: _encode(_plain(v), k, lossy_keys) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, np.ndarray, pd.Series, pd.Index)):
+        if len(obj) >= MIN_ENCODED_LENGTH:
+            encoded = _encode_values(np.asarray(obj, dtype=object if isinstance(obj, (list, tuple)) else None),
+                                     key in lossy_keys)
+            if encoded is not None:
+                return encoded
+        return [_encode(_plain(v), key, lossy_keys) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _encode_values(values, lossy):
+    # None if the array is better left as a plain list
+    if values.ndim != 1:
+        return None
+    if values.dtype.kind in 'biuf':
+        return encode_array(values, lossy)
+    if values.dtype.kind != 'O':
+        values = values.astype(object)
+    if all(v is None or isinstance(v, (int, float, np.number)) for v in values):
+        return encode_array(values, lossy)
+    if all(isinstance(v, str) for v in values) and len(pd.unique(values)) * 2 <= len(values):
+        return encode_strings(values)
+    return None
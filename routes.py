@@ -0,0 +1,340 @@
+# route segment layer for the map, simplified ahead of time for every zoom range
+#
+# the .dbf/.shp files only hold the count stations as points, so a route's line is the
+# chain of its stations in a county, in milepoint order. each chain is simplified with
+# douglas-peucker once per zoom level at build time, with a tolerance of about a pixel
+# at that zoom, so a callback only picks the level for the current zoom, colors each
+# simplified segment by the mean of the stations it spans and batches the segments into
+# one line trace per color class.
+
+import json
+import os
+
+import numpy as np
+from plotly import colors as plotly_colors
+from plotly import graph_objs as go
+
+from filtering import is_all
+from spatial import DEGREES_PER_PIXEL_Z0
+
+ROUTE_LAYER_PATH = './data/route_layer.npz'
+
+# bump this whenever the on-disk layout or the simplification changes. 2 simplifies at
+# mapbox gl's 512px tile scale, layers from before it are simplified twice as much
+ROUTE_LAYER_VERSION = 2
+
+# a route's stations within a county form one line, in milepoint order
+LINE_COLUMNS = ['county_name', 'route_type', 'route']
+ORDER_COLUMN = 'route_mile_point'
+
+# values segments can be colored by
+VALUE_COLUMNS = ['average_daily_traffic', 'log10_adt', 'total_pct_change', 'trend_growth']
+
+# every column RouteLayer.build reads
+SOURCE_COLUMNS = LINE_COLUMNS + [ORDER_COLUMN, 'latitude', 'longitude'] + VALUE_COLUMNS
+
+# zooms a simplified level is made for, a level serves every zoom up to its own.
+# past the last one the lines are drawn with every station
+ZOOM_LEVELS = [5, 7, 9, 11]
+
+# simplification tolerance, in screen pixels
+TOLERANCE_PX = 1.0
+
+
+def mercator(lat, lon):
+    """Project lat/long onto web mercator, in degrees so x is the longitude.
+
+    Args:
+        lat, lon (numpy array): the points, in degrees
+    Returns:
+        x, y (numpy array): the projected points, where a pixel is as long on both axes
+
+    """
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85, 85)
+    y = np.degrees(np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)))
+    return np.asarray(lon, dtype='float64'), y
+
+
+def pixel_degrees(zoom):
+    """Size of a screen pixel at a zoom level, in mercator degrees."""
+    return DEGREES_PER_PIXEL_Z0 / 2 ** zoom
+
+
+def douglas_peucker(x, y, starts, ends, tolerance):
+    """Simplify many polylines at once with the Douglas-Peucker algorithm.
+
+    Every pending span of every line is handled in the same numpy pass: the point
+    farthest from its span's chord is kept if it's more than tolerance away, splitting
+    the span in two, so the number of passes is the depth of the recursion rather than
+    the number of points.
+
+    Args:
+        x, y (numpy array): the points of all the lines, each line's points contiguous
+        starts, ends (numpy array): first and last point of each line
+        tolerance (float): largest allowed distance of a dropped point from the
+            simplified line, in x/y units
+    Returns:
+        keep (numpy array): True for the points of the simplified lines
+
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    lo = np.asarray(starts, dtype='int64')
+    hi = np.asarray(ends, dtype='int64')
+    while True:
+        # spans with points between their ends
+        open_ = hi - lo > 1
+        lo, hi = lo[open_], hi[open_]
+        if len(lo) < 1:
+            return keep
+        lengths = hi - lo - 1
+        span = np.repeat(np.arange(len(lo)), lengths)
+        # interior point positions, lo + 1 ... hi - 1 of each span
+        points = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + lo[span] + 1
+
+        x0, y0, x1, y1 = x[lo][span], y[lo][span], x[hi][span], y[hi][span]
+        dx, dy = x1 - x0, y1 - y0
+        norm = np.hypot(dx, dy)
+        # distance to the chord, or to its start when both ends are the same point
+        distance = np.where(norm > 0,
+                            np.abs(dx * (y0 - y[points]) - dy * (x0 - x[points])) / np.where(norm > 0, norm, 1),
+                            np.hypot(x[points] - x0, y[points] - y0))
+
+        offsets = np.cumsum(lengths) - lengths
+        farthest = np.maximum.reduceat(distance, offsets)
+        split = farthest > tolerance
+        # the first point reaching the max in each span
+        is_max = distance == farthest[span]
+        first_max = np.full(len(lo), -1, dtype='int64')
+        first_max[span[is_max][::-1]] = points[is_max][::-1]
+        pivot = first_max[split]
+        keep[pivot] = True
+        lo, hi = np.concatenate([lo[split], pivot]), np.concatenate([pivot, hi[split]])
+
+
+def _jet(fractions):
+    # plotly's Jet colorscale at each fraction, as rgb strings
+    stops = plotly_colors.PLOTLY_SCALES['Jet']
+    at = np.array([s[0] for s in stops], dtype='float64')
+    rgb = np.array([plotly_colors.unlabel_rgb(s[1]) for s in stops], dtype='float64')
+    channels = [np.interp(fractions, at, rgb[:, c]) for c in range(3)]
+    return ['rgb({:.0f},{:.0f},{:.0f})'.format(*c) for c in zip(*channels)]
+
+
+class RouteLayer(object):
+    """The route lines of one year, with their simplified levels.
+
+    Args:
+        lines (dict): per line: the LINE_COLUMNS values, 'start' and 'end' (its first
+            and last point) and 'south', 'west', 'north', 'east' (its bounding box)
+        points (dict): per point: 'latitude', 'longitude' and the VALUE_COLUMNS
+        levels (dict): zoom -> which points the level keeps
+
+    """
+    def __init__(self, lines, points, levels):
+        self.lines = lines
+        self.points = points
+        self.levels = levels
+        self.zooms = sorted(levels)
+
+    @classmethod
+    def build(cls, df, zooms=ZOOM_LEVELS, tolerance_px=TOLERANCE_PX):
+        """Chain the stations of one year into route lines and simplify them for each zoom level.
+
+        Args:
+            df (pandas DataFrame): one row per station, e.g. the map year's rows
+            zooms (list): zooms to make a simplified level for
+            tolerance_px (float): simplification tolerance, in pixels at each level's zoom
+        Returns:
+            layer (RouteLayer): the lines, lines with a single station left out
+
+        """
+        keys = [df[col].astype(object).values for col in LINE_COLUMNS]
+        valid = np.isfinite(df[ORDER_COLUMN].values) & np.isfinite(df['latitude'].values) & \
+            np.isfinite(df['longitude'].values)
+        for key in keys:
+            valid &= np.array([isinstance(v, str) for v in key])
+        rows = np.flatnonzero(valid)
+        order = np.lexsort([df[ORDER_COLUMN].values[rows]] + [key[rows].astype(str) for key in keys[::-1]])
+        rows = rows[order]
+
+        # a line starts wherever a key changes
+        new_line = np.ones(len(rows), dtype=bool)
+        if len(rows):
+            new_line[1:] = np.any([key[rows][1:] != key[rows][:-1] for key in keys], axis=0)
+        starts = np.flatnonzero(new_line)
+        ends = np.append(starts[1:], len(rows)) - 1
+        # single stations have nothing to draw
+        long_lines = ends > starts
+        line_of_point = np.repeat(long_lines, ends - starts + 1)
+        rows = rows[line_of_point]
+        starts, ends = starts[long_lines], ends[long_lines]
+        lengths = ends - starts + 1
+        starts = np.cumsum(lengths) - lengths
+        ends = starts + lengths - 1
+
+        lat = df['latitude'].values[rows].astype('float64')
+        lon = df['longitude'].values[rows].astype('float64')
+        points = {'latitude': lat, 'longitude': lon}
+        for col in VALUE_COLUMNS:
+            points[col] = df[col].values[rows].astype('float64')
+
+        lines = {col: df[col].astype(object).values[rows[starts]].astype(str) for col in LINE_COLUMNS}
+        lines['start'], lines['end'] = starts, ends
+        offsets = starts if len(starts) else np.zeros(1, dtype='int64')
+        for name, func, values in [('south', np.minimum, lat), ('west', np.minimum, lon),
+                                   ('north', np.maximum, lat), ('east', np.maximum, lon)]:
+            lines[name] = func.reduceat(values, offsets)[:len(starts)] if len(values) else np.zeros(0)
+
+        x, y = mercator(lat, lon)
+        levels = {zoom: douglas_peucker(x, y, starts, ends, tolerance_px * pixel_degrees(zoom)) for zoom in zooms}
+        return cls(lines, points, levels)
+
+    def save(self, path=ROUTE_LAYER_PATH):
+        """Write the layer as one .npz, swapped in so readers never see a partial write."""
+        arrays = {'line_' + k: v for k, v in self.lines.items()}
+        arrays.update({'point_' + k: v for k, v in self.points.items()})
+        arrays.update({'level_{}'.format(zoom): keep for zoom, keep in self.levels.items()})
+        arrays['meta'] = np.array(json.dumps({'version': ROUTE_LAYER_VERSION, 'zooms': self.zooms}))
+        tmp_path = '{}.tmp{}.npz'.format(path, os.getpid())
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def version(path=ROUTE_LAYER_PATH):
+        """The layout version a layer was written with, None if there's no layer."""
+        try:
+            with np.load(path) as f:
+                return json.loads(str(f['meta']))['version']
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def load(cls, path=ROUTE_LAYER_PATH):
+        """Read a layer written by save.
+
+        Raises:
+            ValueError: if the layer was written with another layout version
+
+        """
+        with np.load(path) as f:
+            meta = json.loads(str(f['meta']))
+            if meta['version'] != ROUTE_LAYER_VERSION:
+                raise ValueError('route layer version {} is not {}, rebuild it with RouteLayer.build'
+                                 .format(meta['version'], ROUTE_LAYER_VERSION))
+            lines = {k[len('line_'):]: f[k] for k in f.files if k.startswith('line_')}
+            points = {k[len('point_'):]: f[k] for k in f.files if k.startswith('point_')}
+            levels = {zoom: f['level_{}'.format(zoom)] for zoom in meta['zooms']}
+        return cls(lines, points, levels)
+
+    def level(self, zoom):
+        """Which points to draw at a zoom: the coarsest level made for it or a closer zoom."""
+        for level_zoom in self.zooms:
+            if zoom <= level_zoom:
+                return self.levels[level_zoom]
+        return np.ones(len(self.points['latitude']), dtype=bool)
+
+    def select(self, filters, box=None):
+        """Find the lines matching every filter whose bounding box meets the box.
+
+        Args:
+            filters (dict): LINE_COLUMNS column -> list of selected values, 'ALL' or [] for no filter
+            box (tuple): south, west, north, east edges, or None
+        Returns:
+            lines (numpy array): positions of the matching lines
+
+        """
+        mask = np.ones(len(self.lines['start']), dtype=bool)
+        for col, values in filters.items():
+            if not is_all(values):
+                mask &= np.isin(self.lines[col], [str(v) for v in values])
+        if box is not None:
+            south, west, north, east = box
+            mask &= (self.lines['north'] >= south) & (self.lines['south'] <= north) & \
+                (self.lines['east'] >= west) & (self.lines['west'] <= east)
+        return np.flatnonzero(mask)
+
+    def segments(self, lines, column, zoom):
+        """The simplified segments of some lines at a zoom, with their values.
+
+        Args:
+            lines (numpy array): positions of the lines, e.g. from select
+            column (str): one of VALUE_COLUMNS
+            zoom (float): the map's zoom
+        Returns:
+            a, b (numpy array): first and last point of each segment
+            values (numpy array): mean of the finite values of the points each segment
+                spans, NaN if there are none
+
+        """
+        starts, ends = self.lines['start'][lines], self.lines['end'][lines]
+        lengths = ends - starts + 1
+        points = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + \
+            np.repeat(starts, lengths)
+        kept = points[self.level(zoom)[points]]
+        # consecutive kept points of the same line make a segment
+        same_line = np.searchsorted(ends, kept[:-1], side='left') == np.searchsorted(ends, kept[1:], side='left')
+        a, b = kept[:-1][same_line], kept[1:][same_line]
+
+        values = self.points[column]
+        finite = np.isfinite(values)
+        total = np.concatenate([[0], np.cumsum(np.where(finite, values, 0))])
+        count = np.concatenate([[0], np.cumsum(finite)])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (total[b + 1] - total[a]) / (count[b + 1] - count[a])
+        return a, b, means
+
+    def traces(self, filters, column, zoom, cmin, cmax, box=None, n_classes=12, width=3):
+        """Draw the matching lines at a zoom, one line trace per color class.
+
+        Segments are binned into n_classes equal classes between cmin and cmax and
+        colored with the Jet colorscale like the station markers. Within a class,
+        segments that join end to end are drawn as one run, and runs are separated by
+        gaps, so the trace count doesn't grow with the number of lines.
+
+        Args:
+            filters (dict): LINE_COLUMNS column -> list of selected values, 'ALL' or [] for no filter
+            column (str): one of VALUE_COLUMNS to color by
+            zoom (float): the map's zoom
+            cmin, cmax (float): the values at the ends of the colorscale
+            box (tuple): south, west, north, east edges to draw lines near, or None
+            n_classes (int): number of color classes
+            width (float): line width, in pixels
+        Returns:
+            traces (list): plotly Scattermapbox line traces, segments without a value left out
+
+        """
+        a, b, values = self.segments(self.select(filters, box), column, zoom)
+        drawn = np.isfinite(values)
+        a, b, values = a[drawn], b[drawn], values[drawn]
+
+        span = cmax - cmin if cmax > cmin else 1.0
+        classes = np.clip(((values - cmin) / span * n_classes).astype('int64'), 0, n_classes - 1)
+        class_colors = _jet((np.arange(n_classes) + 0.5) / n_classes)
+        lat, lon = self.points['latitude'], self.points['longitude']
+
+        traces = []
+        for c in np.unique(classes):
+            ca, cb = a[classes == c], b[classes == c]
+            # a run goes on as long as each segment starts where the previous one ended
+            new_run = np.ones(len(ca), dtype=bool)
+            new_run[1:] = ca[1:] != cb[:-1]
+            # a gap and the run's first point before a new run, then every segment's end
+            counts = 1 + 2 * new_run
+            counts[0] -= 1
+            path = np.full(counts.sum(), -1, dtype='int64')
+            end_pos = np.cumsum(counts) - 1
+            path[end_pos] = cb
+            path[end_pos[new_run] - 1] = ca[new_run]
+            gap = path < 0
+            low = cmin + span * c / n_classes
+            traces.append(go.Scattermapbox(
+                lat=np.where(gap, np.nan, lat[path]),
+                lon=np.where(gap, np.nan, lon[path]),
+                mode='lines',
+                line=dict(color=class_colors[c], width=width),
+                name='{:,.2f} to {:,.2f}'.format(low, low + span / n_classes),
+                hoverinfo='name'
+            ))
+        return traces
@@ -0,0 +1,226 @@
+# point geometry reader for the yearly count station shapefiles
+#
+# the .shx index gives the byte offset of every record in the .shp, so the coordinates
+# of all the points are gathered from the memory-mapped file in one fancy-indexing pass,
+# and projected coordinates are converted back to lat/long with the .prj's parameters.
+
+import numpy as np
+import os
+import re
+import struct
+
+# shape types whose first x/y pair sits right after the shape type
+POINT_TYPES = (1, 11, 21)
+# shape types with a bounding box and a point count before their first x/y pair
+MULTIPOINT_TYPES = (8, 18, 28)
+
+
+class ShpReader(object):
+    """Read the points of a point or multipoint shapefile as numpy arrays.
+
+    Record i of the shapefile belongs to record i of the dbf file next to it. Multipoint
+    records are reduced to their first point, and null or non-point shapes come back as
+    NaN so the arrays always have one entry per record.
+
+    Args:
+        path (str): the .shp file, the .shx (and .prj, if any) must sit next to it
+    Attributes:
+        numrec (int): number of records, including null shapes
+        shape_type (int): the shape type declared in the file header
+        prj (dict): the parsed .prj, see read_prj, None if there is no .prj
+
+    """
+    def __init__(self, path):
+        self.path = path
+        base = os.path.splitext(path)[0]
+
+        with open(path, 'rb') as f:
+            header = f.read(100)
+        self.shape_type, = struct.unpack('<i', header[32:36])
+
+        # the index is big endian (offset, content length) pairs in 16 bit words
+        index = np.fromfile(base + '.shx', dtype='>i4', offset=100).reshape(-1, 2)
+        self.numrec = len(index)
+        # skip the 8 byte record header of each record
+        self._offsets = index[:, 0].astype('int64') * 2 + 8
+        self._lengths = index[:, 1].astype('int64') * 2
+
+        prj_path = base + '.prj'
+        self.prj = read_prj(prj_path) if os.path.isfile(prj_path) else None
+
+    def points(self):
+        """Get the coordinates of each record, in the file's own coordinate system.
+
+        Returns:
+            x (numpy array): float64 x (easting or longitude) of each record, NaN for null shapes
+            y (numpy array): float64 y (northing or latitude) of each record
+
+        """
+        x = np.full(self.numrec, np.nan)
+        y = np.full(self.numrec, np.nan)
+        if not self.numrec:
+            return x, y
+
+        data = np.memmap(self.path, dtype='uint8', mode='r')
+        # records too short to hold a shape type are treated as null shapes
+        has_type = self._lengths >= 4
+        types = np.zeros(self.numrec, dtype='int32')
+        types[has_type] = _gather(data, self._offsets[has_type], 4).view('<i4').ravel()
+
+        # position of the first x/y pair inside each record, -1 if it has none
+        xy_at = np.full(self.numrec, -1, dtype='int64')
+        xy_at[np.isin(types, POINT_TYPES)] = 4
+        multi = np.isin(types, MULTIPOINT_TYPES) & (self._lengths >= 40)
+        n_points = np.zeros(self.numrec, dtype='int32')
+        n_points[multi] = _gather(data, self._offsets[multi] + 36, 4).view('<i4').ravel()
+        xy_at[multi & (n_points > 0)] = 40
+
+        found = (xy_at >= 0) & (self._lengths >= xy_at + 16)
+        xy = _gather(data, self._offsets[found] + xy_at[found], 16).view('<f8')
+        x[found] = xy[:, 0]
+        y[found] = xy[:, 1]
+        return x, y
+
+    def lat_long(self):
+        """Get the latitude and longitude of each record, reprojected if the .prj needs it.
+
+        Returns:
+            lat (numpy array): latitude of each record in degrees, NaN for null shapes
+            lon (numpy array): longitude of each record in degrees
+
+        """
+        x, y = self.points()
+        if self.prj is None or self.prj['projection'] is None:
+            return y, x
+        lon, lat = unproject(x, y, self.prj)
+        return lat, lon
+
+
+def _gather(data, offsets, size):
+    # (len(offsets) x size) copy of the bytes starting at each offset
+    return np.ascontiguousarray(data[offsets[:, None] + np.arange(size)])
+
+
+def read_prj(path):
+    """Parse the parts of an ESRI .prj file that unproject needs, see parse_prj."""
+    with open(path) as f:
+        return parse_prj(f.read())
+
+
+def parse_prj(wkt):
+    """Parse the parts of an ESRI .prj (WKT) string that unproject needs.
+
+    Args:
+        wkt (str): the contents of a .prj file
+    Returns:
+        prj (dict): 'projection' (None for plain lat/long), 'parameters' with lowercased
+            names, the spheroid's 'semi_major_axis' and 'inverse_flattening', and
+            'linear_unit' in meters per unit
+
+    """
+    projection = re.search(r'PROJECTION\["([^"]+)"', wkt)
+    spheroid = re.search(r'SPHEROID\["[^"]*",\s*([^,\]]+),\s*([^,\]]+)', wkt)
+    parameters = {
+        name.lower(): float(value) for name, value in re.findall(r'PARAMETER\["([^"]+)",\s*([^,\]]+)\]', wkt)
+    }
+    # the linear unit of a projected system is the last unit in the string
+    units = re.findall(r'UNIT\["[^"]*",\s*([^,\]]+)', wkt)
+
+    return {
+        'projection': projection.group(1) if projection else None,
+        'parameters': parameters,
+        'semi_major_axis': float(spheroid.group(1)) if spheroid else 6378137.0,
+        'inverse_flattening': float(spheroid.group(2)) if spheroid else 298.257222101,
+        'linear_unit': float(units[-1]) if projection and units else 1.0
+    }
+
+
+def unproject(x, y, prj):
+    """Convert projected coordinates back to longitude and latitude.
+
+    Only Lambert conformal conic (what SC DOT's state plane files use) is supported.
+    The datum shift from NAD83 to WGS84 is ignored, it's well under a meter.
+
+    Args:
+        x (numpy array): eastings, in the projection's linear unit
+        y (numpy array): northings, in the projection's linear unit
+        prj (dict): the output of read_prj
+    Returns:
+        lon (numpy array): longitude in degrees
+        lat (numpy array): latitude in degrees
+
+    """
+    lcc = _lcc_constants(prj)
+    e, n, rho0, scale, lam0 = lcc['e'], lcc['n'], lcc['rho0'], lcc['scale'], lcc['lam0']
+    p = prj['parameters']
+    unit = prj['linear_unit']
+
+    dx = (np.asarray(x, dtype='float64') - p.get('false_easting', 0.0)) * unit
+    dy = rho0 - (np.asarray(y, dtype='float64') - p.get('false_northing', 0.0)) * unit
+    sign = np.sign(n)
+    rho = sign * np.hypot(dx, dy)
+    theta = np.arctan2(sign * dx, sign * dy)
+    ts = (rho / scale) ** (1 / n)
+
+    # latitude has no closed form, iterate from the spherical solution, converges in a few steps
+    phi = np.pi / 2 - 2 * np.arctan(ts)
+    for _ in range(8):
+        s = e * np.sin(phi)
+        phi = np.pi / 2 - 2 * np.arctan(ts * ((1 - s) / (1 + s)) ** (e / 2))
+
+    return np.degrees(theta / n + lam0), np.degrees(phi)
+
+
+def project(lon, lat, prj):
+    """Convert longitude and latitude to projected coordinates, the inverse of unproject.
+
+    Args:
+        lon (numpy array): longitude in degrees
+        lat (numpy array): latitude in degrees
+        prj (dict): the output of read_prj
+    Returns:
+        x (numpy array): eastings, in the projection's linear unit
+        y (numpy array): northings, in the projection's linear unit
+
+    """
+    lcc = _lcc_constants(prj)
+    p = prj['parameters']
+    unit = prj['linear_unit']
+
+    rho = lcc['scale'] * lcc['t'](np.radians(np.asarray(lat, dtype='float64'))) ** lcc['n']
+    theta = lcc['n'] * (np.radians(np.asarray(lon, dtype='float64')) - lcc['lam0'])
+    x = rho * np.sin(theta) / unit + p.get('false_easting', 0.0)
+    y = (lcc['rho0'] - rho * np.cos(theta)) / unit + p.get('false_northing', 0.0)
+    return x, y
+
+
+def _lcc_constants(prj):
+    # ellipsoidal lambert conformal conic, Snyder (1987) "Map Projections: A Working Manual" p. 107
+    if prj['projection'] is None or prj['projection'].lower() != 'lambert_conformal_conic':
+        raise ValueError('Projection "{}" not yet supported.'.format(prj['projection']))
+
+    p = prj['parameters']
+    a = prj['semi_major_axis']
+    f = 1.0 / prj['inverse_flattening']
+    e = np.sqrt(2 * f - f * f)
+    k0 = p.get('scale_factor', 1.0)
+    phi0 = np.radians(p['latitude_of_origin'])
+    phi1 = np.radians(p.get('standard_parallel_1', p['latitude_of_origin']))
+    phi2 = np.radians(p.get('standard_parallel_2', np.degrees(phi1)))
+
+    def m(phi):
+        return np.cos(phi) / np.sqrt(1 - (e * np.sin(phi)) ** 2)
+
+    def t(phi):
+        s = e * np.sin(phi)
+        return np.tan(np.pi / 4 - phi / 2) / ((1 - s) / (1 + s)) ** (e / 2)
+
+    if np.isclose(phi1, phi2):
+        n = np.sin(phi1)
+    else:
+        n = (np.log(m(phi1)) - np.log(m(phi2))) / (np.log(t(phi1)) - np.log(t(phi2)))
+    # a * F * k0 in Snyder's notation
+    scale = a * m(phi1) / (n * t(phi1) ** n) * k0
+
+    return {'e': e, 'n': n, 't': t, 'scale': scale, 'rho0': scale * t(phi0) ** n,
+            'lam0': np.radians(p['central_meridian'])}
@@ -0,0 +1,133 @@
+# columnar, memory-mapped copy of the traffic dataframe
+#
+# every gunicorn worker unpickling bigframe.pkl gets its own private copy of the data.
+# the snapshot instead keeps each dtype's numeric columns as one fixed-width 2d .npy
+# and each string column as integer codes plus a list of categories, so workers can
+# np.load them with mmap_mode='r' and share a single page-cache copy.
+
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+
+from compact import compact_frame
+
+SNAPSHOT_DIR = './data/bigframe.snapshot'
+
+# bump this whenever the on-disk layout or the columns the app needs change. 3 added the
+# trend columns, snapshots from before them load fine and then fail on the Trend scale
+SNAPSHOT_VERSION = 3
+
+
+def _codes_dtype(n_categories):
+    # smallest signed int that can hold every code plus -1 for missing
+    for dtype in ('int8', 'int16', 'int32'):
+        if n_categories <= np.iinfo(dtype).max:
+            return dtype
+    return 'int64'
+
+
+def write_snapshot(df, snapshot_dir=SNAPSHOT_DIR):
+    """Write a dataframe as a memory-mappable columnar snapshot.
+
+    Numeric columns are grouped by dtype, each group stored as one (columns x rows)
+    array so a loaded frame has exactly one block per dtype and pandas never needs
+    to consolidate (copy) it. String columns are dictionary encoded. The frame is
+    compacted first, see compact_frame. The snapshot is built in a temp directory and
+    swapped in, so readers never see a partial write.
+
+    Args:
+        df (pandas DataFrame): the dataframe to write, e.g. the output of create_big_df
+        snapshot_dir (str): directory to write the snapshot to
+    Raises:
+        TypeError: if a column is neither numeric nor string
+
+    """
+    df = compact_frame(df)
+    tmp_dir = '{}.tmp{}'.format(snapshot_dir, os.getpid())
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    meta = {'version': SNAPSHOT_VERSION, 'nrows': len(df), 'blocks': [], 'categoricals': []}
+
+    numeric_cols = {}
+    for col, dtype in df.dtypes.items():
+        if dtype.kind in 'biuf':
+            numeric_cols.setdefault(dtype.name, []).append(col)
+        elif dtype.name in ('object', 'category'):
+            cat = pd.Categorical(df[col])
+            file = 'cat{}.npy'.format(len(meta['categoricals']))
+            np.save(os.path.join(tmp_dir, file), cat.codes.astype(_codes_dtype(len(cat.categories))))
+            meta['categoricals'].append({
+                'column': col,
+                'file': file,
+                'categories': [str(c) for c in cat.categories]
+            })
+        else:
+            raise TypeError('column {} has unsupported dtype {}'.format(col, dtype))
+
+    for dtype, cols in numeric_cols.items():
+        file = 'block{}.npy'.format(len(meta['blocks']))
+        np.save(os.path.join(tmp_dir, file), np.ascontiguousarray(df[cols].values.T, dtype=dtype))
+        meta['blocks'].append({'columns': cols, 'file': file, 'dtype': dtype})
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # workers that already mapped the old files keep them alive until they exit
+    old_dir = '{}.old{}'.format(snapshot_dir, os.getpid())
+    if os.path.isdir(snapshot_dir):
+        os.rename(snapshot_dir, old_dir)
+    os.rename(tmp_dir, snapshot_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def snapshot_version(snapshot_dir=SNAPSHOT_DIR):
+    """The layout version a snapshot was written with.
+
+    Args:
+        snapshot_dir (str): directory written by write_snapshot
+    Returns:
+        version (int): the version, None if there's no snapshot
+
+    """
+    try:
+        with open(os.path.join(snapshot_dir, 'meta.json')) as f:
+            return json.load(f)['version']
+    except FileNotFoundError:
+        return None
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """Open a snapshot read-only without copying the data into process memory.
+
+    Loading only reads meta.json and maps the arrays, so it takes the same time no
+    matter how many rows there are. Columns come back grouped by dtype rather than in
+    the order they were written, and string columns come back as categoricals.
+
+    Args:
+        snapshot_dir (str): directory written by write_snapshot
+    Returns:
+        df (pandas DataFrame): a read-only dataframe backed by the mapped files
+
+    """
+    with open(os.path.join(snapshot_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != SNAPSHOT_VERSION:
+        raise ValueError('snapshot version {} is not {}, rebuild it with write_snapshot'
+                         .format(meta['version'], SNAPSHOT_VERSION))
+
+    frames = []
+    for block in meta['blocks']:
+        values = np.load(os.path.join(snapshot_dir, block['file']), mmap_mode='r')
+        # the transpose is a view, and pandas stores it transposed back as its block
+        frames.append(pd.DataFrame(values.T, columns=block['columns'], copy=False))
+
+    for cat in meta['categoricals']:
+        codes = np.load(os.path.join(snapshot_dir, cat['file']), mmap_mode='r')
+        frames.append(pd.DataFrame({
+            cat['column']: pd.Categorical.from_codes(codes, categories=cat['categories'])
+        }))
+
+    return pd.concat(frames, axis=1, copy=False)
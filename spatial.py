@@ -0,0 +1,295 @@
+# spatial helpers for the map: a uniform lat/long grid index and viewport handling
+
+import numpy as np
+import math
+
+# mean earth radius used by haversine_np, in km
+EARTH_RADIUS_KM = 6367.0
+
+# mapbox renders 512px tiles, so one pixel spans this many degrees of longitude at zoom 0
+DEGREES_PER_PIXEL_Z0 = 360.0 / 512.0
+
+
+class GridIndex(object):
+    """Uniform lat/long grid over a set of points, for bounding box, radius and knn queries.
+
+    Row ids are sorted by cell once, with cells numbered row-major, so all the cells of
+    one grid row inside a box are a single contiguous slice.
+
+    Args:
+        lat (numpy array): latitude of each row, NaNs are never returned
+        lon (numpy array): longitude of each row
+        cell_deg (float): width and height of a grid cell, in degrees
+
+    """
+    def __init__(self, lat, lon, cell_deg=0.1):
+        self.lat = np.asarray(lat, dtype='float64')
+        self.lon = np.asarray(lon, dtype='float64')
+        self.cell_deg = cell_deg
+
+        valid = ~(np.isnan(self.lat) | np.isnan(self.lon))
+        if valid.any():
+            self.lat0 = self.lat[valid].min()
+            self.lon0 = self.lon[valid].min()
+            self.n_rows = int((self.lat[valid].max() - self.lat0) // cell_deg) + 1
+            self.n_cols = int((self.lon[valid].max() - self.lon0) // cell_deg) + 1
+        else:
+            self.lat0 = self.lon0 = 0.0
+            self.n_rows = self.n_cols = 1
+
+        cells = np.full(len(self.lat), -1, dtype='int64')
+        cells[valid] = self._cell_row(self.lat[valid]) * self.n_cols + self._cell_col(self.lon[valid])
+        order = np.argsort(cells, kind='mergesort')
+        self.order = order[(~valid).sum():].astype('int32')
+        counts = np.bincount(cells[valid], minlength=self.n_rows * self.n_cols)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def _cell_row(self, lat):
+        return np.clip(((lat - self.lat0) // self.cell_deg).astype('int64'), 0, self.n_rows - 1)
+
+    def _cell_col(self, lon):
+        return np.clip(((lon - self.lon0) // self.cell_deg).astype('int64'), 0, self.n_cols - 1)
+
+    def _candidates(self, south, west, north, east):
+        # (box, row) pairs for every point in the cells each box touches, for arrays of boxes.
+        # each grid row of a box is one contiguous slice of order, so expand (box, grid row)
+        # pairs into slices and the slices into rows without a python loop
+        i0, i1 = self._cell_row(south), self._cell_row(north)
+        j0, j1 = self._cell_col(west), self._cell_col(east)
+        n_grid_rows = i1 - i0 + 1
+        box = np.repeat(np.arange(len(south)), n_grid_rows)
+        grid_row = i0[box] + _ranks(n_grid_rows)
+        lo = self.offsets[grid_row * self.n_cols + j0[box]]
+        hi = self.offsets[grid_row * self.n_cols + j1[box] + 1]
+        counts = hi - lo
+        return np.repeat(box, counts), self.order[np.repeat(lo, counts) + _ranks(counts)]
+
+    def query_radius(self, lat, lon, radius_km, batch_size=4096):
+        """Find every point within radius_km of each query point.
+
+        Queries are answered batch_size at a time, so memory grows with the number of
+        matches rather than with queries x points. For several radii, query once with
+        the largest and filter the distances.
+
+        Args:
+            lat (numpy array): latitude of each query point
+            lon (numpy array): longitude of each query point
+            radius_km (float): great circle search radius, in km
+            batch_size (int): query points handled at a time
+        Returns:
+            queries (numpy array): position of the query point of each match
+            rows (numpy array): row position of the matched point
+            distance_km (numpy array): distance between the two, matches are sorted by
+                query and then distance
+
+        """
+        lat = np.asarray(lat, dtype='float64')
+        lon = np.asarray(lon, dtype='float64')
+        # a box that surely holds the circle, longitude degrees shrink with cos(lat)
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        queries, rows, distances = [], [], []
+        for start in range(0, len(lat), batch_size):
+            q = start + np.flatnonzero(~np.isnan(lat[start:start + batch_size]) & ~np.isnan(lon[start:start + batch_size]))
+            dlon = dlat / np.cos(np.radians(np.minimum(np.abs(lat[q]) + dlat, 89.0)))
+            box, candidates = self._candidates(lat[q] - dlat, lon[q] - dlon, lat[q] + dlat, lon[q] + dlon)
+            q = q[box]
+            d = haversine_np(lon[q], lat[q], self.lon[candidates], self.lat[candidates])
+            keep = d <= radius_km
+            queries.append(q[keep])
+            rows.append(candidates[keep])
+            distances.append(d[keep])
+
+        queries, rows, distances = [np.concatenate(a) if a else np.zeros(0, t) for a, t in
+                                    zip([queries, rows, distances], ['int64', 'int32', 'float64'])]
+        order = np.lexsort((distances, queries))
+        return queries[order], rows[order], distances[order]
+
+    def query_knn(self, lat, lon, k, max_radius_km=None, batch_size=4096):
+        """Find the k nearest points to each query point.
+
+        Runs radius queries with a doubling radius, a query is settled as soon as its
+        circle holds k points since nothing outside can be nearer.
+
+        Args:
+            lat (numpy array): latitude of each query point
+            lon (numpy array): longitude of each query point
+            k (int): number of neighbours per query point
+            max_radius_km (float): never look further than this, fewer than k matches
+                are returned for queries without k points within it
+            batch_size (int): query points handled at a time
+        Returns:
+            queries, rows, distance_km (numpy array): as for query_radius, at most k per query
+
+        """
+        lat = np.asarray(lat, dtype='float64')
+        lon = np.asarray(lon, dtype='float64')
+        # a circle around the whole earth holds every point
+        limit = math.pi * EARTH_RADIUS_KM if max_radius_km is None else max_radius_km
+        radius = min(limit, self.cell_deg * 111.0)
+        pending = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lon))
+        queries, rows, distances = [], [], []
+        while len(pending):
+            q, r, d = self.query_radius(lat[pending], lon[pending], radius, batch_size)
+            counts = np.bincount(q, minlength=len(pending))
+            settled = (counts >= k) | (radius >= limit)
+            keep = settled[q] & (_ranks(counts) < k)
+            queries.append(pending[q[keep]])
+            rows.append(r[keep])
+            distances.append(d[keep])
+            pending = pending[~settled]
+            radius = min(limit, radius * 2)
+
+        queries, rows, distances = [np.concatenate(a) if a else np.zeros(0, t) for a, t in
+                                    zip([queries, rows, distances], ['int64', 'int32', 'float64'])]
+        order = np.lexsort((distances, queries))
+        return queries[order], rows[order], distances[order]
+
+    def query(self, south, west, north, east):
+        """Find the rows whose point falls inside a bounding box.
+
+        Args:
+            south, west, north, east (float): the box edges, in degrees
+        Returns:
+            rows (numpy array): sorted row positions inside the box
+
+        """
+        i0, i1 = self._cell_row(np.array([south, north]))
+        j0, j1 = self._cell_col(np.array([west, east]))
+        rows = np.concatenate([
+            self.order[self.offsets[i * self.n_cols + j0]:self.offsets[i * self.n_cols + j1 + 1]]
+            for i in range(i0, i1 + 1)
+        ] or [self.order[:0]])
+        lat, lon = self.lat[rows], self.lon[rows]
+        rows = rows[(lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)]
+        rows.sort()
+        return rows
+
+
+def _ranks(counts):
+    # 0..count-1 for each count, concatenated
+    counts = np.asarray(counts, dtype='int64')
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def haversine_np(lon1, lat1, lon2, lat2):
+    """Calculate the great circle distance between points, in km.
+
+    Args:
+        lon1, lat1 (numpy array): the first points, in decimal degrees
+        lon2, lat2 (numpy array): the second points, same length as the first
+    Returns:
+        km (numpy array): distance between each pair of points
+
+    """
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+
+    c = 2 * np.arcsin(np.sqrt(a))
+    return EARTH_RADIUS_KM * c
+
+
+def viewport_from_relayout(relayout_data, width=1000, height=575):
+    """Pull the visible map bounds and zoom out of a Graph's relayoutData.
+
+    Uses the corner coordinates plotly reports as mapbox._derived when they're there,
+    otherwise estimates the bounds from the center and zoom for a width x height map.
+
+    Args:
+        relayout_data (dict): the relayoutData of the map Graph, may be None
+        width (int): assumed map width in pixels
+        height (int): assumed map height in pixels
+    Returns:
+        viewport (tuple): (zoom, south, west, north, east), or None if the data has no view
+
+    """
+    if not relayout_data or 'mapbox.zoom' not in relayout_data:
+        return None
+    zoom = relayout_data['mapbox.zoom']
+
+    corners = (relayout_data.get('mapbox._derived') or {}).get('coordinates')
+    if corners:
+        lons = [c[0] for c in corners]
+        lats = [c[1] for c in corners]
+        return zoom, min(lats), min(lons), max(lats), max(lons)
+
+    center = relayout_data.get('mapbox.center')
+    if not center:
+        return None
+    deg_per_px = DEGREES_PER_PIXEL_Z0 / 2 ** zoom
+    half_lon = width / 2.0 * deg_per_px
+    # latitude degrees shrink with cos(lat) in web mercator
+    half_lat = height / 2.0 * deg_per_px * math.cos(math.radians(center['lat']))
+    return (zoom, center['lat'] - half_lat, center['lon'] - half_lon,
+            center['lat'] + half_lat, center['lon'] + half_lon)
+
+
+def cluster_cell_deg(zoom, cluster_px=40):
+    """Size of the clustering grid cell that spans about cluster_px pixels at a zoom."""
+    return cluster_px * DEGREES_PER_PIXEL_Z0 / 2 ** zoom
+
+
+def snap_viewport(viewport, zoom_step=0.5, pad=0.25):
+    """Round a viewport so small pans and zooms map to the same (cacheable) view.
+
+    The zoom is floored to zoom_step, and the box is padded by pad of its size on each
+    side and snapped outwards to the clustering grid at that zoom.
+
+    Args:
+        viewport (tuple): (zoom, south, west, north, east) from viewport_from_relayout
+        zoom_step (float): granularity of the zoom
+        pad (float): fraction of the box added on each side
+    Returns:
+        viewport (tuple): the snapped (zoom, south, west, north, east)
+
+    """
+    zoom, south, west, north, east = viewport
+    zoom = math.floor(zoom / zoom_step) * zoom_step
+    lat_pad = (north - south) * pad
+    lon_pad = (east - west) * pad
+    cell = cluster_cell_deg(zoom)
+    return (
+        zoom,
+        math.floor((south - lat_pad) / cell) * cell,
+        math.floor((west - lon_pad) / cell) * cell,
+        math.ceil((north + lat_pad) / cell) * cell,
+        math.ceil((east + lon_pad) / cell) * cell
+    )
+
+
+def grid_clusters(lat, lon, values, cell_deg):
+    """Aggregate points into the cells of a lat/long grid.
+
+    Args:
+        lat (numpy array): latitude of each point
+        lon (numpy array): longitude of each point
+        values (numpy array): the value to average per cell, e.g. the marker color
+        cell_deg (float): width and height of a cell, in degrees
+    Returns:
+        clusters (dict): per non-empty cell the mean 'lat', 'lon' and 'value', and the 'count'
+
+    """
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    values = np.asarray(values, dtype='float64')
+    keep = ~(np.isnan(lat) | np.isnan(lon))
+    lat, lon, values = lat[keep], lon[keep], values[keep]
+
+    cell_keys = np.stack([np.floor(lat / cell_deg), np.floor(lon / cell_deg)], axis=1)
+    cells, inverse = np.unique(cell_keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    count = np.bincount(inverse, minlength=len(cells))
+    valid = ~np.isnan(values)
+    value_count = np.bincount(inverse, weights=valid, minlength=len(cells))
+    value_sum = np.bincount(inverse, weights=np.where(valid, values, 0), minlength=len(cells))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'lat': np.bincount(inverse, weights=lat, minlength=len(cells)) / count,
+            'lon': np.bincount(inverse, weights=lon, minlength=len(cells)) / count,
+            'value': value_sum / value_count,
+            'count': count
+        }
@@ -0,0 +1,188 @@
+# per-group distribution summaries, so the violin plot ships a few hundred numbers per
+# year instead of every filtered value and leaves no kde/box work to the browser
+
+import numpy as np
+from plotly import graph_objs as go
+
+
+def _quantile(values, starts, counts, q):
+    # linear interpolation between order statistics, same as pandas and plotly's box
+    pos = starts + q * (counts - 1)
+    lo = np.floor(pos).astype('int64')
+    hi = np.ceil(pos).astype('int64')
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def group_summaries(groups, values, n_points=64, n_bins=512):
+    """Compute box stats and a kernel density estimate for every group in one pass.
+
+    Values are sorted within groups once, so the quantiles are index lookups. The kde
+    uses a normal kernel with plotly's rule of thumb bandwidth over plotly's default
+    'soft' span, evaluated on n_points per group. Values are first binned into n_bins
+    per group, so the kde costs the same however many rows a group has.
+
+    Args:
+        groups (array like): the group of each value, e.g. the year
+        values (array like): the values to summarise, non-finite values are ignored
+        n_points (int): number of points the kde is evaluated at, per group
+        n_bins (int): number of bins values are counted into before the kde
+    Returns:
+        summary (dict): arrays with one entry per group, sorted by group: 'group', 'count',
+            'min', 'q1', 'median', 'q3', 'max', 'mean', 'lower_whisker', 'upper_whisker',
+            'bandwidth', and (groups x n_points) arrays 'kde_x' and 'kde_density'
+
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype='float64')
+    keep = np.isfinite(values)
+    groups, values = groups[keep], values[keep]
+
+    keys, inverse = np.unique(groups, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.lexsort((values, inverse))
+    values = values[order]
+    inverse = inverse[order]
+
+    counts = np.bincount(inverse, minlength=len(keys))
+    starts = np.cumsum(counts) - counts
+    ends = starts + counts - 1
+
+    q1 = _quantile(values, starts, counts, 0.25)
+    median = _quantile(values, starts, counts, 0.5)
+    q3 = _quantile(values, starts, counts, 0.75)
+    mean = np.bincount(inverse, weights=values, minlength=len(keys)) / np.maximum(counts, 1)
+
+    # whiskers reach the most extreme values within 1.5 iqr of the box
+    iqr = q3 - q1
+    inside = (values >= (q1 - 1.5 * iqr)[inverse]) & (values <= (q3 + 1.5 * iqr)[inverse])
+    # reduceat can't take an empty list of groups
+    lower_whisker = upper_whisker = np.zeros(0)
+    if len(keys):
+        lower_whisker = np.minimum.reduceat(np.where(inside, values, np.inf), starts)
+        upper_whisker = np.maximum.reduceat(np.where(inside, values, -np.inf), starts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.bincount(inverse, weights=(values - mean[inverse]) ** 2, minlength=len(keys)) / (counts - 1)
+        std = np.sqrt(variance)
+        bandwidth = 1.059 * np.fmin(std, iqr / 1.349) * counts ** -0.2
+    # single values or constant groups still need a visible width
+    spread = values[ends] - values[starts]
+    fallback = np.where(spread > 0, spread / 10, np.maximum(np.abs(median), 1) / 100)
+    bandwidth = np.where(np.isfinite(bandwidth) & (bandwidth > 0), bandwidth, fallback)
+
+    lo = values[starts] - 2 * bandwidth
+    hi = values[ends] + 2 * bandwidth
+    bin_width = (hi - lo) / n_bins
+    bins = np.clip(((values - lo[inverse]) / bin_width[inverse]).astype('int64'), 0, n_bins - 1)
+    hist = np.bincount(inverse * n_bins + bins, minlength=len(keys) * n_bins).reshape(len(keys), n_bins)
+
+    centers = lo[:, None] + (np.arange(n_bins) + 0.5)[None, :] * bin_width[:, None]
+    kde_x = lo[:, None] + np.linspace(0, 1, n_points)[None, :] * (hi - lo)[:, None]
+    z = (kde_x[:, :, None] - centers[:, None, :]) / bandwidth[:, None, None]
+    kde_density = np.einsum('gpb,gb->gp', np.exp(-0.5 * z * z), hist) / \
+        (np.maximum(counts, 1) * bandwidth * np.sqrt(2 * np.pi))[:, None]
+
+    return {
+        'group': keys,
+        'count': counts,
+        'min': values[starts],
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'max': values[ends],
+        'mean': mean,
+        'lower_whisker': lower_whisker,
+        'upper_whisker': upper_whisker,
+        'bandwidth': bandwidth,
+        'kde_x': kde_x,
+        'kde_density': kde_density
+    }
+
+
+def concat_summaries(summaries):
+    """Join group_summaries outputs computed over separate chunks of the groups.
+
+    Args:
+        summaries (list): group_summaries outputs with no group in more than one, in group order
+    Returns:
+        summary (dict): one summary over every chunk's groups
+
+    """
+    if not summaries:
+        return group_summaries(np.zeros(0), np.zeros(0))
+    if len(summaries) == 1:
+        return summaries[0]
+    return {key: np.concatenate([s[key] for s in summaries]) for key in summaries[0]}
+
+
+def _round_to_span(values, span, digits=4):
+    # keep digits significant figures relative to the group's range, it's only drawn
+    if not span > 0:
+        return values
+    return np.round(values, int(digits - np.floor(np.log10(span))))
+
+
+def _segments(xs, ys):
+    # join per-group polylines into one trace, separated by gaps
+    x, y = [], []
+    for xi, yi in zip(xs, ys):
+        x.extend(xi)
+        x.append(None)
+        y.extend(yi)
+        y.append(None)
+    return x, y
+
+
+def violin_traces(summary, line_color='mediumpurple', opacity=0.6, half_width=0.4, box_half_width=0.05):
+    """Draw precomputed summaries as violins with an inner box and a mean line.
+
+    Every group's outline goes into one filled trace, the boxes into a second one and
+    the whiskers and mean lines into a third, so the trace count doesn't grow with
+    the number of groups. A marker per group carries the hover stats.
+
+    Args:
+        summary (dict): the output of group_summaries, grouped by a numeric x (e.g. year)
+        line_color (str): color of the violins
+        opacity (float): opacity of the violins
+        half_width (float): half the width of the widest point of each violin, in x units
+        box_half_width (float): half the width of the inner box, in x units
+    Returns:
+        traces (list): plotly traces
+
+    """
+    x0 = summary['group'].astype('float64')
+    peak = summary['kde_density'].max(axis=1, initial=0)
+    widths = summary['kde_density'] / np.where(peak > 0, peak, 1)[:, None] * half_width
+    kde_x = [_round_to_span(k, k[-1] - k[0]) for k in summary['kde_x']]
+
+    outline_x, outline_y = _segments(
+        [np.round(np.concatenate([x - w, (x + w)[::-1], [x - w[0]]]), 3) for x, w in zip(x0, widths)],
+        [np.concatenate([k, k[::-1], [k[0]]]) for k in kde_x]
+    )
+    box_x, box_y = _segments(
+        [[x - box_half_width, x + box_half_width, x + box_half_width, x - box_half_width, x - box_half_width] for x in x0],
+        [[a, a, b, b, a] for a, b in zip(summary['q1'], summary['q3'])]
+    )
+    # the mean line spans the violin's width at the mean
+    mean_widths = [np.interp(m, k, w) for m, k, w in zip(summary['mean'], summary['kde_x'], widths)]
+    line_x, line_y = _segments(
+        [[x, x] for x in x0] + [[x - w, x + w] for x, w in zip(x0, mean_widths)],
+        [[a, b] for a, b in zip(summary['lower_whisker'], summary['upper_whisker'])] + [[m, m] for m in summary['mean']]
+    )
+
+    hover = [
+        'n: {}<br>max: {:.4g}<br>q3: {:.4g}<br>median: {:.4g}<br>mean: {:.4g}<br>q1: {:.4g}<br>min: {:.4g}'
+        .format(*stats)
+        for stats in zip(summary['count'], summary['max'], summary['q3'], summary['median'],
+                         summary['mean'], summary['q1'], summary['min'])
+    ]
+
+    return [
+        go.Scatter(x=outline_x, y=outline_y, mode='lines', fill='toself', line_color=line_color,
+                   opacity=opacity, hoverinfo='skip'),
+        go.Scatter(x=box_x, y=box_y, mode='lines', fill='toself', line_color=line_color,
+                   fillcolor=line_color, hoverinfo='skip'),
+        go.Scatter(x=line_x, y=line_y, mode='lines', line_color=line_color, hoverinfo='skip'),
+        go.Scatter(x=x0, y=summary['median'], mode='markers', marker=dict(color='white', size=5),
+                   text=hover, hoverinfo='text')
+    ]
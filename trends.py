@@ -0,0 +1,70 @@
+# per-station growth trends, fitted for every station at once
+#
+# each station's log aadt is laid out as one row of a padded (stations x years) array,
+# NaN where the station wasn't counted, so the least squares fit of every station is a
+# handful of masked sums over that array rather than one regression per station.
+
+import numpy as np
+
+
+def station_trends(groups, years, values):
+    """Fit a log-linear trend to each group's values over the years.
+
+    Non-positive and missing values are left out of the fit, so a group's trend only
+    uses the years it was actually counted in. Groups with fewer than two such years
+    get NaN for everything but 'years'.
+
+    Args:
+        groups (array like): group id of each row, e.g. GroupKernel.start
+        years (array like): year of each row, at most one row per group and year
+        values (array like): the positive values to fit, e.g. average daily traffic
+    Returns:
+        trends (dict): one entry per row, broadcast from its group: 'slope' (of the log
+            values per year), 'growth' (the slope as percent per year), 'cagr' (percent
+            per year from the first to the last counted year), 'r2' (of the fit) and
+            'years' (number of counted years)
+
+    """
+    if len(values) < 1:
+        return {name: np.zeros(0) for name in ('slope', 'growth', 'cagr', 'r2', 'years')}
+
+    group_keys, group_idx = np.unique(np.asarray(groups), return_inverse=True)
+    year_keys, year_idx = np.unique(np.asarray(years), return_inverse=True)
+    group_idx, year_idx = group_idx.ravel(), year_idx.ravel()
+    values = np.asarray(values, dtype='float64')
+
+    log_values = np.full((len(group_keys), len(year_keys)), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_values[group_idx, year_idx] = np.where(values > 0, np.log(values), np.nan)
+    counted = np.isfinite(log_values)
+    x = year_keys.astype('float64')[None, :]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = counted.sum(axis=1)
+        x_mean = np.where(counted, x, 0).sum(axis=1) / n
+        y_mean = np.where(counted, log_values, 0).sum(axis=1) / n
+        dx = np.where(counted, x - x_mean[:, None], 0)
+        dy = np.where(counted, log_values - y_mean[:, None], 0)
+        sxx = (dx * dx).sum(axis=1)
+        sxy = (dx * dy).sum(axis=1)
+        syy = (dy * dy).sum(axis=1)
+
+        fitted = n >= 2
+        slope = np.where(fitted, sxy / sxx, np.nan)
+        # a flat series is fitted perfectly by a flat line
+        r2 = np.where(fitted, np.where(syy > 0, sxy * sxy / (sxx * syy), 1.0), np.nan)
+
+        # first and last counted year of each group
+        first = np.argmax(counted, axis=1)
+        last = counted.shape[1] - 1 - np.argmax(counted[:, ::-1], axis=1)
+        rows = np.arange(len(group_keys))
+        span = year_keys[last].astype('float64') - year_keys[first]
+        cagr = np.where(fitted, np.expm1((log_values[rows, last] - log_values[rows, first]) / span) * 100, np.nan)
+
+    return {
+        'slope': slope[group_idx],
+        'growth': np.expm1(slope)[group_idx] * 100,
+        'cagr': cagr[group_idx],
+        'r2': r2[group_idx],
+        'years': n[group_idx]
+    }
@@ -0,0 +1,114 @@
+# background warm-up of the figure caches
+#
+# right after a deploy every view is a cache miss. the default view and the single
+# slicer views are what most sessions start from, so they're computed ahead of time in
+# a small thread pool while the server is already taking requests.
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
+
+
+def common_views(dataset, columns):
+    """List the views worth precomputing: no filter, then each single slicer value, busiest first.
+
+    Args:
+        dataset (PartitionedDataset or InMemoryDataset): the data the slicers filter
+        columns (list): the slicer columns
+    Returns:
+        views (list): dicts of column -> selected values, [] for no filter
+
+    """
+    views = [{col: [] for col in columns}]
+    for col in columns:
+        for value in dataset.value_counts(col).index:
+            view = {c: [] for c in columns}
+            view[col] = [value]
+            views.append(view)
+    return views
+
+
+class CacheWarmer(object):
+    """Run cache-filling calls in a background thread pool, within a budget.
+
+    Tasks are started in order until the time budget or the task limit is used up, so
+    put the most valuable ones first. Failures are counted and skipped.
+
+    Args:
+        tasks (iterable): (func, args) pairs to call
+        workers (int): number of threads calling tasks
+        budget (float): seconds after which no more tasks are started, None for no limit
+        max_tasks (int): max number of tasks run, e.g. the cache size so warming
+            doesn't evict its own results, None for no limit
+        report_every (float): seconds between progress lines
+
+    """
+    def __init__(self, tasks, workers=2, budget=None, max_tasks=None, report_every=10.0):
+        self.tasks = list(tasks)[:max_tasks]
+        self.workers = workers
+        self.budget = budget
+        self.report_every = report_every
+        self.done = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start warming in a daemon thread and return right away."""
+        thread = threading.Thread(target=self.run, name='cache-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        """Warm the caches in the calling thread, returns when done or out of budget."""
+        self.started = time.time()
+        last_report = self.started
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for func, args in self.tasks:
+                if self.budget is not None and time.time() - self.started > self.budget:
+                    break
+                # keep only as many tasks queued as there are threads, so the budget is checked often
+                while len(pending) >= self.workers:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(pool.submit(self._call, func, args))
+                if time.time() - last_report >= self.report_every:
+                    self.report()
+                    last_report = time.time()
+            wait(pending)
+        self.finished = time.time()
+        self.report()
+
+    def _call(self, func, args):
+        try:
+            func(*args)
+            with self._lock:
+                self.done += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print('cache warm-up: {} failed: {!r}'.format(getattr(func, '__name__', func), e))
+
+    def progress(self):
+        """Counters for monitoring the warm-up.
+
+        Returns:
+            progress (dict): tasks, done, failed, seconds spent and whether it's finished
+
+        """
+        with self._lock:
+            done, failed = self.done, self.failed
+        end = self.finished or time.time()
+        return {
+            'tasks': len(self.tasks),
+            'done': done,
+            'failed': failed,
+            'seconds': end - self.started if self.started else 0.0,
+            'finished': int(self.finished is not None)
+        }
+
+    def report(self):
+        progress = self.progress()
+        print('cache warm-up: {done}/{tasks} done, {failed} failed, {seconds:.1f}s{state}'.format(
+            state=' (finished)' if progress['finished'] else '', **progress))
@@ -2,155 +2,604 @@
 
 import pandas as pd
 import numpy as np
-from simpledbf import Dbf5
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
 import os
 
+from snapshot import write_snapshot, SNAPSHOT_DIR
+from partitions import write_partitions
+from compact import compact_frame, memory_report
+from routes import RouteLayer, ROUTE_LAYER_PATH
+from groupkernels import GroupKernel, mean_dedup
+from trends import station_trends
+from dbfreader import DbfReader
+from shpreader import ShpReader
+from spatial import GridIndex
 
-def convert_lat_long(series, delimiter=':', precision=5):
+SHP_DIR = './data/shp_files'
+BIGFRAME_PATH = './data/bigframe.pkl'
+CACHE_DIR = './data/cache'
+ZIP_XREF_PATH = './data/sc-zip-code-latitude-and-longitude.csv'
+
+# bump this whenever clean_year_df changes so stale cached years get rebuilt
+CACHE_VERSION = 4
+
+# bump this whenever the columns or values combine_year_dfs builds change. it's written
+# next to bigframe.pkl, so a pickle from an older build (e.g. without the trend columns,
+# or with fills leaking between stations) is rebuilt instead of copied into the app's data
+BIGFRAME_VERSION = 1
+
+# columns that identify a single count station across years
+ID_COLS = ['station_id', 'route_identifier', 'route_number']
+
+# create a dictionary that will allow us to rename columns from key to value.
+# we won't map every column - only keep a subset
+COL_MAPPING_DICT = {
+    **dict.fromkeys(['station', 'stationnu', 'stationnum'], 'station_id'),
+    **dict.fromkeys(['milepoint', 'metermile', 'metermilep'], 'route_mile_point'),
+    **dict.fromkeys(['latitude', 'lat'], 'latitude'),
+    **dict.fromkeys(['longitude', 'long'], 'longitude'), 
+    **dict.fromkeys(['aadtyr', 'year', 'factored1', 'factoreda1'], 'year'),
+    **dict.fromkeys(['routelrs', 'maplrs'], 'route_identifier'),
+    **dict.fromkeys(['termini', 'descriptio'], 'route_leg_descrip'),
+    **dict.fromkeys(['beginmilep', 'beginmile', 'bmp'], 'route_leg_beginmile'),
+    **dict.fromkeys(['endmilepo', 'endmilepoi', 'emp'], 'route_leg_endmile'),
+    **dict.fromkeys(['routetype', 'rtetype', 'routetypen', 'routetype1'], 'route_type'),   # has to be a numeric column as well, some collision here
+    **dict.fromkeys(['rtenum', 'rtenumb', 'routenumb', 'routenum', 'routenumbe'], 'route_number'),
+    **dict.fromkeys(['county', 'countyname', 'countynam'], 'county_name'),
+    **dict.fromkeys(['countyid', 'countynumb'], 'county_id'),
+    **dict.fromkeys(['aadt', 'factoreda', 'count', 'factoredaa'], 'average_daily_traffic'),
+    **dict.fromkeys(['id1'], 'row_number')
+}
+
+# columns that aren't renamed but still make it into the final dataframe
+EXTRA_COLS = ['gmrotation']
+
+# lat/long taken from each year's point geometry, preferred over the attribute columns
+GEOMETRY_COLS = ['geomlatitude', 'geomlongitude']
+
+# files next to a year's dbf that feed into its cleaned frame
+SIDECAR_EXTS = ['.shp', '.shx', '.prj']
+
+# stands in for the dbf fields that aren't decoded when dropping duplicate rows
+UNREAD_COL = 'unreadfields'
+
+# characters that may separate the degrees, minutes and seconds of a lat/long
+DMS_DELIMITERS = ':;, \'"\u00b0'
+
+# delimiters that mark the unit of the part before them, so they may end a value
+DMS_UNIT_SIGNS = '\'"\u00b0'
+
+# still some collision - column name can mean different things in different years.
+# these years have a county_name column that isn't actually the county name
+COUNTY_NAME_COLLISION_YEARS = ['2009', '2012', '2017']
+
+
+def convert_lat_long(series, delimiter=DMS_DELIMITERS, precision=5, return_errors=False):
     """Convert a series of lat or long strings into floating point representation.
-    
+
+    Values are degrees, minutes and seconds separated by any of the delimiter
+    characters, with an optional sign on the degrees; missing minutes or seconds count
+    as zero and every part may have decimals. Values that don't parse, including ones
+    with an empty part like '34::30', become NaN.
+    The parsing is done on the values' bytes (see parse_dms), so no per-value python
+    strings or lists are built.
+
     Args:
         series (pandas Series): a series of strings of lat/long, delimited by delimiter.
-        delimiter (str): the string delimiter
+        delimiter (str): the characters that can separate degrees, minutes and seconds
         precision (int): the number of decimal places to round the result to
+        return_errors (bool): also return the number of values that didn't parse
     Returns:
         converted (pandas Series): a series of floating points of lat/long, rounded
-    
+        errors (int): number of non-missing values that became NaN, if return_errors
+
     """
-    # expand=True turns the delimited series into a dataframe with multiple columns (rather than a column made of lists of splits)
-    split = series.str.split(delimiter, expand=True).astype('float')
-    multiplier = np.sign(split[0])
-    hours = np.absolute(split[0])
-    minutes = split[1] / 60.0
-    seconds = split[2] / (60.0 * 60.0)
-    converted = multiplier * (hours + minutes + seconds)
-    
-    return converted.round(precision)
+    values = series.values
+    missing = pd.isna(values)
+    strings = np.where(missing, '', values)
+    try:
+        raw = strings.astype('S')
+    except UnicodeEncodeError:
+        # things like a degree sign can't go straight to ascii
+        raw = np.array([str(v).encode('utf-8') for v in strings], dtype='S')
 
+    converted, invalid = parse_dms(raw, delimiter)
+    converted = pd.Series(converted, index=series.index).round(precision)
+    if return_errors:
+        return converted, int((invalid & ~missing).sum())
+    return converted
 
-def create_big_df():
-    # read GIS dbf data into dataframes, one file for each year between 2009 and 2018
-    shp_dfs = {}
-    for root, dirs, files in os.walk("./data/shp_files"):
+
+def parse_dms(raw, delimiter=DMS_DELIMITERS):
+    """Parse a fixed width bytes array of degree/minute/second strings.
+
+    The array is viewed as a (values x width) byte matrix and scanned one byte column
+    at a time for all values at once: digits are accumulated into an integer mantissa
+    per part, and a part ends at a delimiter. Whitespace around a delimiter is skipped,
+    but two other delimiters in a row leave an empty part and the value doesn't parse.
+    Only a unit sign may end the value, as in 34°30'15". Dividing the mantissa by the
+    power of ten of its decimals gives the same float as float() on the part, and the parts
+    are combined as sign * (|d| + m / 60 + s / 3600) like the str.split version did.
+
+    Args:
+        raw (numpy array): 'S' dtype array of the values
+        delimiter (str): the characters that can separate the parts
+    Returns:
+        degrees (numpy array): float64 decimal degrees, NaN where a value didn't parse
+        invalid (numpy array): True where a value didn't parse (including blank values)
+
+    """
+    n = len(raw)
+    width = max(raw.dtype.itemsize, 1)
+    # column major, so each byte column is contiguous
+    chars = np.asfortranarray(np.ascontiguousarray(raw, dtype='S{}'.format(width)).view('uint8').reshape(n, width))
+
+    delimiters = np.zeros(256, dtype=bool)
+    delimiters[list(delimiter.encode('utf-8'))] = True
+    # NUL is the padding of the fixed width array
+    delimiters[0] = True
+    spaces = np.zeros(256, dtype=bool)
+    spaces[[0, ord(' '), ord('\t')]] = True
+    # a multi byte delimiter like the degree sign is one delimiter, its leading bytes are skipped
+    for char in delimiter:
+        spaces[list(char.encode('utf-8')[:-1])] = True
+    units = np.zeros(256, dtype=bool)
+    units[[ord(char.encode('utf-8')[-1:]) for char in DMS_UNIT_SIGNS if char in delimiter]] = True
+
+    parts = np.zeros((3, n))
+    part = np.zeros(n, dtype='int8')
+    in_part = np.zeros(n, dtype=bool)
+    negative = np.zeros(n, dtype=bool)
+    invalid = np.zeros(n, dtype=bool)
+    mantissa = np.zeros(n, dtype='int64')
+    n_digits = np.zeros(n, dtype='int16')
+    n_decimals = np.zeros(n, dtype='int16')
+    n_dots = np.zeros(n, dtype='int16')
+    # a delimiter that isn't whitespace was seen since the last part ended, and whether it was a unit sign
+    after_delimiter = np.zeros(n, dtype=bool)
+    after_unit = np.zeros(n, dtype=bool)
+
+    def end_parts(ending):
+        # float64 division is exact for mantissas of up to 15 digits
+        invalid[...] |= ending & ((n_digits < 1) | (n_digits > 15) | (n_dots > 1) | (part > 2))
+        value = mantissa / 10.0 ** n_decimals
+        for k in range(3):
+            parts[k] = np.where(ending & (part == k), value, parts[k])
+        part[...] += ending
+        for counter in (mantissa, n_digits, n_decimals, n_dots):
+            counter *= ~ending
+
+    for j in range(width + 1):
+        # one extra pass of padding closes parts that run to the last byte
+        c = chars[:, j] if j < width else np.zeros(n, dtype='uint8')
+        is_delimiter = delimiters[c]
+        is_space = spaces[c]
+        ending = in_part & is_delimiter
+        if ending.any():
+            end_parts(ending)
+        # a delimiter before the degrees or right after another one leaves an empty part
+        separator = is_delimiter & ~is_space
+        invalid |= separator & ~in_part & (after_delimiter | (part == 0))
+        after_delimiter = (after_delimiter & is_space) | separator
+        after_unit = np.where(separator, units[c], after_unit)
+
+        digit = c - np.uint8(ord('0'))
+        is_digit = digit < 10
+        is_dot = c == ord('.')
+        # a sign is only allowed as the very first byte of the degrees
+        is_sign = ((c == ord('-')) | (c == ord('+'))) & ~in_part & (part == 0)
+        invalid |= ~(is_delimiter | is_digit | is_dot | is_sign)
+        negative |= is_sign & (c == ord('-'))
+
+        mantissa = np.where(is_digit, mantissa * 10 + digit, mantissa)
+        n_digits += is_digit
+        n_decimals += is_digit & (n_dots > 0)
+        n_dots += is_dot
+        in_part = ~is_delimiter
+
+    invalid |= (part == 0) | (after_delimiter & ~after_unit)
+    degrees = np.where(negative, -1.0, 1.0) * (parts[0] + parts[1] / 60.0 + parts[2] / (60.0 * 60.0))
+    degrees[invalid] = np.nan
+    return degrees, invalid
+
+
+def find_year_files(shp_dir=SHP_DIR):
+    """Find the GIS dbf file for each year under shp_dir.
+
+    Args:
+        shp_dir (str): directory holding one dbf file per year
+    Returns:
+        year_files (dict): year string -> path of that year's dbf file
+
+    """
+    year_files = {}
+    for root, dirs, files in os.walk(shp_dir):
         for file in files:
             if file.endswith(".dbf"):
-                # print(file.split('.')[0])
-                dbf = Dbf5(os.path.join(root, file))
-                df = dbf.to_dataframe()
-                shp_dfs[file.split('.')[0]] = df
-
-    # create a dictionary that will allow us to rename columns from key to value.
-    # we won't map every column - only keep a subset
-    col_mapping_dict = {
-        **dict.fromkeys(['station', 'stationnu', 'stationnum'], 'station_id'),
-        **dict.fromkeys(['milepoint', 'metermile', 'metermilep'], 'route_mile_point'),
-        **dict.fromkeys(['latitude', 'lat'], 'latitude'),
-        **dict.fromkeys(['longitude', 'long'], 'longitude'), 
-        **dict.fromkeys(['aadtyr', 'year', 'factored1', 'factoreda1'], 'year'),
-        **dict.fromkeys(['routelrs', 'maplrs'], 'route_identifier'),
-        **dict.fromkeys(['termini', 'descriptio'], 'route_leg_descrip'),
-        **dict.fromkeys(['beginmilep', 'beginmile', 'bmp'], 'route_leg_beginmile'),
-        **dict.fromkeys(['endmilepo', 'endmilepoi', 'emp'], 'route_leg_endmile'),
-        **dict.fromkeys(['routetype', 'rtetype', 'routetypen', 'routetype1'], 'route_type'),   # has to be a numeric column as well, some collision here
-        **dict.fromkeys(['rtenum', 'rtenumb', 'routenumb', 'routenum', 'routenumbe'], 'route_number'),
-        **dict.fromkeys(['county', 'countyname', 'countynam'], 'county_name'),
-        **dict.fromkeys(['countyid', 'countynumb'], 'county_id'),
-        **dict.fromkeys(['aadt', 'factoreda', 'count', 'factoredaa'], 'average_daily_traffic'),
-        **dict.fromkeys(['id1'], 'row_number')
-    }
-
-    for df in shp_dfs.values():
-        df.columns = [c.replace('_', '').lower().strip() for c in df.columns]
+                year_files[file.split('.')[0]] = os.path.join(root, file)
+
+    # os.walk order is arbitrary, keep the years in order so each station's rows stack oldest first
+    return {year: year_files[year] for year in sorted(year_files)}
+
+
+def normalize_col(col):
+    """Normalize a raw dbf column name the way COL_MAPPING_DICT's keys are written."""
+    return col.replace('_', '').lower().strip()
+
+
+def read_year_points(path, reader):
+    """Read the lat/long of each record's point from the shapefile next to a dbf.
+
+    Args:
+        path (str): path to the dbf file
+        reader (DbfReader): the open reader of that dbf file
+    Returns:
+        lat, lon (numpy array): per non-deleted record, NaN for null shapes, or None if
+            there is no usable shapefile
+
+    """
+    base = os.path.splitext(path)[0]
+    if not (os.path.isfile(base + '.shp') and os.path.isfile(base + '.shx')):
+        return None
+    shp = ShpReader(base + '.shp')
+    # shapes pair up with dbf records by position, so the counts have to agree
+    if shp.numrec != reader.numrec:
+        print('{}: {} shapes for {} records, using the lat/long columns'.format(base, shp.numrec, reader.numrec))
+        return None
+    try:
+        lat, lon = shp.lat_long()
+    except ValueError as e:
+        print('{}: {}, using the lat/long columns'.format(base, e))
+        return None
+
+    recnos = reader.record_numbers()
+    return lat[recnos], lon[recnos]
+
+
+def read_year_df(path):
+    """Read the columns of a year's dbf file that create_big_df actually uses.
+
+    Only the columns named in COL_MAPPING_DICT (under any alias) and EXTRA_COLS are
+    decoded. The rest of each record is summarised into UNREAD_COL so that dropping
+    duplicate rows still compares every field except id2, as it did with all of them read.
+    If the year's .shp/.shx sit next to the dbf, the lat/long of each record's point
+    are added as GEOMETRY_COLS, and the lat/long columns are only decoded when some
+    records have no point.
+
+    Args:
+        path (str): path to the dbf file
+    Returns:
+        df (pandas DataFrame): the raw (not renamed) columns plus UNREAD_COL
+
+    """
+    reader = DbfReader(path)
+    wanted = [c for c in reader.columns if normalize_col(c) in COL_MAPPING_DICT or normalize_col(c) in EXTRA_COLS]
+    ids = [c for c in reader.columns if normalize_col(c) == 'id2']
+
+    points = read_year_points(path, reader)
+    if points is not None and not (np.isnan(points[0]).any() or np.isnan(points[1]).any()):
+        wanted = [c for c in wanted if COL_MAPPING_DICT.get(normalize_col(c)) not in ('latitude', 'longitude')]
+
+    df = reader.read(wanted, unread_key=UNREAD_COL, unread_exclude=ids)
+    if points is not None:
+        df[GEOMETRY_COLS[0]], df[GEOMETRY_COLS[1]] = points
+    return df
+
+
+def parse_lat_long(df):
+    """Get float lat/long from the latitude and longitude attribute columns.
+
+    Args:
+        df (pandas DataFrame): a renamed frame with latitude and longitude columns
+    Returns:
+        latitude, longitude (pandas Series): the columns as floats
+
+    """
+    # convert the lat/long series if the dtype of the column is object (string) and has a colon
+    if df.latitude.dtype == 'O' and df.latitude.str.contains(':').any():
+        latitude, lat_errors = convert_lat_long(df.latitude, return_errors=True)
+        longitude, long_errors = convert_lat_long(df.longitude, return_errors=True)
+        if lat_errors or long_errors:
+            print('{} latitudes and {} longitudes could not be parsed'.format(lat_errors, long_errors))
+        return latitude, longitude
+    # make sure all lat/long columns are floats
+    return df.latitude.astype('float'), df.longitude.astype('float')
+
+
+def clean_year_df(year, df):
+    """Apply all the cleaning steps that only need a single year's data.
+
+    Renames the columns to the common schema, drops duplicated rows and columns,
+    averages adt across duplicate stations and sets float lat/long, from the point
+    geometry where there is one and from the attribute columns otherwise.
+
+    Args:
+        year (str): the year the dbf file holds
+        df (pandas DataFrame): the raw dbf contents for that year
+    Returns:
+        df (pandas DataFrame): the cleaned dataframe, one row per station
+
+    """
+    df.columns = [normalize_col(c) for c in df.columns]
 
     # rename columns as per mapping dict
-    shp_dfs_renamed = {year: df.rename(columns=col_mapping_dict) for year, df in shp_dfs.items()}
+    df = df.rename(columns=COL_MAPPING_DICT)
 
     # rename route_type column only if it's a float
-    for year, df in shp_dfs_renamed.items():
-        # create a df of column names and dtypes
-        col_dtypes = df.dtypes.reset_index()
-        col_dtypes.columns = ['col_name', 'dtype']
-        # create a boolean mask with the criteria
-        col_mask = (col_dtypes['col_name'] == 'route_type') & (col_dtypes['dtype'] == 'float64')
-        # use integer indexing to rename the correct column 
-        new_cols = np.array(df.columns)
-        new_cols[col_mask] = 'route_type_number'
-        df.columns = new_cols
-
-    # still some collision - column name can mean different things in different years.
+    # create a df of column names and dtypes
+    col_dtypes = df.dtypes.reset_index()
+    col_dtypes.columns = ['col_name', 'dtype']
+    # create a boolean mask with the criteria
+    col_mask = (col_dtypes['col_name'] == 'route_type') & (col_dtypes['dtype'] == 'float64')
+    # use integer indexing to rename the correct column 
+    new_cols = np.array(df.columns)
+    new_cols[col_mask] = 'route_type_number'
+    df.columns = new_cols
+
     # drop some columns that still aren't right
-    shp_dfs_renamed['2009'].drop(['county_name'], axis=1, inplace=True)
-    shp_dfs_renamed['2012'].drop(['county_name'], axis=1, inplace=True)
-    shp_dfs_renamed['2017'].drop('county_name', axis=1, inplace=True)
+    if year in COUNTY_NAME_COLLISION_YEARS:
+        df = df.drop('county_name', axis=1)
 
     # drop columns that are duplicated
-    for year, df in shp_dfs_renamed.items():
-        df = df.loc[:, ~df.columns.duplicated()]
-        shp_dfs_renamed[year] = df
+    df = df.loc[:, ~df.columns.duplicated()]
 
     # drop duplicated rows in dataframes
     # some rows are only unique based on row_number (id1) and id2 fields
-    for year, df in shp_dfs_renamed.items():
-        df = df.drop('row_number', axis=1)
-        if 'id2' in df.columns:
-            df = df.drop('id2', axis=1)
-        df = df.drop_duplicates()
-        shp_dfs_renamed[year] = df
+    df = df.drop('row_number', axis=1)
+    if 'id2' in df.columns:
+        df = df.drop('id2', axis=1)
+    # the geometry is per record, it doesn't make otherwise equal rows distinct
+    df = df.drop_duplicates(subset=[c for c in df.columns if c not in GEOMETRY_COLS])
+    if UNREAD_COL in df.columns:
+        df = df.drop(UNREAD_COL, axis=1)
 
     # replace route type
-    for year, df in shp_dfs_renamed.items():
-        if 'route_type' in df.columns:
-            df['route_type'] = df.route_type.str.replace('L', 'S')
-        if 'route_type_number' in df.columns:
-            df['route_type_number'] = df.route_type_number.replace(9, 7)
+    if 'route_type' in df.columns:
+        df['route_type'] = df.route_type.str.replace('L', 'S')
+    if 'route_type_number' in df.columns:
+        df['route_type_number'] = df.route_type_number.replace(9, 7)
 
     # drop dupes by identity column
-    for year, df in shp_dfs_renamed.items():
-        df['average_daily_traffic'] = df. \
-            groupby(['station_id', 'route_identifier', 'route_number']). \
-            average_daily_traffic. \
-            transform('mean')
-        # drop dupes if there are any
-        df = df.drop_duplicates()
-        # if there are still multiple records within the group, we'll take the first record, now that adt is averaged across the group
-        df = df.groupby(['station_id', 'route_identifier', 'route_number']).head(1)
-        shp_dfs_renamed[year] = df
-
-    exclude_cols = ['station_id', 'route_identifier', 'route_number', 'average_daily_traffic', 'year']
-    cols = [c for c in shp_dfs_renamed['2018'].columns if c not in exclude_cols]
-    
+    # if there are multiple records within the group, we'll take the first record, with adt averaged across the group
+    df = mean_dedup(df, ID_COLS, 'average_daily_traffic')
+
+    # only parse the attribute columns for stations without a point
+    if all(c in df.columns for c in GEOMETRY_COLS):
+        # same precision convert_lat_long rounds to
+        latitude, longitude = [df.pop(c).round(5) for c in GEOMETRY_COLS]
+        missing = latitude.isna() | longitude.isna()
+        if 'latitude' in df.columns and missing.any():
+            latitude[missing], longitude[missing] = parse_lat_long(df[missing])
+        df['latitude'] = latitude
+        df['longitude'] = longitude
+    elif 'latitude' in df.columns:
+        df['latitude'], df['longitude'] = parse_lat_long(df)
+
+    return df
+
+
+def load_clean_year(year, path):
+    """Read a single year's dbf file and run clean_year_df over it.
+
+    Module level so it can be shipped to a process pool.
+
+    Args:
+        year (str): the year the dbf file holds
+        path (str): path to the dbf file
+    Returns:
+        df (pandas DataFrame): the cleaned dataframe for the year
+
+    """
+    return clean_year_df(year, read_year_df(path))
+
+
+def file_fingerprint(path, stat=None):
+    """Describe a source file by size, mtime and sha1 of its contents.
+
+    Args:
+        path (str): the file to fingerprint
+        stat (os.stat_result): an already taken stat of the file, optional
+    Returns:
+        fingerprint (dict): size, mtime_ns and sha1 of the file
+
+    """
+    stat = stat or os.stat(path)
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1.hexdigest()}
+
+
+def _cache_paths(cache_dir, year):
+    return os.path.join(cache_dir, year + '.pkl'), os.path.join(cache_dir, year + '.json')
+
+
+def year_source_files(path):
+    """The files a year's cleaned frame is built from: its dbf and whichever SIDECAR_EXTS exist."""
+    base = os.path.splitext(path)[0]
+    return [path] + [base + ext for ext in SIDECAR_EXTS if os.path.isfile(base + ext)]
+
+
+def read_cached_year(year, path, cache_dir=CACHE_DIR):
+    """Return the cached cleaned frame for a year if none of its source files changed.
+
+    A matching size and mtime is trusted as is. If the size matches but the mtime
+    doesn't (e.g. a fresh checkout) the content hash decides, and the stored mtime
+    is refreshed on a hit so the next lookup skips hashing.
+
+    Args:
+        year (str): the year the dbf file holds
+        path (str): path to the source dbf file
+        cache_dir (str): directory holding the per-year cache
+    Returns:
+        df (pandas DataFrame): the cached frame, or None if stale or missing
+
+    """
+    pkl_path, meta_path = _cache_paths(cache_dir, year)
+    if not (os.path.isfile(pkl_path) and os.path.isfile(meta_path)):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('version') != CACHE_VERSION:
+        return None
+
+    sources = year_source_files(path)
+    # a sidecar file appearing or going away changes the frame too
+    if sorted(os.path.basename(p) for p in sources) != sorted(meta['files']):
+        return None
+
+    refreshed = False
+    for source in sources:
+        known = meta['files'][os.path.basename(source)]
+        stat = os.stat(source)
+        if stat.st_size != known['size']:
+            return None
+        if stat.st_mtime_ns != known['mtime_ns']:
+            fingerprint = file_fingerprint(source, stat)
+            if fingerprint['sha1'] != known['sha1']:
+                return None
+            known.update(fingerprint)
+            refreshed = True
+    if refreshed:
+        _write_json(meta_path, meta)
+
+    return pd.read_pickle(pkl_path)
+
+
+def write_cached_year(year, path, df, cache_dir=CACHE_DIR):
+    """Store a year's cleaned frame along with the fingerprints of its source files.
+
+    Args:
+        year (str): the year the dbf file holds
+        path (str): path to the source dbf file
+        df (pandas DataFrame): the cleaned frame for the year
+        cache_dir (str): directory holding the per-year cache
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    pkl_path, meta_path = _cache_paths(cache_dir, year)
+    # write the frame first so a crash never leaves a fresh manifest next to an old frame
+    df.to_pickle(pkl_path + '.tmp')
+    os.replace(pkl_path + '.tmp', pkl_path)
+    files = {os.path.basename(p): file_fingerprint(p) for p in year_source_files(path)}
+    _write_json(meta_path, {'version': CACHE_VERSION, 'files': files})
+
+
+def _write_json(path, obj):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f)
+    os.replace(path + '.tmp', path)
+
+
+def bigframe_version(out_path=BIGFRAME_PATH):
+    """The version of combine_year_dfs a pickled dataframe was built with.
+
+    Args:
+        out_path (str): the pickled dataframe
+    Returns:
+        version (int): the version, None if the pickle or its version file is missing
+
+    """
+    if not os.path.isfile(out_path):
+        return None
+    try:
+        with open(out_path + '.json') as f:
+            return json.load(f).get('version')
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def load_year_dfs(shp_dir=SHP_DIR, cache_dir=CACHE_DIR, workers=None):
+    """Load the cleaned frame for every year, only re-reading years whose files changed.
+
+    Changed years are read and cleaned in parallel in a process pool and written back
+    to the cache. Pass cache_dir=None to skip the cache entirely.
+
+    Args:
+        shp_dir (str): directory holding one dbf file per year
+        cache_dir (str): directory holding the per-year cache, or None
+        workers (int): max number of worker processes, defaults to one per cpu
+    Returns:
+        year_dfs (dict): year string -> cleaned dataframe
+
+    """
+    year_files = find_year_files(shp_dir)
+    year_dfs = {}
+    if cache_dir is not None:
+        for year, path in year_files.items():
+            df = read_cached_year(year, path, cache_dir)
+            if df is not None:
+                year_dfs[year] = df
+
+    stale = sorted(year for year in year_files if year not in year_dfs)
+    if stale:
+        print('reading {} of {} years: {}'.format(len(stale), len(year_files), ', '.join(stale)))
+    if len(stale) == 1 or workers == 1:
+        fresh = {year: load_clean_year(year, year_files[year]) for year in stale}
+    elif stale:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {year: pool.submit(load_clean_year, year, year_files[year]) for year in stale}
+            fresh = {year: future.result() for year, future in futures.items()}
+    else:
+        fresh = {}
+
+    for year, df in fresh.items():
+        if cache_dir is not None:
+            write_cached_year(year, year_files[year], df, cache_dir)
+        year_dfs[year] = df
+
+    # in find_year_files' sorted order, oldest first, which the per-station fills rely on
+    return {year: year_dfs[year] for year in year_files}
+
+
+def reference_year(years):
+    """The year whose station attributes overwrite every other year's, the newest one."""
+    return max(years, key=int)
+
+
+def combine_year_dfs(shp_dfs_renamed):
+    """Run the cross-year steps over the cleaned per-year frames and stack them.
+
+    Every step works within a station, so running this on some stations' rows of each
+    year gives exactly those stations' rows of the full result.
+
+    Args:
+        shp_dfs_renamed (dict): year string -> cleaned dataframe, as from load_year_dfs
+    Returns:
+        traffic_df (pandas DataFrame): one row per station per year, with derived columns
+
+    """
+    # don't modify the (possibly cached) frames we were handed
+    shp_dfs_renamed = dict(shp_dfs_renamed)
+
     # update all values for consistency
-    update_df = shp_dfs_renamed['2018'].copy(deep=True)
+    reference = reference_year(shp_dfs_renamed)
+    update_df = shp_dfs_renamed[reference].copy(deep=True)
     # DON'T overwrite average daily traffic values or year
     update_df = update_df.drop(['average_daily_traffic', 'year'], axis=1)
-    update_df = update_df.set_index(['station_id', 'route_identifier', 'route_number'])
+    update_df = update_df.set_index(ID_COLS)
     cols = update_df.columns
 
     for year, df in shp_dfs_renamed.items():
     # make sure the year column is filled in for each one
-        if year != '2018':
+        if year != reference:
+            df = df.copy()
             for c in cols:
                 if c not in df.columns:
                     df[c] = np.nan
-            df = df.set_index(['station_id', 'route_identifier', 'route_number'])
+            df = df.set_index(ID_COLS)
             # overwrite all column values where index matches update_df index 
             df.update(update_df, overwrite=True)
             shp_dfs_renamed[year] = df.reset_index()
     
-    # drop nas for average daily traffic - only in the 2018 df.
+    # drop nas for average daily traffic - only in the reference df.
     
-    shp_dfs_renamed['2018'] = shp_dfs_renamed['2018'].dropna(subset=['average_daily_traffic'])
-
-    # convert all the lat/long series in the dfs if the dtype of the column is object (string) and has a colon
-    for year, df in shp_dfs_renamed.items():
-        if 'latitude' in df.columns:
-            if df.latitude.dtype == 'O' and df.latitude.str.contains(':').any():
-                df['latitude'] = convert_lat_long(df.latitude)
-                df['longitude'] = convert_lat_long(df.longitude)
-            # make sure all lat/long columns are floats
-            else:
-                df['latitude'] = df.latitude.astype('float')
-                df['longitude'] = df.longitude.astype('float')
+    shp_dfs_renamed[reference] = shp_dfs_renamed[reference].dropna(subset=['average_daily_traffic'])
 
     # stack all the data frames together
     traffic_df = pd.concat(shp_dfs_renamed.values(), sort=True, axis=0)
@@ -174,17 +623,17 @@ def create_big_df():
         'year'
     ]
 
-    traffic_df = traffic_df[cols_to_keep]
+    # sort by station and year once, every per-station step below works on this layout.
+    # the stacked frames' labels repeat across years, number the rows afresh
+    kernel = GroupKernel([traffic_df[c].values for c in ID_COLS], order_by=traffic_df['year'].values)
+    traffic_df = traffic_df[cols_to_keep].take(kernel.order).reset_index(drop=True)
+    # the trends only fit the years a station was actually counted in, keep them before filling
+    counted_adt = traffic_df.average_daily_traffic.values.astype('float64')
     for col in cols_to_keep:
-        traffic_df[col] = traffic_df.groupby(['station_id', 'route_identifier', 'route_number'])[col].bfill().ffill()
-
-    traffic_df = traffic_df.sort_values(['station_id', 'route_identifier', 'route_number', 'year'])
+        traffic_df[col] = kernel.fill(traffic_df[col].values)
 
     # add a bunch of values
-    traffic_df['pct_changed'] = traffic_df. \
-        groupby(['station_id', 'route_identifier', 'route_number']) \
-        ['average_daily_traffic']. \
-        pct_change()
+    traffic_df['pct_changed'] = kernel.pct_change(traffic_df.average_daily_traffic.values)
     
     traffic_df['route_type'] = traffic_df.route_type.str.replace('-', '')
     traffic_df['route'] = traffic_df.route_type + '-' + traffic_df.route_number.astype('int').astype('str')
@@ -193,13 +642,256 @@ def create_big_df():
     traffic_df.loc[traffic_df.route_number == 385, ['route_type', 'route_type_number']] = 'I', 1
     traffic_df['log_adt'] = np.log(traffic_df.average_daily_traffic)
     traffic_df['log10_adt'] = np.log10(traffic_df.average_daily_traffic)
-    traffic_df['total_pct_change'] = traffic_df\
-        .sort_values(['station_id', 'route_identifier', 'route_number', 'year'])\
-        .groupby(['station_id', 'route_identifier', 'route_number'])\
-        .average_daily_traffic\
-        .transform(lambda x: ((x.values[-1] - x.values[0]) / x.values[0]) * 100)
-    
+    traffic_df['total_pct_change'] = kernel.total_pct_change(traffic_df.average_daily_traffic.values)
+
+    # log-linear growth fit of every station at once
+    for name, values in station_trends(kernel.start, traffic_df.year.values, counted_adt).items():
+        traffic_df['trend_' + name] = values
+
+    return traffic_df
+
+
+def save_outputs(traffic_df, out_path=BIGFRAME_PATH, snapshot_dir=SNAPSHOT_DIR, partition_dir=None,
+                 route_layer_path=ROUTE_LAYER_PATH):
+    """Write everything built from the traffic dataframe: the pickle, and what the app reads.
+
+    Args:
+        traffic_df (pandas DataFrame): the output of combine_year_dfs or combine_new_year
+        out_path (str): where to write the pickled dataframe, with its version next to it
+            in out_path + '.json'
+        snapshot_dir (str): where to write the memory-mapped snapshot, or None to skip it
+        partition_dir (str): where to write the dataset partitioned by year and county,
+            or None to skip it
+        route_layer_path (str): where to write the newest year's simplified route lines,
+            or None to skip it
+
+    """
     print('saving as pickle file')
-    traffic_df.to_pickle('./data/bigframe.pkl')
+    traffic_df.to_pickle(out_path)
+    _write_json(out_path + '.json', {'version': BIGFRAME_VERSION})
+    if snapshot_dir is not None or partition_dir is not None:
+        compact_df = compact_frame(traffic_df)
+        print(memory_report(traffic_df, compact_df))
+    if snapshot_dir is not None:
+        print('saving memory-mapped snapshot')
+        write_snapshot(compact_df, snapshot_dir)
+    if partition_dir is not None:
+        print('saving partitioned dataset')
+        write_partitions(compact_df, partition_dir)
+    if route_layer_path is not None:
+        print('saving route layer')
+        RouteLayer.build(traffic_df[traffic_df.year == traffic_df.year.max()]).save(route_layer_path)
     print('donezo')
 
+
+def create_big_df(shp_dir=SHP_DIR, out_path=BIGFRAME_PATH, cache_dir=CACHE_DIR, workers=None,
+                  snapshot_dir=SNAPSHOT_DIR, partition_dir=None, route_layer_path=ROUTE_LAYER_PATH):
+    """Build the multi-year traffic dataframe and save it as a pickle and a snapshot.
+
+    Each year is cleaned on its own and cached under cache_dir, so a rebuild only
+    re-reads the years whose source files changed; the cross-year steps always rerun.
+
+    Args:
+        shp_dir (str): directory holding one dbf file per year
+        out_path (str): where to write the pickled dataframe
+        cache_dir (str): directory holding the per-year cache, or None to disable it
+        workers (int): max number of processes used to read changed years
+        snapshot_dir (str): where to write the memory-mapped snapshot, or None to skip it
+        partition_dir (str): where to write the dataset partitioned by year and county,
+            or None to skip it
+        route_layer_path (str): where to write the newest year's simplified route lines,
+            or None to skip it
+
+    """
+    # read GIS dbf data into dataframes, one file for each year between 2009 and 2018
+    shp_dfs_renamed = load_year_dfs(shp_dir, cache_dir, workers)
+    traffic_df = combine_year_dfs(shp_dfs_renamed)
+    
+    save_outputs(traffic_df, out_path, snapshot_dir, partition_dir, route_layer_path)
+
+
+def station_rows(df, keys):
+    """Find the rows of some stations.
+
+    Args:
+        df (pandas DataFrame): a frame with the ID_COLS columns
+        keys (pandas MultiIndex): the stations' ID_COLS values
+    Returns:
+        mask (numpy array): True for the matching rows
+
+    """
+    ids = pd.MultiIndex.from_arrays([df[c].values for c in ID_COLS])
+    return ids.isin(keys)
+
+
+def combine_new_year(traffic_df, shp_dfs_renamed, year):
+    """Splice a new year into the output of combine_year_dfs, recomputing only the stations it touches.
+
+    Only the stations in the new year, and in the reference year before and after it,
+    get different attributes or derived columns, so only their rows are recomputed and
+    the rest of traffic_df is kept as it is. The result is the same as running
+    combine_year_dfs over every year.
+
+    Args:
+        traffic_df (pandas DataFrame): combine_year_dfs' output for every year but the new one
+        shp_dfs_renamed (dict): year string -> cleaned dataframe, for every year including the new one
+        year (str): the year being added
+    Returns:
+        traffic_df (pandas DataFrame): combine_year_dfs' output for every year
+
+    """
+    old_reference = reference_year(y for y in shp_dfs_renamed if y != year)
+    new_reference = reference_year(shp_dfs_renamed)
+    # a new reference year moves the attribute overwrite off the old one's stations too
+    touched_years = [year] if new_reference == old_reference else [year, old_reference]
+    touched = pd.concat([shp_dfs_renamed[y][ID_COLS] for y in touched_years])
+    # clean_year_df already dropped the rows with a missing key
+    touched = pd.MultiIndex.from_frame(touched.drop_duplicates())
+    print('recomputing {} stations'.format(len(touched)))
+
+    recomputed = combine_year_dfs({
+        y: df[station_rows(df, touched)] for y, df in shp_dfs_renamed.items()
+    })
+    kept = traffic_df[~station_rows(traffic_df, touched)]
+    if len(kept) < 1:
+        return recomputed
+    traffic_df = pd.concat([kept, recomputed], sort=False)
+
+    # back into combine_year_dfs' station then year order
+    kernel = GroupKernel([traffic_df[c].values for c in ID_COLS], order_by=traffic_df['year'].values)
+    return traffic_df.take(kernel.order).reset_index(drop=True)
+
+
+def append_year(year, shp_dir=SHP_DIR, out_path=BIGFRAME_PATH, cache_dir=CACHE_DIR, snapshot_dir=SNAPSHOT_DIR,
+                partition_dir=None, route_layer_path=ROUTE_LAYER_PATH):
+    """Add a new year to the built dataframe and snapshot without rebuilding the unchanged stations.
+
+    The new year's file has to be in shp_dir next to the years out_path was built from.
+    The other years come from the per-year cache, and only the stations the new year
+    touches are recomputed, see combine_new_year. The result is the same as rebuilding
+    everything with create_big_df.
+
+    Args:
+        year (str): the year to add, as in its file name
+        shp_dir (str): directory holding one dbf file per year
+        out_path (str): the pickled dataframe to update
+        cache_dir (str): directory holding the per-year cache, or None to disable it
+        snapshot_dir (str): where to rewrite the memory-mapped snapshot, or None to skip it
+        partition_dir (str): where to rewrite the partitioned dataset, or None to skip it
+        route_layer_path (str): where to rewrite the newest year's simplified route lines,
+            or None to skip it
+    Raises:
+        ValueError: if year is already built, out_path was built by an older version, or
+            shp_dir's other years aren't the built ones
+
+    """
+    if bigframe_version(out_path) != BIGFRAME_VERSION:
+        raise ValueError('{} was built by an older version, rerun create_big_df'.format(out_path))
+    traffic_df = pd.read_pickle(out_path)
+    built = set(str(y) for y in traffic_df.year.unique())
+    year_files = find_year_files(shp_dir)
+    if year not in year_files:
+        raise ValueError('no file for {} in {}'.format(year, shp_dir))
+    if year in built:
+        raise ValueError('{} is already built, rerun create_big_df to replace it'.format(year))
+    if built != set(year_files) - {year}:
+        raise ValueError('the years in {} are not the ones {} was built from, rerun create_big_df'
+                         .format(shp_dir, out_path))
+
+    shp_dfs_renamed = load_year_dfs(shp_dir, cache_dir)
+    traffic_df = combine_new_year(traffic_df, shp_dfs_renamed, year)
+
+    save_outputs(traffic_df, out_path, snapshot_dir, partition_dir, route_layer_path)
+
+
+def load_zip_xref(path=ZIP_XREF_PATH):
+    """Read the zip code to lat/long xref.
+
+    Args:
+        path (str): the xref csv
+    Returns:
+        unique_zip (pandas DataFrame): Zip, Latitude and Longitude, one row per distinct point
+
+    """
+    zip_xref = pd.read_csv(path)
+    zip_xref['Latitude'] = zip_xref.Latitude.astype('float')
+    zip_xref['Longitude'] = zip_xref.Longitude.astype('float')
+    return zip_xref.loc[:, ['Zip', 'Latitude', 'Longitude']].drop_duplicates()
+
+
+def unique_stations(traffic_df):
+    """Get one lat/long per station from the multi-year traffic dataframe.
+
+    Args:
+        traffic_df (pandas DataFrame): the output of create_big_df
+    Returns:
+        unique_station (pandas DataFrame): ID_COLS, latitude and longitude
+
+    """
+    return traffic_df \
+        .loc[:, ID_COLS + ['latitude', 'longitude']] \
+        .drop_duplicates() \
+        .groupby(ID_COLS) \
+        .head(1)
+
+
+def station_zip_xref(unique_station, unique_zip, radius_km=16, k=None, batch_size=4096):
+    """Pair stations with the zip codes around them.
+
+    The zips go into a GridIndex and the stations are looked up in batches, so only
+    matching pairs are ever materialised instead of every station x zip combination.
+
+    Args:
+        unique_station (pandas DataFrame): ID_COLS, latitude and longitude, e.g. from unique_stations
+        unique_zip (pandas DataFrame): Zip, Latitude and Longitude, e.g. from load_zip_xref
+        radius_km (float): keep zips within this distance, None for no limit
+        k (int): keep only the k nearest zips of each station, None for all within radius_km
+        batch_size (int): stations looked up at a time
+    Returns:
+        station_zip_xref (pandas DataFrame): one row per matching pair, with ID_COLS,
+            station_lat, station_long, Zip, zip_lat, zip_long and distance_km
+
+    """
+    if radius_km is None and k is None:
+        raise ValueError('Need a radius_km, a k, or both.')
+
+    zip_index = GridIndex(unique_zip.Latitude.values, unique_zip.Longitude.values)
+    lat = unique_station.latitude.values
+    lon = unique_station.longitude.values
+    if k is None:
+        stations, zips, distance_km = zip_index.query_radius(lat, lon, radius_km, batch_size)
+    else:
+        stations, zips, distance_km = zip_index.query_knn(lat, lon, k, radius_km, batch_size)
+
+    station_part = unique_station[ID_COLS + ['latitude', 'longitude']].iloc[stations].reset_index(drop=True)
+    zip_part = unique_zip[['Zip', 'Latitude', 'Longitude']].iloc[zips].reset_index(drop=True)
+    xref = pd.concat([station_part, zip_part], axis=1)
+    xref.columns = ID_COLS + ['station_lat', 'station_long', 'Zip', 'zip_lat', 'zip_long']
+    xref['distance_km'] = distance_km
+    return xref
+
+
+def home_sales_in_radius(sales_df, station_zip_xref, radius_cutoff):
+    """Sum the home sales of the zip codes within radius_cutoff km of each station.
+
+    Args:
+        sales_df (pandas DataFrame): yearly sales with ZipCode, Year and Sales
+        station_zip_xref (pandas DataFrame): the output of station_zip_xref, with a radius
+            at least as large as radius_cutoff
+        radius_cutoff (float): the radius in km
+    Returns:
+        sales_per_station (pandas DataFrame): ID_COLS, Year and the summed Sales
+
+    """
+    filtered_zips = station_zip_xref.loc[station_zip_xref.distance_km <= radius_cutoff]
+    sales_per_station = filtered_zips.merge(sales_df[['ZipCode', 'Year', 'Sales']], left_on=['Zip'], right_on=['ZipCode'])
+    return sales_per_station \
+        .groupby(ID_COLS + ['Year']) \
+        .Sales \
+        .sum() \
+        .reset_index()
+
+
+if __name__ == '__main__':
+    # the full rebuild, reading changed years in a process pool
+    create_big_df()